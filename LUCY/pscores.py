@@ -10,44 +10,42 @@ Author: George Hume
 """
 
 ### IMPORTS ###
-import csv
-import numpy as np
 import datetime as dt
 import sys
 sys.path.append('..')
-from SnP_funcs import loadDB, flatten, priority_list
+from SnP_funcs import loadDB, priority_list, priority_list_lazy, save_list, StageCache, SLOW_TOPK
 
 
+Tday = dt.datetime.combine(dt.datetime.now(), dt.datetime.min.time()) #today's data at turn of the day
+fastname = f"../xOUTPUTS/TransientList_F_{Tday.strftime('%Y%m%d')}.csv"
+slowname = f"../xOUTPUTS/TransientList_S_{Tday.strftime('%Y%m%d')}.csv"
+
+#skip if the lists have already been made for today from the same TNS database and code
+cache = StageCache("pscores", files=["../xOUTPUTS/tns_public_objects.csv"], config={"slow_topk": SLOW_TOPK}, date=Tday,
+                   outputs=[fastname, slowname, "../xOUTPUTS/solar_times.json"])
+if cache.restore():
+    sys.exit()
+
 # loads in the tns database as numpy array along with the date it was released as a string and a list of the headers
 date, headers, database = loadDB("../xOUTPUTS/tns_public_objects.csv")
-#create a new list of headers for the new database (as have removed columns and added new ones)
-newHeaders = flatten([headers[0:5], [headers[12], headers[-1],headers[13], "observable_time", "lunar_sep", "galactic_latitude", "possible_host","priority_score", "fink_url"]])
-
-#line to go before headers to give context in CSV
-Tday = dt.datetime.combine(dt.datetime.now(), dt.datetime.min.time()) #today's data at turn of the day
-todaySTR = Tday.strftime('%Y-%m-%d %H:%M:%S')
-topline = [f"List calculated for {todaySTR} using TNS database from {date}"]
 
 
 # PEPPER FAST #
-fastDB = priority_list(database,date,False)
+fastDB = priority_list(database,date,False,now=Tday)
 
 #save out fast database CSV
-filename = f"../xOUTPUTS/TransientList_F_{Tday.strftime('%Y%m%d')}.csv"
-with open(filename, 'w') as file:
-    csvwriter = csv.writer(file,delimiter=",") # create a csvwriter object
-    csvwriter.writerow(topline)
-    csvwriter.writerow(newHeaders) #add headers first row
-    csvwriter.writerows(fastDB) # write the rest of the data
+save_list(fastname, fastDB, headers, Tday, date)
 
 
 # PEPPER SLOW #
-slowDB = priority_list(database,date)
+#only the top of the slow list is acted on (the email highlights it), so only it is cross-matched with the galaxy catalogues
+if SLOW_TOPK is None:
+    slowDB = priority_list(database,date,now=Tday)
+else:
+    slowDB, dummy = priority_list_lazy(database,date,topK=SLOW_TOPK,now=Tday)
 
 #save out the slow database CSV
-filename = f"../xOUTPUTS/TransientList_S_{Tday.strftime('%Y%m%d')}.csv"
-with open(filename, 'w') as file:
-    csvwriter = csv.writer(file,delimiter=",") # create a csvwriter object
-    csvwriter.writerow(topline)
-    csvwriter.writerow(newHeaders) #add headers first row
-    csvwriter.writerows(slowDB) # write the rest of the data
+save_list(slowname, slowDB, headers, Tday, date)
+
+#store the lists so this can be skipped if run again with nothing changed
+cache.save()
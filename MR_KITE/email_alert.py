@@ -5,9 +5,6 @@ Author: George Hume
 2023
 """
 
-import smtplib
-from email import encoders
-from email.mime.base import MIMEBase
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.image import MIMEImage
@@ -19,7 +16,13 @@ import json
 import sys
 import glob
 sys.path.append('..')
-from SnP_funcs import loadDB, csv2list, array2html, visplots, LTcoords
+from SnP_funcs import loadDB, LTcoords, StageCache
+from SnP_email import csv2list, array2html, spool_email, send_outbox, list_attachments
+from SnP_plots import visplots_async, visplots_path
+
+attach_budget = 5_000_000 #maximum total size in bytes of the priority lists attached to the email
+plot_budget = 2_000_000 #maximum size in bytes of the visibility plots
+plot_fmt = "png" #format of the visibility plots
 
 #list of emails addresses to send the email to as CSV file
 correspondents = csv2list("correspondents.csv")
@@ -41,10 +44,22 @@ dummy, headers, fastDB = loadDB(fastlist)
 plists.append(slowlist)
 plists.append(fastlist)
 
+date = datetime.now().strftime('%Y-%m-%d') #date to put in the subject
+htmlpath = f"{fastlist[0:-4]}.html" #path for HTML table (or message saying it doesn't exisit)
+
+#skip making the email if it has already been made today from the same lists (only send anything left in the outbox)
+cache = StageCache("email_alert", files=plists + ["correspondents.csv", "email.html"], date=date,
+                   config={"attach_budget": attach_budget, "plot_budget": plot_budget, "plot_fmt": plot_fmt},
+                   outputs=[htmlpath, visplots_path(plot_fmt)])
+if cache.restore():
+    with open('email_creds.json') as json_file:
+        send_outbox(json.load(json_file))
+    sys.exit()
+
 ### Make the attachments and return paths ###
 
-vispath = visplots(plists) #visiblity plots of highest priority targets in both lists
-htmlpath = f"{fastlist[0:-4]}.html" #path for HTML table (or message saying it doesn't exisit)
+#visiblity plots of highest priority targets in both lists (drawn in the background while the email is made)
+visplot = visplots_async(plists, dpi=150, fmt=plot_fmt, budget=plot_budget)
 
 if fastDB.size == 0:
     #if no transients met the requirements replace table with notice
@@ -65,13 +80,13 @@ else:
     hsts = np.char.replace(hosts, '+', '%2B')
     hsts = np.char.replace(hsts, ' ', '+') #used to make NED links work
     hs = np.char.replace(hosts, 'None', '') #used to make None entries not clickable
-    for p in range(hosts.size):
-        if "GLADE" in hosts[p]:
-            #if a glade name then link to ViziR
-            fastDB.T[-3][p] = '<a href=' + "http://vizier.cds.unistra.fr/viz-bin/VizieR-5?-ref=VIZ6450d83424009d&-out.add=.&-source=VII/291/gladep&recno=" +  hsts[p].split("+")[-1] + '><div>' + hsts[p] +'</div></a>'
-        else:
-            #if other name link to the NED
-            fastDB.T[-3][p] = '<a href=' + "https://ned.ipac.caltech.edu/byname?objname=" + hsts[p]  + '><div>' + hs[p] +'</div></a>'
+    glade = np.char.find(hosts, "GLADE") != -1
+    #if a glade name then link to ViziR, if other name link to the NED
+    href = np.where(glade,
+                    np.char.add("http://vizier.cds.unistra.fr/viz-bin/VizieR-5?-ref=VIZ6450d83424009d&-out.add=.&-source=VII/291/gladep&recno=", np.char.rpartition(hsts, "+")[:,2]),
+                    np.char.add("https://ned.ipac.caltech.edu/byname?objname=", hsts))
+    text = np.where(glade, hsts, hs)
+    fastDB.T[-3] = np.char.add(np.char.add(np.char.add(np.char.add('<a href=', href), '><div>'), text), '</div></a>')
 
     fastDB = fastDB.astype(str)
     array2html(headers,fastDB,htmlpath) #html table of fast list
@@ -81,8 +96,6 @@ if slowDB.size == 0:
     with open(htmlpath, "w") as file:
         file.write("<p><font color=#FF0000><em> No transients met the requirements for either PEPPER Fast or Slow tonight. </em></font></p><br>")
 
-date = datetime.now().strftime('%Y-%m-%d') #date to put in the subject
-
 with open('email.html', 'r') as file: #reads in text to put in body of the email
 	words = file.read()
 
@@ -112,6 +125,10 @@ with open(htmlpath,"r") as file:
 	table = file.read()
 fulltxt = words + "<br><hr> <b> PEPPER Fast List </b> <br><br>" + table
 
+#priority lists to attach (compressed, or the top of each list added to the email, if they are too big)
+list_parts, summary = list_attachments(plists, attach_budget)
+fulltxt += summary
+
 message = MIMEMultipart()
 message['Subject'] = f"High Priority Transients for Night Starting {date}"
 message['From'] = "SALT&PEPPER Pipeline"
@@ -120,31 +137,23 @@ html_part = MIMEText(fulltxt,'html')
 message.attach(html_part)
 
 #attach visiblity plots
+vispath = visplot.result() #wait for plots to be finished
 with open(vispath, 'rb') as f:
     imagepart = MIMEImage(f.read())
 message.attach(imagepart)
 
-for plist in plists:
-    with open(plist, "rb") as attachment:
-    # Add the attachment to the message
-        part = MIMEBase("application", "octet-stream")
-        part.set_payload((attachment).read())
-    encoders.encode_base64(part)
-    part.add_header("Content-Disposition",f"attachment; filename= {os.path.basename(plist)}")
+for part in list_parts:
     message.attach(part)
 
 
 ### SEND EMAIL ###
-try:
-    #email credentials
-    with open('email_creds.json') as json_file:
-        creds = json.load(json_file)
-    #set up email
-    smtpObj = smtplib.SMTP_SSL('smtp.gmail.com', 465)
-    smtpObj.login(creds["email"],creds["password"])
+#save the email to the outbox so it isn't lost if sending fails
+spool_email(message, correspondents)
+cache.save() #the email is in the outbox so doesn't need to be made again
 
-    smtpObj.sendmail(creds["email"], correspondents, message.as_string())
-    print("email sent")
+#email credentials
+with open('email_creds.json') as json_file:
+    creds = json.load(json_file)
 
-except:
-    print("email failed")
+#send everything in the outbox (including any emails that failed on earlier runs) over one connection
+send_outbox(creds)
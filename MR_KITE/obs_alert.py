@@ -5,7 +5,6 @@ Author: George Hume
 2023
 """
 
-import smtplib
 from email import encoders
 from email.mime.base import MIMEBase
 from email.mime.multipart import MIMEMultipart
@@ -19,7 +18,8 @@ import json
 import sys
 import glob
 sys.path.append('..')
-from SnP_funcs import loadDB, csv2list, array2html
+from SnP_funcs import load_requests, load_observations, OBSERVATIONS, StageCache
+from SnP_email import csv2list, array2html, spool_email, send_outbox
 
 #list of emails addresses to send the email to as CSV file
 correspondents = csv2list("correspondents.csv")
@@ -28,17 +28,22 @@ correspondents = csv2list("correspondents.csv")
 yesterday = (dt.datetime.utcnow() - dt.timedelta(days=1))
 date = yesterday.strftime('%Y-%m-%d')
 
+#skip making the email if it has already been made from the same observations and requests (only send anything left in the outbox)
+cache = StageCache("obs_alert", files=["../RITA/fail.txt", "correspondents.csv", "obs_email.html"] + glob.glob("../xOUTPUTS/*spliced.log"),
+                   config={"requests": load_requests(date), "observations": load_observations(date)[1].tolist()}, date=date)
+if cache.restore():
+    with open('email_creds.json') as json_file:
+        send_outbox(json.load(json_file))
+    sys.exit()
+
 #if connection did not fail on both or either of the requests then...
 if len(glob.glob("../RITA/fail.txt")) == 0:
-    #load in CSV containing all PEPPER observations
-    obspath = "../xOUTPUTS/observations.csv"
-    dummy, headers, DB = loadDB(obspath)
-
-    #check if yesterday's date is in database
-    if date in DB.T[0]:
-        #extract rows from the database corresponding just to yesterday's date
-        DBmsk = DB.T[0] == date #make mask to removes dates other than one we want
-        DByd = DB[DBmsk] #apply mask
+    #load in the rows of the CSV containing all PEPPER observations for yesterday's date
+    obspath = OBSERVATIONS
+    headers, DByd = load_observations(date)
+
+    #check if there were observations for yesterday's date
+    if DByd.size != 0:
         DByd = np.delete(DByd, 0, 1) #delete date column
 
         htmlpath = f"../xOUTPUTS/observations_{yesterday.strftime('%Y%m%d')}.html"
@@ -56,14 +61,13 @@ if len(glob.glob("../RITA/fail.txt")) == 0:
 else:
     #if connection failed on both nights then show the requests that were made for the past night
 
-    #load the request record
-    with open("../xOUTPUTS/request_records.json","r") as r:
-        allreqs = json.load(r)
+    #load the requests for the past night
+    yd_reqs = load_requests(date)
 
-    if date in allreqs.keys():
-        #open requests for past night and convert the dict to a string to
+    if len(yd_reqs) != 0:
+        #convert the dict of requests for past night to a string to
         #add to email (with html line breaks)
-        reqs = "<pre>"+json.dumps(allreqs[date],indent=4).replace("\n","<br>")+"</pre>"
+        reqs = "<pre>"+json.dumps(yd_reqs,indent=4).replace("\n","<br>")+"</pre>"
     else:
         #if can't open then no requests were made
         reqs = "No requests made on the previous night."
@@ -107,17 +111,13 @@ else:
 
 
 ### SEND EMAIL ###
-try:
-    #email credentials
-    with open('email_creds.json') as json_file:
-        creds = json.load(json_file)
-    #set up email
-    smtpObj = smtplib.SMTP_SSL('smtp.gmail.com', 465)
-    smtpObj.login(creds["email"],creds["password"])
+#save the email to the outbox so it isn't lost if sending fails
+spool_email(message, correspondents)
+cache.save() #the email is in the outbox so doesn't need to be made again
 
-    smtpObj.sendmail(creds["email"], correspondents, message.as_string())
-    print("email sent")
+#email credentials
+with open('email_creds.json') as json_file:
+    creds = json.load(json_file)
 
-except Exception as e:
-    print(e)
-    print("email failed")
+#send everything in the outbox (including any emails that failed on earlier runs) over one connection
+send_outbox(creds)
@@ -0,0 +1,17 @@
+"""
+Script that tidies up the journal of requests made to the LT once a week, rewriting it so only the latest
+version of each request is kept (older versions are left behind whenever a request's record is updated).
+
+Author: George Hume
+2023
+"""
+
+### IMPORTS ###
+import datetime as dt
+import sys
+sys.path.append('..')
+from SnP_funcs import compact_requests
+
+if dt.datetime.utcnow().weekday() == 6: #only on Sundays
+    compact_requests()
+    print("Request records compacted.")
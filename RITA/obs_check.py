@@ -6,41 +6,37 @@ Author: George Hume
 """
 
 ### IMPORTS ###
-import numpy as np
 import datetime as dt
 import json
-import subprocess
-import time
 import csv
 import sys
 sys.path.append('..')
-from SnP_funcs import loadDB
+from SnP_funcs import poll_log, match_log, load_requests, load_observations, save_observations, EXP_TIME
+from SnP_schedule import blacklist_add
 
 #DATES
 today = dt.datetime.utcnow()
 yesterday = today - dt.timedelta(days=1)
 
 #check if the checks have already been performed
-obspath = "../xOUTPUTS/observations.csv"
-dummy, dummy2, DB = loadDB(obspath)
+dummy, done = load_observations(yesterday.strftime('%Y-%m-%d'))
 
-if yesterday.strftime('%Y-%m-%d') in DB:
+if done.size != 0:
     print("Last night's observation requests have already been checked.")
 
 else:
-    #load in observation file
-    with open("../xOUTPUTS/request_records.json","r") as fp:
-        allobs = json.load(fp)
+    #load in requests made for last night
+    yd_reqs = load_requests(yesterday.strftime('%Y-%m-%d'))
 
     try: #try to extract request 1 status from last night
-        req1 = allobs[yesterday.strftime('%Y-%m-%d')]["Request-1"]
+        req1 = yd_reqs["Request-1"]
         req1S = req1["status"]
     except:
         req1S = "Connection to LT failed."
         #if request not present so treat as non-connection to LT
 
     try: #try to extract request 2 status from last night
-        req2 = allobs[yesterday.strftime('%Y-%m-%d')]["Request-2"]
+        req2 = yd_reqs["Request-2"]
         req2S = req2["status"]
     except:
         req2S = "Connection to LT failed."
@@ -71,86 +67,38 @@ else:
             else:
                 uid = rqst["uid"]
                 for entry in rqst['targets']:
-                    rtargets.append((entry['name'],uid))
-
-        if len(rtargets) != 0:
-            #if there were targets requested
-            released = False
-            while released == False:
-                ### Try to download LT log for the previous night using curl ###
-                cmd = f'curl -s https://telescope.livjm.ac.uk/data/archive/webfiles/Logs/lt//{yesterday.strftime("%Y%m%d")}.log > ../xOUTPUTS/LT{yesterday.strftime("%Y%m%d")}.log'
-                subprocess.call(cmd,shell=True)
-
-                #open log and read all lines to a list
-                with open(f"../xOUTPUTS/LT{yesterday.strftime('%Y%m%d')}.log") as L:
-                    Log = L.readlines()
-
-                #if the log has not been released yet wait 30mins and try again
-                if "<p>The requested URL was not found on this server.</p>\n" in Log:
-                    released = False
-                    time.sleep(1800)
-                else:
-                    released = True
+                    #targets requested separately have their own uid
+                    rtargets.append((entry['name'],entry.get('uid',uid)))
 
+        if len(rtargets) == 0:
+            print("No targets were requested last night so there is nothing to check.")
 
+        else:
             #exp-time requested
             with open('obs_prams.json') as json_file:
                 obs_prams = json.load(json_file)
-            r_texp = float(obs_prams['exp_time'])
+            r_texp = float(obs_prams['exp_time']) if str(obs_prams['exp_time']).strip() != "" else EXP_TIME
 
             #load in proposal name from LT credentials
             with open('LT_creds.json') as json_file:
                 propID = json.load(json_file)["proposal"]
 
-            observations = [] #blank list which will contain the contents for the csv
-            slog = [] #empty list to contain all log rows that contain our targets
-
-            #extract all rows for each target if it is in the log
-            for target in rtargets:
-                trows = [] #empty list to store all the rows corresponding to this target
-                for row in Log:
-                    if (target[0] in row) and (target[1] in row):
-                        #if target name and UID is this row then its our obs so add to list
-                        trows.append(row.split()) #split row string into a list
-                        slog.append(row)
-                trows = np.array(trows)
-
-                if trows.size == 0:
-                    #if target was not observed
-                    observed = False
-                    pc = 0
-                    fname_root = "n/a"
-                    propid = propID
-                    groupid = target[1]
-
-                else:
-                    observed = True
-
-                    #calculate percentage of observations completed
-                    total_exp = sum(trows.T[10].astype(float))
-                    pc = total_exp/r_texp
-
-                    if pc >= 1:
-                        #if the target has been observed for full time requested
-                        with open("blacklist.csv","a") as blist:
-                            #append name to black list to avoid repeats
-                            blist.write(f"{target[0]}\n")
-
-                    #extract proposal and group ids from the first log entry for the target
-                    propid = trows.T[2][0]
-                    groupid = trows.T[14][0] #group id should be same as the uid
-
-                    #extract the root file name from the first log entry for the target
-                    split_fname = trows.T[13][0].split("_") #split using underscores
-                    fname_root = f"{split_fname[1]}_{split_fname[2]}_{split_fname[3]}"
-
-                #add target's info to list
-                observations.append([yesterday.strftime('%Y-%m-%d'), propid, groupid, target[0][0:2],target[0][2:],observed,fname_root])
+            #everything else is ready so wait for the log to be released (this script runs in the background so nothing waits on it)
+            logpath = f"../xOUTPUTS/LT{yesterday.strftime('%Y%m%d')}.log"
+            Log = poll_log(yesterday.strftime("%Y%m%d"), logpath)
+
+            if Log is None:
+                print("Last night's observation requests could not be checked as the LT log was not released.")
+                sys.exit()
+
+            #find which targets were observed from one pass through the log
+            observations, slog, completed = match_log(Log, rtargets, r_texp, propID, yesterday.strftime('%Y-%m-%d'))
+
+            #add targets that have been observed for full time requested to black list to avoid repeats
+            blacklist_add(completed)
 
             #save observations array to the CSV containing info on all data at top and headers
-            with open(f"../xOUTPUTS/observations.csv",'a') as obs:
-                csvwriter = csv.writer(obs,delimiter=",")
-                csvwriter.writerows(observations)
+            save_observations(observations)
 
             #save log spliced to only contain our targets
             #get headers from the log file
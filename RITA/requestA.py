@@ -11,26 +11,20 @@ import json
 import sys
 import glob
 sys.path.append('..')
-from SnP_funcs import csv2list, request
+from SnP_funcs import load_requests, save_request
+from SnP_schedule import load_blacklist, request
 
 now = dt.datetime.utcnow()
 yesterday = now - dt.timedelta(days=1)
 yd_str = yesterday.strftime('%Y-%m-%d')
 
-#load in obs_requests.json
-if len(glob.glob("../xOUTPUTS/request_records.json")) != 0:
-    with open("../xOUTPUTS/request_records.json","r") as fp:
-        allreqs = json.load(fp)
-else: #if it doesn't exist create a new one
-    allreqs = {}
+#load in the requests already made for this night
+yd_reqs = load_requests(yd_str)
 
 
 #check if request A for today has already been made
-if yd_str in allreqs.keys(): #check if the date exists in record
-    if "Request-2" in allreqs[yd_str].keys(): #check if previous request made
-        request_made = True
-    else:
-        request_made = False
+if "Request-2" in yd_reqs.keys(): #check if previous request made
+    request_made = True
 else:
     request_made = False
 
@@ -41,23 +35,22 @@ else:
     ## Set up black list ##
 
     # load in the black list
-    blist = csv2list("blacklist.csv")
+    blist = load_blacklist()
 
     # add observations that have already been requested for this night to the black list
-    if (yd_str not in allreqs.keys()):
+    if ("Request-1" not in yd_reqs.keys()):
         print("No request made yet for this night as date is not listed.")
 
-    elif allreqs[yd_str]["Request-1"]["status"] == "Connection to LT failed.":
+    elif yd_reqs["Request-1"]["status"] == "Connection to LT failed.":
         print("No request made yet for this night as LT connection failed")
 
-    elif allreqs[yd_str]["Request-1"]["status"] == "No requests made.":
+    elif yd_reqs["Request-1"]["status"] == "No requests made.":
         print("No request made yet for this night as previous priority list was empty")
 
     else:
         #load in previous targets requested for this night
-        prev_tars = allreqs[yd_str]["Request-1"]["targets"]
-        for tar in prev_tars: #append each name to black list
-            blist.append(tar["name"])
+        prev_tars = yd_reqs["Request-1"]["targets"]
+        blist.update(tar["name"] for tar in prev_tars) #add each name to black list
 
 
     ## Set up start and end times of observations ##
@@ -80,14 +73,7 @@ else:
 
     ## try to make requests using the most recent PEPPER fast list ##
     pep_fast = glob.glob("../xOUTPUTS/TransientList_F*.csv")[0]
-    req_morn = request(pep_fast,blist,req_times)
-
-    #write out new request record
-    if yd_str in allreqs.keys(): #check if the date exists in record
-        allreqs[yd_str]["Request-2"] = req_morn
-    else: #if doesn't have to make new date entry
-        reqA = {}
-        reqA["Request-2"] = req_morn
-        allreqs[yd_str] = reqA
-    with open("../xOUTPUTS/request_records.json","w") as fp:
-        json.dump(allreqs, fp, indent=4)
+    req_morn = request(pep_fast,blist,req_times,per_target=True) #each target gets its own slot in the schedule
+
+    #add new request to the records
+    save_request(yd_str, "Request-2", req_morn)
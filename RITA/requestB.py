@@ -11,23 +11,19 @@ import json
 import sys
 import glob
 sys.path.append('..')
-from SnP_funcs import csv2list, request
+from SnP_funcs import load_requests, save_request
+from SnP_schedule import load_blacklist, request
 
 now = dt.datetime.utcnow()
 td_str = now.strftime('%Y-%m-%d')
 
-#load in obs_requests.json - will exist as request A runs before this
-with open("../xOUTPUTS/request_records.json","r") as fp:
-    allreqs = json.load(fp)
-
-
 #check if request B for today has already been made
-if td_str in allreqs.keys(): #will have been if today's date is in records json
+if len(load_requests(td_str)) != 0: #will have been if today's date is in records
     print("Request B has already been made to LT today.")
 
 else:
     ## load in the black list ##
-    blist = csv2list("blacklist.csv")
+    blist = load_blacklist()
 
 
     ## Set up start and end times of observations ##
@@ -50,11 +46,7 @@ else:
 
     ## try to make requests using the most recent PEPPER fast list ##
     pep_fast = glob.glob("../xOUTPUTS/TransientList_F*.csv")[0]
-    req_night = request(pep_fast,blist,req_times)
-
-    #write out new request record
-    reqB = {}
-    reqB["Request-1"] = req_night
-    allreqs[td_str] = reqB
-    with open("../xOUTPUTS/request_records.json","w") as fp:
-        json.dump(allreqs, fp, indent=4)
+    req_night = request(pep_fast,blist,req_times,per_target=True) #each target gets its own slot in the schedule
+
+    #add new request to the records
+    save_request(td_str, "Request-1", req_night)
@@ -0,0 +1,509 @@
+"""
+Downloading the observed data from the LT archive and indexing their FITS headers.
+
+Author: George Hume
+2023
+"""
+
+### IMPORTS ###
+import csv
+import json
+import time
+import datetime as dt
+from astropy.io import fits
+import os
+import glob
+import requests
+from concurrent.futures import ThreadPoolExecutor
+import re
+from urllib.parse import urljoin, unquote
+import shutil
+import tarfile
+from SnP_metrics import counted_session, timed
+from SnP_funcs import OBSERVATIONS, _obs_index, _read_rows, _write_atomic, file_checksum, loadDB
+
+######################### FUNCTIONS FOR DOWNLOADING DATA #######################
+
+LT_ARCHIVE_URL = "https://telescope.ljmu.ac.uk/DataProd/RecentData/" #where the LT releases new data for each proposal
+
+def archive_session(propID, psswrd):
+    """
+    Sets up a session logged in to the LT archive which is reused for every file of a proposal.
+    Arguments:
+        - propID: the proposal ID (also the username for the LT archive)
+        - psswrd: the password for the LT archive for this proposal
+    Outputs:
+        - session: requests Session object with the log in details
+    """
+    session = counted_session()
+    session.auth = (propID, psswrd)
+    return session
+
+################################################################################
+
+def list_archive(session, url, ext=".tgz", timeout=60):
+    """
+    Lists the files in a directory of the LT archive.
+    Arguments:
+        - session: requests Session logged in to the archive (see archive_session)
+        - url: address of the directory
+        - ext: only files ending in this are listed (default is ".tgz")
+        - timeout: seconds to wait for the archive to respond (default is 60)
+    Outputs:
+        - files: list of the addresses of the files (None if the directory couldn't be listed)
+    """
+
+    try:
+        r = session.get(url, timeout=timeout)
+        if r.status_code == 404:
+            return [] #nothing released for this night
+        r.raise_for_status()
+    except requests.RequestException as e:
+        print(f"Could not list {url}: {e}")
+        return None
+
+    #links in the directory index page
+    links = re.findall(r'href="([^"?]+)"', r.text)
+    files = [urljoin(url, link) for link in links if link.endswith(ext)]
+
+    return list(dict.fromkeys(files)) #removes repeats, keeping the order
+
+################################################################################
+
+def _range_total(r):
+    """
+    Gets the full size of a file from the Content-Range header of a response to a Range request (None if it isn't given).
+    """
+    total = r.headers.get("Content-Range", "").rsplit("/", 1)[-1].strip()
+    return int(total) if total.isdigit() else None
+
+
+def download_file(session, url, path, retries=3, backoff=5, timeout=60, chunk=1<<20):
+    """
+    Downloads a file, carrying on from where it stopped if part of it was already downloaded. The ETag (or
+    Last-Modified) of the file a partial download came from is kept next to it ({path}.validator) and sent as
+    If-Range, so if the file has changed in the archive since then the whole file is downloaded again instead.
+    Arguments:
+        - session: requests Session logged in to the archive (see archive_session)
+        - url: address of the file
+        - path: path to save the file to
+        - retries: number of times to try (default is 3)
+        - backoff: seconds to wait after the first failed try, doubled after each one (default is 5)
+        - timeout: seconds to wait for the archive to respond (default is 60)
+        - chunk: size in bytes of the pieces the file is written in (default is 1MB)
+    Outputs:
+        - done: True if the whole file was downloaded, False if not
+    """
+
+    vpath = f"{path}.validator"
+
+    for attempt in range(retries):
+        have = os.path.getsize(path) if os.path.isfile(path) else 0
+        headers = {}
+        if have > 0:
+            headers["Range"] = f"bytes={have}-"
+            if os.path.isfile(vpath):
+                with open(vpath) as fp:
+                    headers["If-Range"] = fp.read().strip()
+
+        try:
+            with session.get(url, headers=headers, stream=True, timeout=timeout) as r:
+                if (r.status_code == 416) and (have > 0):
+                    #asked for bytes past the end of the file, so check the partial file is the whole file
+                    size = _range_total(r)
+                    if size is None:
+                        h = session.head(url, timeout=timeout, allow_redirects=True)
+                        size = int(h.headers["Content-Length"]) if h.ok and ("Content-Length" in h.headers) else None
+                    if size == have:
+                        if os.path.isfile(vpath):
+                            os.remove(vpath)
+                        return True
+                    os.remove(path) #bigger than (or can't be checked against) the file in the archive so start again
+                    raise IOError(f"partial file is {have} bytes but the file in the archive is {size} bytes")
+
+                r.raise_for_status()
+
+                if r.status_code == 206: #carrying on from where it stopped
+                    mode, size = "ab", _range_total(r)
+                else: #server sent the whole file (e.g., if it changed since the partial download)
+                    mode, size = "wb", int(r.headers.get("Content-Length",-1))
+                    #remember which version of the file this is in case the download stops part way
+                    etag = r.headers.get("ETag", "")
+                    validator = etag if (etag != "") and not etag.startswith("W/") else r.headers.get("Last-Modified", "") #If-Range needs a strong ETag
+                    if validator != "":
+                        with open(vpath, "w") as fp:
+                            fp.write(validator)
+                    elif os.path.isfile(vpath):
+                        os.remove(vpath)
+
+                with open(path, mode) as file:
+                    for block in r.iter_content(chunk):
+                        file.write(block)
+
+            if (size is None) or (size < 0) or (os.path.getsize(path) == size):
+                if os.path.isfile(vpath):
+                    os.remove(vpath)
+                return True
+            raise IOError(f"only got {os.path.getsize(path)} of {size} bytes")
+
+        except (requests.RequestException, IOError, ValueError) as e:
+            print(f"Download of {url} failed (try {attempt+1} of {retries}): {e}")
+            if attempt < retries - 1:
+                time.sleep(backoff * 2**attempt)
+
+    return False
+
+################################################################################
+
+def _file_entry(path, etag=None):
+    """
+    Makes the manifest entry (size, checksum, modification time and ETag) of a downloaded file.
+    """
+    stat = os.stat(path)
+    return {"size": stat.st_size, "sha256": file_checksum(path), "mtime": stat.st_mtime, "etag": etag}
+
+################################################################################
+
+def load_manifest(dest="../yDATA"):
+    """
+    Loads the manifest of the files that have been downloaded into the data directory ({dest}/manifest.json).
+    If the manifest has been lost it is rebuilt from the files in the data directory.
+    Arguments:
+        - dest: directory the data is saved in (default is "../yDATA")
+    Outputs:
+        - manifest: dict containing "files", the entry of each file keyed by {date}_{propID}/{file name},
+            and "nights", the date and time each {date}_{propID} was last checked in the archive
+    """
+
+    path = os.path.join(dest, "manifest.json")
+    if os.path.isfile(path):
+        with open(path) as fp:
+            return json.load(fp)
+
+    #rebuild from the data already downloaded (ETags aren't known so these files are checked by size)
+    manifest = {"files": {}, "nights": {}}
+    for night in sorted(glob.glob(os.path.join(dest, "*_*"))):
+        if not os.path.isdir(night):
+            continue
+        manifest["nights"][os.path.basename(night)] = dt.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        for fpath in sorted(glob.glob(os.path.join(night, "*"))):
+            if not os.path.isfile(fpath):
+                continue #e.g., the extracted FITS files
+            manifest["files"][os.path.relpath(fpath, dest)] = _file_entry(fpath)
+    if len(manifest["files"]) != 0:
+        print(f"Rebuilt the download manifest from {len(manifest['files'])} files in {dest}")
+        save_manifest(manifest, dest)
+
+    return manifest
+
+################################################################################
+
+def save_manifest(manifest, dest="../yDATA"):
+    """
+    Saves the manifest of the downloaded files (see load_manifest).
+    Arguments:
+        - manifest: the manifest dict
+        - dest: directory the data is saved in (default is "../yDATA")
+    Outputs:
+        - replaces {dest}/manifest.json with the manifest
+    """
+    os.makedirs(dest, exist_ok=True)
+    _write_atomic(os.path.join(dest, "manifest.json"), json.dumps(manifest, separators=(",",":")))
+
+################################################################################
+
+def verify_file(entry, path):
+    """
+    Checks a downloaded file is still the same as when it was downloaded. The checksum is only found again if
+    the file has been modified since.
+    Arguments:
+        - entry: the manifest entry of the file (see load_manifest)
+        - path: path to the file
+    Outputs:
+        - ok: True if the file is present and unchanged, False if not
+    """
+    if (entry is None) or (not os.path.isfile(path)):
+        return False
+    stat = os.stat(path)
+    if stat.st_size != entry["size"]:
+        return False
+    return (stat.st_mtime == entry["mtime"]) or (file_checksum(path) == entry["sha256"])
+
+################################################################################
+
+def _fetch(session, url, tmp, final, entry, timeout=60):
+    """
+    Downloads a file from the archive into a temporary directory unless the copy already in the data directory
+    is complete and hasn't changed in the archive (checked with a HEAD request).
+    Outputs:
+        - status: "skip" if the file was already there, "new" if it was downloaded, None if the download failed
+        - etag: the ETag of the file in the archive (or None)
+    """
+
+    etag, size = None, None
+    try:
+        r = session.head(url, timeout=timeout, allow_redirects=True)
+        if r.ok:
+            etag = r.headers.get("ETag")
+            size = int(r.headers["Content-Length"]) if "Content-Length" in r.headers else None
+    except requests.RequestException:
+        pass #just download it
+
+    if verify_file(entry, final):
+        if (etag is not None) and (entry.get("etag") is not None):
+            unchanged = etag == entry["etag"]
+        else: #no ETag to compare so use the size
+            unchanged = (size is None) or (size == entry["size"])
+        if unchanged:
+            return "skip", etag
+
+    name = os.path.basename(final)
+    if download_file(session, url, os.path.join(tmp, name), timeout=timeout):
+        return "new", etag
+    return None, etag
+
+################################################################################
+
+@timed("download_nights")
+def download_nights(jobs, creds, dest="../yDATA", url=LT_ARCHIVE_URL, workers=4, manifest=None):
+    """
+    Downloads the data of several nights and proposals from the LT archive, fetching the files in parallel.
+    Files already in the data directory are skipped if they are complete and unchanged in the archive, and
+    only new or changed files are downloaded. Each night is downloaded to its own temporary directory
+    ({dest}/.{date}_{propID}) and the files are only moved to {dest}/{date}_{propID} once every file of
+    the night is complete, and partial files left by a failed run are carried on from where they stopped.
+    Arguments:
+        - jobs: list of (date, propID) with dates as strings in the format YYYYMMDD
+        - creds: dict of the LT archive passwords for each proposal ID
+        - dest: directory the data is saved in (default is "../yDATA")
+        - url: address of the directory the LT releases data to (default is LT_ARCHIVE_URL)
+        - workers: maximum number of files downloaded at once (default is 4)
+        - manifest: manifest of the files already downloaded (default is None - i.e., load it from dest), which is
+            updated and saved
+    Outputs:
+        - results: dict of the path to the directory of each (date, propID) that is complete, None if the
+            download failed and "" if no data was released
+    """
+
+    if manifest is None:
+        manifest = load_manifest(dest)
+
+    sessions = {} #one session for each proposal
+    results, pending = {}, {}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for date, propID in jobs:
+            if propID not in sessions:
+                sessions[propID] = archive_session(propID, creds[propID])
+
+            files = list_archive(sessions[propID], f"{url.rstrip('/')}/{propID}/{date}/")
+            if files is None:
+                results[(date, propID)] = None
+                continue
+            if len(files) == 0:
+                print(f"No data released from {date} for proposal {propID}")
+                results[(date, propID)] = ""
+                continue
+
+            night = f"{date}_{propID}"
+            tmp = os.path.join(dest, f".{night}")
+            os.makedirs(tmp, exist_ok=True)
+            futures = {}
+            for f in files:
+                key = f"{night}/{unquote(f.rsplit('/',1)[-1])}"
+                futures[key] = pool.submit(_fetch, sessions[propID], f, tmp, os.path.join(dest, key), manifest["files"].get(key))
+            pending[(date, propID)] = futures
+
+        for (date, propID), futures in pending.items():
+            night = f"{date}_{propID}"
+            tmp = os.path.join(dest, f".{night}")
+            final = os.path.join(dest, night)
+            status = {key: f.result() for key, f in futures.items()}
+
+            if any(st is None for st, etag in status.values()):
+                print(f"Data download of {propID} for night {date} failed.")
+                results[(date, propID)] = None
+                continue
+
+            #everything is there so move the new files into place and add them to the manifest
+            os.makedirs(final, exist_ok=True)
+            new = 0
+            for key, (st, etag) in status.items():
+                if st == "new":
+                    os.replace(os.path.join(tmp, os.path.basename(key)), os.path.join(dest, key))
+                    manifest["files"][key] = _file_entry(os.path.join(dest, key), etag)
+                    new += 1
+                elif (etag is not None) and (manifest["files"][key].get("etag") is None):
+                    manifest["files"][key]["etag"] = etag #remember the ETag of files found when rebuilding
+            shutil.rmtree(tmp, ignore_errors=True)
+            manifest["nights"][night] = dt.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+            results[(date, propID)] = final
+            print(f"{propID} for night {date} is complete ({new} new files, {len(status)-new} already downloaded)")
+
+    save_manifest(manifest, dest)
+
+    return results
+
+################################################################################
+
+########################## FUNCTIONS FOR INDEXING DATA #########################
+
+FITS_INDEX = "../yDATA/fits_index.csv" #index of the headers of all the FITS files extracted from the downloaded data
+FITS_COLUMNS = ["night", "prop_id", "archive", "object", "uid", "filter", "rotor", "exptime", "mjd", "path", "obs_offset"]
+#header keywords of each column in the index (the first one found is used)
+FITS_KEYWORDS = {
+    "object": ["OBJECT"],
+    "uid": ["GRPUID", "GROUPID"],
+    "filter": ["FILTER1", "FILTER"],
+    "rotor": ["ROTANGLE", "MOPRPOS", "ROTSKYPA"],
+    "exptime": ["EXPTIME"],
+    "mjd": ["MJD", "MJD-OBS"],
+}
+
+def fits_header_row(path):
+    """
+    Reads the values for the FITS index from the header of a FITS file. The file is memory-mapped and only
+    the header is read, so the image data is never loaded.
+    Arguments:
+        - path: path to the FITS file
+    Outputs:
+        - values: dict of the object, UID, filter, rotor angle, exposure time and MJD (empty strings if not in the header)
+    """
+
+    with fits.open(path, memmap=True, lazy_load_hdus=True) as hdul:
+        header = hdul[0].header
+        if "OBJECT" not in header: #compressed files keep the header in the first extension
+            try:
+                header = hdul[1].header #only loads the first extension (len(hdul) would load them all)
+            except IndexError:
+                pass
+        return {col: next((header[key] for key in keys if key in header), "") for col, keys in FITS_KEYWORDS.items()}
+
+################################################################################
+
+def extract_archive(tpath, outdir, exts=(".fits", ".fits.fz", ".fit")):
+    """
+    Extracts the FITS files from a .tgz bundle in a single streaming pass and reads their headers.
+    Each file is written to a temporary name and moved into place once complete.
+    Arguments:
+        - tpath: path to the .tgz file
+        - outdir: directory to extract the FITS files into
+        - exts: extensions of the files to extract (default is (".fits", ".fits.fz", ".fit"))
+    Outputs:
+        - rows: list of dicts of the header values (see fits_header_row) and path of each FITS file extracted
+    """
+
+    os.makedirs(outdir, exist_ok=True)
+    rows = []
+
+    with tarfile.open(tpath, "r|gz") as tar: #stream mode so the bundle is only read through once
+        for member in tar:
+            if (not member.isfile()) or (not member.name.endswith(exts)):
+                continue
+
+            fpath = os.path.join(outdir, os.path.basename(member.name))
+            with tar.extractfile(member) as src, open(f"{fpath}.part", "wb") as dst:
+                shutil.copyfileobj(src, dst, 1<<20)
+            os.replace(f"{fpath}.part", fpath)
+
+            row = fits_header_row(fpath)
+            row["path"] = fpath
+            rows.append(row)
+
+    return rows
+
+################################################################################
+
+def index_data(nights, dest="../yDATA", index=FITS_INDEX, obspath=OBSERVATIONS, workers=4):
+    """
+    Extracts the FITS files from the downloaded bundles of some nights (in parallel) and adds their headers to the FITS index.
+    Bundles that are already in the index (including those found to have no FITS files) are skipped. Each FITS file is linked to the row of observations.csv
+    with the same night and root file name (by the byte offset of the row, see load_observations).
+    Arguments:
+        - nights: list of the directories of the nights in dest to index, e.g., ["20231010_PL23A01"]
+        - dest: directory the data is saved in (default is "../yDATA")
+        - index: path to the FITS index (default is FITS_INDEX)
+        - obspath: path to observations.csv (default is OBSERVATIONS)
+        - workers: maximum number of bundles extracted at once (default is 4)
+    Outputs:
+        - new_rows: list of the rows added to the index
+    """
+
+    #bundles already indexed
+    done = set()
+    if os.path.isfile(index):
+        dummy, dummy2, old = loadDB(index)
+        done = set(old.T[2]) if old.size != 0 else set()
+
+    #byte offsets of the rows of observations.csv for these nights by night and root file name
+    links = {}
+    oindex = _obs_index(obspath)
+    for night in nights:
+        date = night.split("_", 1)[0]
+        offsets = oindex["dates"].get(f"{date[:4]}-{date[4:6]}-{date[6:]}", [])
+        for offset, entry in zip(offsets, _read_rows(obspath, offsets)):
+            if entry[6] != "n/a":
+                links[(date, entry[6])] = offset
+
+    jobs = []
+    for night in nights:
+        date, propID = night.split("_", 1)
+        for tpath in sorted(glob.glob(os.path.join(dest, night, "*.tgz"))):
+            if os.path.relpath(tpath, dest) not in done:
+                jobs.append((date, propID, tpath))
+
+    new_rows = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(extract_archive, tpath, os.path.join(dest, f"{date}_{propID}", "fits")) for date, propID, tpath in jobs]
+        for (date, propID, tpath), future in zip(jobs, futures):
+            try:
+                rows = future.result()
+            except (tarfile.TarError, OSError) as e:
+                print(f"Could not extract {tpath}: {e}")
+                continue
+            for row in rows:
+                root = "_".join(os.path.basename(row["path"]).split("_")[1:4]) #e.g., e_20231010_12
+                row.update(night=date, prop_id=propID, archive=os.path.relpath(tpath, dest), obs_offset=links.get((date, root), -1))
+                new_rows.append([row[col] for col in FITS_COLUMNS])
+            if len(rows) == 0:
+                #record bundles without any FITS files too (with no path) so they aren't extracted again
+                row = dict.fromkeys(FITS_COLUMNS, "")
+                row.update(night=date, prop_id=propID, archive=os.path.relpath(tpath, dest), obs_offset=-1)
+                new_rows.append([row[col] for col in FITS_COLUMNS])
+
+    #append to the index (with a description and headers at the top like the other CSVs)
+    if len(new_rows) != 0:
+        new = not os.path.isfile(index)
+        with open(index, "a") as file:
+            csvwriter = csv.writer(file, delimiter=",")
+            if new:
+                file.write("Headers of the FITS files extracted from the LT data.\n")
+                csvwriter.writerow(FITS_COLUMNS)
+            csvwriter.writerows(new_rows)
+        nfits = sum(1 for row in new_rows if row[FITS_COLUMNS.index("path")] != "")
+        print(f"Indexed {nfits} FITS files from {len(jobs)} bundles")
+
+    return new_rows
+
+################################################################################
+
+def query_index(index=FITS_INDEX, **match):
+    """
+    Finds the FITS files in the FITS index matching some values, e.g., query_index(object="SN2023abc", filter="R").
+    The rows recording bundles without any FITS files are left out.
+    Arguments:
+        - index: path to the FITS index (default is FITS_INDEX)
+        - match: the values of the columns (see FITS_COLUMNS) that have to match
+    Outputs:
+        - rows: numpy object array of the rows of the index that match (with the columns in the order of FITS_COLUMNS)
+    """
+
+    dummy, headers, rows = loadDB(index)
+    if rows.size == 0:
+        return rows
+
+    keep = rows.T[headers.index("path")].astype(str) != ""
+    for col, value in match.items():
+        keep &= rows.T[headers.index(col)].astype(str) == str(value)
+
+    return rows[keep]
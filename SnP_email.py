@@ -0,0 +1,316 @@
+"""
+The HTML tables of the emails and the outbox they are spooled to and sent from.
+
+Author: George Hume
+2023
+"""
+
+### IMPORTS ###
+import csv
+import json
+import time
+import numpy as np
+import datetime as dt
+import os
+import glob
+from urllib.parse import urlsplit
+import smtplib
+import gzip
+from email import encoders
+from email.mime.base import MIMEBase
+from SnP_metrics import net_call, timed
+from SnP_funcs import _write_atomic, loadDB
+
+######################### FUNCTIONS FOR EMAILS ETC. ############################
+
+def csv2list(fname):
+    """
+    This function takes in anysimple CSV file where each row contains a single entry and converts it into a list.
+    Arguments:
+        - fname: the path to the CSV file
+    Output:
+        - lst: a list where each element is a row of the CSV file
+    """
+    with open(fname) as file:
+        lst = []
+        csvreader = csv.reader(file)
+        for row in csvreader:
+            try:
+                lst.append(row[0])
+            except: #skips any blank rows
+                continue
+    return lst
+
+################################################################################
+
+#url schemes that get turned into links (same as pandas' render_links)
+URL_SCHEMES = {"file","ftp","git","git+ssh","gopher","hdl","http","https","imap","mms","nfs","nntp","prospero","rsync","rtsp","rtsps",
+               "rtspu","sftp","shttp","sip","sips","snews","svn","svn+ssh","tel","telnet","wais","ws","wss"}
+
+def _is_url(cell):
+    """
+    Checks whether a table cell is a url with a known scheme.
+    """
+    try:
+        return urlsplit(cell).scheme in URL_SCHEMES
+    except ValueError:
+        return False
+
+def _html_cell(cell):
+    """
+    Strips a table cell and turns it into a link if it is a url, like pandas' to_html(render_links=True).
+    """
+    cell = cell.strip()
+    #only cells with a ':' that start with a letter can be urls
+    if ":" in cell and cell[:1].isalpha() and _is_url(cell):
+        return f'<a href="{cell}" target="_blank">{cell}</a>'
+    return cell
+
+def array2html(headers,database,path):
+    """
+    Function converts a numpy array with headers to a html table. The table must have a column called 'name' which is the TNS name (minus the prefix) and the columnn headers must be in the second row (index 1) - the first row must be a dummy row.
+    The rows are written straight to the file with a template made once for the whole table, giving the same markup as pandas' to_html (cells holding a url, e.g. fink_url, become links like render_links=True did).
+    Arguments:
+        - headers: list of strings to be headers for html table
+        - database: the numpy array of data the html table contains
+        - path: path you want to save the html table to
+    Output:
+        - saves the HTML table to specified path
+    """
+
+    database = np.asarray(database, dtype=object).reshape(-1, len(headers)).astype(str).astype(object) #object so cells can get longer
+
+    #click tns name to take to website
+    if "name" in headers:
+        c = headers.index("name")
+        names = database[:,c].astype(str)
+        database[:,c] = np.char.add(np.char.add(np.char.add(np.char.add('<a href=https://www.wis-tns.org/object/', names), '><div>'), names), '</div></a>')
+
+    #click urls (e.g. fink_url) to open them
+    database = [[_html_cell(cell) for cell in r] for r in database.tolist()]
+
+    #template of a row of the table
+    row = "    <tr>\n" + "".join("      <td>{}</td>\n" for h in headers) + "    </tr>\n"
+
+    with open(path, "w") as file:
+        file.write('<table border="1" class="dataframe">\n  <thead>\n    <tr style="text-align: left;">\n')
+        file.writelines(f"      <th>{h}</th>\n" for h in headers)
+        file.write("    </tr>\n  </thead>\n  <tbody>\n")
+        file.writelines(row.format(*r) for r in database)
+        file.write("  </tbody>\n</table>")
+
+########################## FUNCTIONS FOR SENDING EMAILS ########################
+
+OUTBOX = "outbox" #directory emails are kept in until they have been sent (in MR_KITE)
+
+def list_attachments(paths, budget=None, top=10, level=9):
+    """
+    Makes the email attachments of some CSV lists, keeping their total size within a budget. If the lists are
+    too big they are attached gzipped, and if they are still too big the top rows of the lists that don't
+    fit are shown in the email instead (the smallest lists are attached first).
+    Arguments:
+        - paths: list of paths to the CSV lists (with a description on the first row and headers on the second)
+        - budget: maximum total size of the attachments in bytes (default is None - i.e., no limit)
+        - top: number of rows of each list to show in the email if they are too big to attach (default is 10)
+        - level: gzip/zip compression level (default is 9)
+    Outputs:
+        - parts: list of the MIME parts to attach to the email
+        - html: HTML to add to the body of the email (an empty string unless the top rows are shown)
+    """
+
+    def part(name, data, subtype="octet-stream"):
+        p = MIMEBase("application", subtype)
+        p.set_payload(data)
+        encoders.encode_base64(p)
+        p.add_header("Content-Disposition",f"attachment; filename= {name}")
+        print(f"attaching {name} ({len(data)/1e6:.2f} MB)")
+        return p
+
+    raw = {}
+    for path in paths:
+        with open(path, "rb") as file:
+            raw[os.path.basename(path)] = file.read()
+
+    #lists as they are
+    if (budget is None) or (sum(len(d) for d in raw.values()) <= budget):
+        return [part(name, data) for name, data in raw.items()], ""
+
+    #gzipped lists
+    gz = {f"{name}.gz": gzip.compress(data, compresslevel=level, mtime=0) for name, data in raw.items()}
+    if sum(len(d) for d in gz.values()) <= budget:
+        return [part(name, data, "gzip") for name, data in gz.items()], ""
+
+    #attach the gzipped lists that fit and show the top rows of the rest in the email
+    parts, html = [], ""
+    for path in sorted(paths, key=lambda path: len(gz[f"{os.path.basename(path)}.gz"])):
+        name = f"{os.path.basename(path)}.gz"
+        if len(gz[name]) <= budget:
+            parts.append(part(name, gz[name], "gzip"))
+            budget -= len(gz[name])
+            continue
+
+        print(f"{name} is too big to attach ({len(gz[name])/1e6:.2f} MB), adding its top {top} rows to the email")
+        dummy, headers, DB = loadDB(path)
+        tpath = f"{path[0:-4]}_top{top}.html"
+        array2html(headers, DB[:top], tpath)
+        with open(tpath) as file:
+            html += f"<br><hr> <b> Top {top} of {os.path.basename(path)} (full list too big to attach) </b> <br><br>" + file.read()
+
+    return parts, html
+
+################################################################################
+
+def spool_email(message, recipients, outbox=OUTBOX):
+    """
+    Saves an email to the outbox so it is kept until it has been sent (see send_outbox).
+    Arguments:
+        - message: the email as an email.message object (e.g., MIMEMultipart)
+        - recipients: list of the email addresses to send it to
+        - outbox: directory of the outbox (default is OUTBOX)
+    Outputs:
+        - mid: the ID of the email in the outbox
+    """
+
+    os.makedirs(outbox, exist_ok=True)
+    mid = f"{dt.datetime.utcnow().strftime('%Y%m%d%H%M%S%f')}_{os.getpid()}"
+
+    #message is saved first so an email is only in the outbox once it has been fully written
+    data = message.as_bytes() #made once and sent to every recipient
+    with open(os.path.join(outbox, f"{mid}.eml"), "wb") as file:
+        file.write(data)
+    print(f"email queued: {message['Subject']} ({len(data)/1e6:.2f} MB for {len(recipients)} recipients)")
+    info = {"recipients": list(recipients), "subject": str(message["Subject"]), "queued": time.time(), "attempts": 0, "next_try": 0}
+    _write_atomic(os.path.join(outbox, f"{mid}.json"), json.dumps(info))
+
+    return mid
+
+################################################################################
+
+def smtp_connect(creds, timeout=60):
+    """
+    Opens a connection to the email server and logs in. Uses Gmail unless the credentials include a "host",
+    "port" and "ssl" (e.g., {"host": "localhost", "port": 1025, "ssl": false} for a local debugging server).
+    Arguments:
+        - creds: dict of the email credentials containing the "email" and "password"
+        - timeout: seconds to wait for the server to respond (default is 60)
+    Outputs:
+        - smtp: smtplib SMTP object which is logged in
+    """
+
+    host, port = creds.get("host", "smtp.gmail.com"), int(creds.get("port", 465))
+    if creds.get("ssl", True):
+        smtp = smtplib.SMTP_SSL(host, port, timeout=timeout)
+    else:
+        smtp = smtplib.SMTP(host, port, timeout=timeout)
+    if creds.get("password"): #local debugging servers don't need logging in to
+        smtp.login(creds["email"], creds["password"])
+
+    return smtp
+
+################################################################################
+
+@timed("send_outbox")
+def send_outbox(creds, outbox=OUTBOX, backoff=600, max_backoff=24*3600, max_tries=10):
+    """
+    Sends all the emails waiting in the outbox over a single connection. Emails that fail stay in the outbox
+    and are tried again on later runs, waiting twice as long after each failure. The time each email took
+    to send is recorded in {outbox}/deliveries.csv.
+    Arguments:
+        - creds: dict of the email credentials (see smtp_connect)
+        - outbox: directory of the outbox (default is OUTBOX)
+        - backoff: seconds to wait before trying an email again after its first failure (default is 600)
+        - max_backoff: maximum number of seconds to wait before trying an email again (default is 24hrs)
+        - max_tries: number of tries after which an email is moved to {outbox}/failed (default is 10)
+    Outputs:
+        - sent: list of the subjects of the emails that were sent
+    """
+
+    now = time.time()
+    queue = []
+    for ipath in sorted(glob.glob(os.path.join(outbox, "*.json"))):
+        with open(ipath) as fp:
+            info = json.load(fp)
+        if info["next_try"] <= now:
+            queue.append((ipath, info))
+    if len(queue) == 0:
+        return []
+
+    sent, timings = [], []
+    done = set() #emails that have been sent or have failed on their own
+    smtp = None
+    try:
+        t0 = time.perf_counter()
+        smtp = smtp_connect(creds)
+        connect = time.perf_counter() - t0
+        print(f"connected to email server in {connect:.2f} s")
+
+        for ipath, info in queue:
+            mpath = ipath[:-5] + ".eml"
+            with open(mpath, "rb") as file:
+                msg = file.read()
+
+            t0 = time.perf_counter()
+            try:
+                smtp.sendmail(creds["email"], info["recipients"], msg)
+            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError, smtplib.SMTPSenderRefused) as e:
+                #problem with this email only, so carry on with the rest
+                _email_failed(ipath, info, e, backoff, max_backoff, max_tries)
+                done.add(ipath)
+                continue
+            took = time.perf_counter() - t0
+            net_call(creds.get("host", "smtp.gmail.com"), took, len(msg))
+
+            os.remove(mpath)
+            os.remove(ipath)
+            done.add(ipath)
+            sent.append(info["subject"])
+            timings.append([dt.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'), info["subject"], info["attempts"]+1,
+                            round(time.time() - info["queued"], 1), round(took, 3), len(msg)])
+            print(f"email sent: {info['subject']} ({len(msg)/1e6:.2f} MB in {took:.2f} s)")
+
+    except (smtplib.SMTPException, OSError) as e:
+        #connection failed so every email not yet sent is tried again later
+        for ipath, info in queue:
+            if ipath not in done:
+                _email_failed(ipath, info, e, backoff, max_backoff, max_tries)
+
+    finally:
+        if smtp is not None:
+            try:
+                smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+
+    #record how long each email took to send
+    if len(timings) != 0:
+        new = not os.path.isfile(os.path.join(outbox, "deliveries.csv"))
+        with open(os.path.join(outbox, "deliveries.csv"), "a") as file:
+            csvwriter = csv.writer(file, delimiter=",")
+            if new:
+                csvwriter.writerow(["sent", "subject", "tries", "queued_s", "send_s", "bytes"])
+            csvwriter.writerows(timings)
+
+    return sent
+
+################################################################################
+
+def _email_failed(ipath, info, error, backoff, max_backoff, max_tries):
+    """
+    Records a failed try at sending an email from the outbox and works out when to try it again.
+    """
+
+    info["attempts"] += 1
+    info["next_try"] = time.time() + min(backoff * 2**(info["attempts"]-1), max_backoff)
+    info["error"] = str(error)
+
+    if info["attempts"] >= max_tries:
+        #give up on this email, but keep it
+        failed = os.path.join(os.path.dirname(ipath), "failed")
+        os.makedirs(failed, exist_ok=True)
+        os.replace(ipath[:-5] + ".eml", os.path.join(failed, os.path.basename(ipath)[:-5] + ".eml"))
+        _write_atomic(os.path.join(failed, os.path.basename(ipath)), json.dumps(info))
+        os.remove(ipath)
+        print(f"email failed {info['attempts']} times, moved to {failed}: {info['subject']} ({error})")
+    else:
+        _write_atomic(ipath, json.dumps(info))
+        print(f"email failed, will try again later: {info['subject']} ({error})")
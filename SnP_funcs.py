@@ -18,21 +18,139 @@ from skyfield.framelib import galactic_frame
 import subprocess
 from astropy import units as u
 from astropy.coordinates import SkyCoord
+from astropy.table import Table, vstack
 import warnings #stops warning re: deprecation
 with warnings.catch_warnings():
     warnings.simplefilter("ignore")
     from astroquery.vizier import Vizier
     from astroquery.ipac.ned import Ned
-import pandas as pd
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
 import os
 import glob
 import requests
-import ltrtml
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import hashlib
+import shutil
+from collections import namedtuple
+import sys
+from SnP_metrics import ARCHIVE, counted_session, net_call, timed, traced
+
+_background = ThreadPoolExecutor(max_workers=2) #for work that carries on while the rest of a module runs
+_fill = ThreadPoolExecutor(max_workers=1) #for filling in the rest of lazy priority lists (so they don't wait on _background's jobs or vice versa)
+
+######################### FUNCTIONS FOR CACHING STAGES #########################
+
+CACHE = "../wCACHE" #outputs of the stages that last ran, stored under the hash of their inputs
+
+class StageCache:
+    """
+    Lets a stage of the pipeline be skipped when nothing it depends on has changed since it last finished,
+    e.g., when cron retries or SnP is run again by hand after one of the later modules failed.
+    The key is a hash of the stage's input files, config, date and code (the SnP_*.py modules and the script running),
+    and the stage's output files are stored under it so they can be put back if they have been moved or lost.
+    Use as:
+        cache = StageCache("LUCY", files=[...], date=..., outputs=[...])
+        if not cache.restore():
+            ...run the stage...
+            cache.save()
+    Note that inputs which aren't files (e.g., VizieR, HyperLEDA) aren't included.
+    """
+
+    def __init__(self, stage, files=(), config=None, date=None, outputs=(), code=None, cache=CACHE, keep=14):
+        """
+        Arguments:
+            - stage: name of the stage
+            - files: paths to the files the stage reads (missing files are allowed)
+            - config: anything else the outputs depend on which can be saved as JSON (default is None)
+            - date: the date the stage is run for as a string or datetime (default is None)
+            - outputs: paths to the files the stage makes
+            - code: paths to the code the stage runs (default is the SnP_*.py modules and the script being run)
+            - cache: path to the cache (default is CACHE)
+            - keep: number of runs of the stage to keep in the cache (default is 14)
+        """
+        self.stage = stage
+        self.outputs = list(outputs)
+        self.keep = keep
+        if code is None:
+            code = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "SnP_*.py"))) + [os.path.abspath(sys.argv[0])]
+
+        def digest(path):
+            return file_checksum(path) if os.path.isfile(path) else None
+
+        self.inputs = {"files": {path: digest(path) for path in files},
+                       "config": config,
+                       "date": date.strftime('%Y-%m-%d %H:%M:%S') if isinstance(date, dt.datetime) else date,
+                       "code": {os.path.basename(path): digest(path) for path in code}}
+        self.key = hashlib.sha256(json.dumps(self.inputs, sort_keys=True, default=str).encode()).hexdigest()[:20]
+        self.path = os.path.join(cache, stage, self.key)
+
+    def restore(self):
+        """
+        Checks if the stage has already been run with the same inputs, putting back any of its outputs which are missing or changed.
+        Outputs:
+            - done: True if the stage can be skipped
+        """
+        try:
+            with open(os.path.join(self.path, "stage.json")) as fp:
+                record = json.load(fp)
+        except (OSError, ValueError):
+            return False
+
+        for out, saved in zip(self.outputs, record["outputs"]):
+            cached = os.path.join(self.path, saved["file"])
+            if not os.path.isfile(cached):
+                return False #cache is incomplete so run the stage again
+            if not os.path.isfile(out) or file_checksum(out) != saved["sha256"]:
+                os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+                shutil.copy2(cached, out)
+
+        print(f"{self.stage} skipped as its inputs haven't changed since it ran at {record['finished']}")
+        return True
+
+    def save(self):
+        "Stores the outputs of the stage once it has finished so it can be skipped next time."
+        tmp = f"{self.path}.part"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+
+        outputs = []
+        for k, out in enumerate(self.outputs):
+            name = f"{k}_{os.path.basename(out)}"
+            shutil.copy2(out, os.path.join(tmp, name))
+            outputs.append({"path": out, "file": name, "sha256": file_checksum(out)})
+        record = {"stage": self.stage, "finished": dt.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+                  "inputs": self.inputs, "outputs": outputs}
+        with open(os.path.join(tmp, "stage.json"), "w") as fp:
+            json.dump(record, fp, indent=4)
+
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.replace(tmp, self.path)
+
+        #only keep the most recent runs
+        runs = sorted(glob.glob(os.path.join(os.path.dirname(self.path), "*", "stage.json")), key=os.path.getmtime)
+        for old in runs[:-self.keep]:
+            shutil.rmtree(os.path.dirname(old), ignore_errors=True)
+
+################################################################################
+
+def file_checksum(path, chunk=1<<20):
+    """
+    Finds the SHA-256 checksum of a file, reading it in pieces so large files aren't loaded into memory.
+    Arguments:
+        - path: path to the file
+        - chunk: size in bytes of the pieces the file is read in (default is 1MB)
+    Outputs:
+        - checksum: the checksum as a hexadecimal string
+    """
+    sha = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(chunk), b""):
+            sha.update(block)
+    return sha.hexdigest()
 
 ################# FUNCTIONS FOR UPDATING TNS DATABASE ##########################
 
+@traced("loadDB")
 def loadDB(filename):
     """
     Function to load in the TNS database from its CSV file
@@ -60,6 +178,7 @@ def loadDB(filename):
 
 ################################################################################
 
+@timed("dload")
 def dload(file, creds):
     """
     Function to download CSV files from the TNS via a TNS bot with an API key.
@@ -80,7 +199,10 @@ def dload(file, creds):
     cmd = f'{cmd1}{creds["tns_id"]}{cmd2}{creds["name"]}{cmd3}{creds["api_key"]}{cmd4}{file}{cmd5}{file}{cmd6}'
 
     #do the curl command to download the update file
+    t0 = time.perf_counter()
     subprocess.call(cmd,shell=True)
+    zpath = f"../xOUTPUTS/{file}.zip"
+    net_call("www.wis-tns.org", time.perf_counter() - t0, os.path.getsize(zpath) if os.path.isfile(zpath) else 0)
 
     #unzip the csv and delete the zip file
     uzip = f"unzip ../xOUTPUTS/{file}.zip -d ../xOUTPUTS/"
@@ -90,6 +212,8 @@ def dload(file, creds):
 
 ################################################################################
 
+@timed("UPdate")
+@traced("UPdate")
 def UPdate(ufile,date,database):
     """
     This function updates the local TNS database using update files from the TNS server.
@@ -128,6 +252,58 @@ def UPdate(ufile,date,database):
 
 ################################################################################
 
+def reconstruct_tns(date, path="../xOUTPUTS/tns_public_objects.csv", archive=ARCHIVE, window=14):
+    """
+    Rebuilds the TNS database as it was released on a past date (at 00:00 UTC) from the current database and the
+    daily update files kept in the archive (zARCHIVE/*/tns_public_objects_YYYYMMDD.csv).
+    Objects that haven't changed since the date are kept as they are, the ones that have are put back to their
+    last version in the updates from the window days before the date, and any others (i.e., not modified in the
+    window, so too old for the priority lists) or discovered after the date are left out.
+    Arguments:
+        - date: datetime of the day to rebuild the database for
+        - path: path to the current TNS database (default is "../xOUTPUTS/tns_public_objects.csv")
+        - archive: path to the archive (default is ARCHIVE)
+        - window: number of days of updates to use before the date (default is 14, as far back as the priority lists look)
+    Outputs:
+        - date: the date of the rebuilt database as a string in the format '%Y-%m-%d %H:%M:%S'
+        - headers: the column headers of the database as a list
+        - database: numpy object array of the rebuilt database
+        - missing: list of the dates (YYYYMMDD) of the updates in the window that couldn't be found
+    """
+
+    date = dt.datetime.combine(date, dt.datetime.min.time())
+    dstr = date.strftime('%Y-%m-%d %H:%M:%S')
+    dummy, headers, database = loadDB(path)
+
+    #go through the updates in order so the last version of each object before the date is kept
+    rows, missing = {}, []
+    for k in range(window, 0, -1):
+        day = (date - dt.timedelta(days=k)).strftime('%Y%m%d')
+        name = f"tns_public_objects_{day}.csv"
+        found = sorted(glob.glob(os.path.join(archive, "*", name))) + glob.glob(os.path.join(os.path.dirname(path), name))
+        if len(found) == 0:
+            missing.append(day)
+            continue
+        dummy, uheaders, updates = loadDB(found[-1])
+        for row in updates:
+            rows[row[0]] = row
+
+    #objects that haven't changed since the date (ISO dates so can be compared as strings)
+    if database.size != 0:
+        same = (database.T[-1].astype(str) < dstr) & (database.T[12].astype(str) < dstr)
+        for row in database[same]:
+            rows[row[0]] = row
+
+    if len(missing) != 0:
+        print(f"TNS updates for {', '.join(missing)} not found - objects last modified on those days may be missing")
+
+    #newest entries at the top, as in the TNS database
+    database = np.array(list(rows.values())[::-1], dtype=object)
+
+    return dstr, headers, database, missing
+
+################################################################################
+
 def delay():
     """
     Incduces a delay in the code until the next midnight if it is less than 14hrs in the future. This allows downloading of the TNS updates as close as possible to when they are released.
@@ -152,6 +328,77 @@ def delay():
 
 ################# FUNCTIONS FOR CALCULATING PRIORITY SCORES ####################
 
+_ephems = {} #timescale and ephemerides already loaded in (so only loaded once per run)
+MIN_ALT = 35 #default lowest altitude targets can be observed at in degrees (airmass ~1.74)
+EXP_TIME = 880 #default exposure time of each requested observation in seconds
+OVERHEAD = 300 #default time taken to slew to and set up on each target in seconds
+#highest altitude of the sun in degrees for each class of sky brightness
+SKY_CLASSES = {"any": 90, "civil": -6, "nautical": -12, "astronomical": -18, "dark": -18}
+
+def ephemeris(ephm = 'de421.bsp'):
+    """
+    Loads the skyfield timescale and ephemerides, reusing them if they have already been loaded.
+    Arguments:
+        - ephm: the path to the ephemerides file for skyfield (default is 'de421.bsp')
+    Outputs:
+        - ts: skyfield timescale object
+        - eph: skyfield ephemerides
+    """
+    if ephm not in _ephems:
+        _ephems[ephm] = (load.timescale(), load(ephm))
+    return _ephems[ephm]
+
+
+def airmass2alt(airmass):
+    """
+    Converts an airmass into the altitude it corresponds to (using the plane-parallel approximation, airmass = sec(z)).
+    Arguments:
+        - airmass: the airmass (float or array)
+    Outputs:
+        - alt: the altitude in decimal degrees
+    """
+    return np.degrees(np.arcsin(1/np.asarray(airmass,dtype=float)))
+
+################################################################################
+
+def alt_curves(ra, dec, times, lat, long, elv, ephm = 'de421.bsp'):
+    """
+    Calculates the altitudes of a list of targets at every time in a grid of times all at once. The apparent
+    positions of the targets are found once (at the middle of the grid) and the altitudes are then found from
+    the local sidereal time, which is accurate to well under an arcsecond over a night.
+    Arguments:
+        - ra: array of right ascensions of the targets (in decimal degrees)
+        - dec: array of declinations of the targets (in decimal degrees)
+        - times: skyfield time object containing an array of times
+        - lat: the latitude of the location (in decimal degrees)
+        - long: the eastwards longitude of the location (in decimal degrees)
+        - elv: the elevation of the location (in metres)
+        - ephm: the path to the ephemerides file for skyfield (default is 'de421.bsp')
+    Outputs:
+        - alts: numpy array of the altitudes in decimal degrees with a row per target and a column per time
+    """
+
+    ts, eph = ephemeris(ephm)
+    location = wgs84.latlon(lat * N, long * E, elevation_m = elv) #location of observatory
+    Epos = eph['earth'] + location
+
+    #apparent RA and Dec (of date) of all the targets at the middle of the time grid
+    ra, dec = np.atleast_1d(np.asarray(ra,dtype=float)), np.atleast_1d(np.asarray(dec,dtype=float))
+    tmid = ts.tt_jd(np.mean(times.tt))
+    tars = Star(ra_hours=ra/15, dec_degrees=dec)
+    aRA, aDEC, dummy = Epos.at(tmid).observe(tars).apparent().radec(epoch='date')
+
+    #hour angles of the targets at all the times (local apparent sidereal time minus RA)
+    last = (times.gast + long/15) % 24 #local apparent sidereal time in hours
+    HA = np.radians((last[np.newaxis,:] - aRA.hours[:,np.newaxis]) * 15)
+
+    #altitude from hour angle, declination and latitude
+    latR, decR = np.radians(lat), aDEC.radians[:,np.newaxis]
+    sinalt = np.sin(latR)*np.sin(decR) + np.cos(latR)*np.cos(decR)*np.cos(HA)
+
+    return np.degrees(np.arcsin(np.clip(sinalt,-1,1)))
+
+
 def TNSlice(database,date):
     """
     Function that slices the TNS database so only the transients discovered in the last 3 months
@@ -193,11 +440,13 @@ def TNSlice(database,date):
 
 ################################################################################
 
-def Visibility(ra, dec, lat, long, elv, ephm = 'de421.bsp'):
+@timed("Visibility")
+def Visibility(ra, dec, lat, long, elv, ephm = 'de421.bsp', min_alt = MIN_ALT, now = None, step = 1/60):
     """
-    Function that calaculates the observable time, lunar separation and transit altitude
-    of a list of targets given their right ascension and declination, the latitude
-    longitude and elevation of the elevation, and the date of the start of the night.
+    Function that calaculates the observable time and lunar separation of a list of targets given their right
+    ascension and declination, the latitude longitude and elevation of the elevation, and the date of the start
+    of the night. The observable time comes from the same windows as the schedule (see constraint_windows), so
+    all the targets are done at once on a shared grid of times.
     Arguments:
         - ra: list of right ascensions of the targets (in decimal degrees)
         - dec: list of declinations of the targets (in decimal degrees)
@@ -205,14 +454,18 @@ def Visibility(ra, dec, lat, long, elv, ephm = 'de421.bsp'):
         - long: the eastwards longitude of the location (in decimal degrees)
         - elv: the elevation of the location (in metres)
         - ephm: the path to the ephemerides file for skyfield (default is 'de421.bsp')
+        - min_alt: the lowest altitude the targets can be observed at in decimal degrees (default is MIN_ALT)
+        - now: datetime of the day the night starts on (default is None - i.e., today)
+        - step: time between the points the altitudes are calculated at in hours (default is 1 minute)
     Outputs:
-        - tObs: the time in hours that the target is above 35 altitude in dark time
-        - tAlt: the altitude of the target when it transits the meridian (in decimal degrees)
-        - lSep: the average separation between the moon and the target during the night (in decimal degrees)
+        - tObs: array of the time in hours that each target is above min_alt altitude in dark time
+        - lSep: array of the average separation between the moon and each target during dark time (in decimal degrees, 0 if it can't be observed)
+        - mill: the fraction of the moon that is illuminated at midnight
     """
 
     #convert date to datetime object at midday
-    today = dt.datetime.combine(dt.datetime.now(), dt.datetime.min.time()) + dt.timedelta(days=0.5)
+    now = dt.datetime.now() if now is None else now
+    today = dt.datetime.combine(now, dt.datetime.min.time()) + dt.timedelta(days=0.5)
     today =today.replace(tzinfo=utc)
     tomorrow = today + dt.timedelta(days=1) #next day at midday
     tomorrow = tomorrow.replace(tzinfo=utc)
@@ -220,11 +473,9 @@ def Visibility(ra, dec, lat, long, elv, ephm = 'de421.bsp'):
 
     ### Set-up sky-field observing ##
     location = wgs84.latlon(lat * N, long * E, elevation_m = elv) #location of observatory
-    ts = load.timescale() #loads in timescale
-    eph = load(ephm)  #loads in ephemerides
-    #sets up sun, earth (needed for calculating dark time and our location respectivly) and moon (for illumination, etc.)
-    earth, sun, moon = eph['earth'], eph['sun'], eph['moon']
-    Epos = earth + location #sets up observing position (i.e., the postion of the follow-up telescope)
+    ts, eph = ephemeris(ephm) #loads in timescale and ephemerides
+    #sets up earth (needed for our location) and moon (for illumination, etc.)
+    earth, moon = eph['earth'], eph['moon']
 
     #makes time objects from today and tomorrow
     t0 = ts.from_datetime(today)
@@ -254,333 +505,318 @@ def Visibility(ra, dec, lat, long, elv, ephm = 'de421.bsp'):
 
     #find the UTC time at the middle of the night
     middark = ts.from_datetime(darkstart.utc_datetime()+((darkend.utc_datetime() - darkstart.utc_datetime())/2))
-    darktimes = [darkstart,middark,darkend] #list of the time at the start, middle, and end of dark time
+    darktimes = ts.tt_jd([darkstart.tt, middark.tt, darkend.tt]) #the time at the start, middle, and end of dark time
 
-    ## calculate moon's alt, phase, and illumination ##
+    ## calculate moon's illumination ##
     midnight = t0 + dt.timedelta(hours=12)
-    mastro = Epos.at(midnight).observe(moon)
-    mapp = mastro.apparent()
-    malt, maz, mdst = mapp.altaz()
-    mphase = almanac.moon_phase(eph, t0)
     mill = almanac.fraction_illuminated(eph,"moon",midnight)
-    malt, mphase = malt.degrees, mphase.degrees
 
-    ## FUNCTIONS FOR CALCULATING OBSERVABLE TIME OF TARGET ##
-    def transit_time(tar,t_start,t_end):
-        """
-        Function that finds the transit time (in UTC) of a target between two times (need to be 24hrs apart)
-        and the altitude of this transit in degrees.
-        Arguments:
-            - tar: the target as a skyfield Star object.
-            - t0: start time as a skyfield time object.
-            - t1: end time (should be ~24hrs later) as a skyfield time object.
-        Output:
-            t_time: time that the object transits in UTC as a skyfield time object.
-            t_alt: altitude in degrees that the object transits (float).
-        """
-        #function that calculates transit
-        f = almanac.meridian_transits(eph, tar, location)
-        t, y = almanac.find_discrete(t_start, t_end, f)
-        #t is times of transit,
-        #y is array with 0 for antimerdian transit and 1 for meridian transit (which we are intrested in)
-
-        #so t_time is the element at the same index as 1 in y in the t array
-        meridian_index = np.where(y==1)[0]
-        t_time = t[meridian_index]
-
-        #now need to find altitude of star at this time
-        astro = Epos.at(t_time).observe(tar)
-        app = astro.apparent()
-        alt, az, distance = app.altaz()
-        t_alt = alt.degrees
-
-        return t_time[0], t_alt[0]
-
-    def alt2HA(alt,lt,dec):
-        '''
-        Function that calculates the absolute value of the hour angle of a target for at a specified altitude, given the latitude of the location and the declination of the target.
-        Arguments:
-            - alt: the altitude you want to find the value of the HA at, in decimal degrees (float).
-            - lt: the latitude of the location you are observing the target, in decimal degrees (float).
-            - dec: the declination of the target, in decimal degrees (float)
-        Output:
-            - HA: the absolute value of the HA of the target at the specified altitude in decimal hours (float).
-        '''
 
-        #convert dec, lat and alt into radian
-        altR = np.radians(alt)
-        latR = np.radians(lt)
-        decR = np.radians(dec)
+    ## CALCULATING OUTPUTS ##
+    RA = np.atleast_1d(np.asarray(ra,dtype=float))
+    DEC = np.atleast_1d(np.asarray(dec,dtype=float))
 
-        #find the hour angle of the
-        cosHAnum = np.sin(altR) - (np.sin(latR)*np.sin(decR)) #numerator of cos(HA)
-        cosHAden = np.cos(latR)*np.cos(decR) #denominator of cos(HA)
-        cosHA = cosHAnum/cosHAden
+    #time each target is above the lower limit in dark time
+    wstart, wend = constraint_windows(RA, DEC, darkstart.utc_datetime(), darkend.utc_datetime(), [{"min_alt": min_alt}],
+                                      step, lat, long, elv, ephm)
+    tObs = np.nan_to_num(wend[:,0] - wstart[:,0])
 
-        if cosHA > 1: #i.e., target never reaches 35 degs
-            HA = None
-        else:
-            #find the hour angle using arccos
-            HAdeg = np.degrees(np.arccos(cosHA)) #hour angle in degrees
-            HA = HAdeg/15 #hour angle in hours
+    #mean angular separation from the moon at the start, middle and end of dark time (doesn't depend on location on earth just time)
+    mpos = earth.at(darktimes).observe(moon).position.au
+    mvec = mpos / np.linalg.norm(mpos, axis=0) #unit vectors of the moon (3 x times)
+    raR, decR = np.radians(RA), np.radians(DEC)
+    tvec = np.stack([np.cos(decR)*np.cos(raR), np.cos(decR)*np.sin(raR), np.sin(decR)], axis=1) #targets x 3
+    lSep = np.degrees(np.arccos(np.clip(tvec @ mvec, -1, 1))).mean(axis=1)
+    lSep = np.where(tObs > 0, lSep, 0) #no lunar separation if it can't be observed
 
-        return HA
+    #return along with lunar illumination
+    return tObs, lSep, mill
 
-    def obs_time(dt_start,dt_end,rise_t,set_t):
-        """
-        Function that calculates how long a target is visible given the times dark time starts and ends, and
-        the times the target rises above and sets below a certain altitude. Note all times need to be in
-        the same timezone, idealy UTC.
-        Arguments:
-            - dt_start: the time dark time starts as a skyfield time object.
-            - dt_end: the time dark time ends as a skyfield time object.
-            - rise_t: the time the target rises above the certain altitude.
-            - set_t: the time the target sets below the certain altitude.
-        Output:
-            t_obs: the time the target is obserable in dark time, as a decimal hour (float).
-        """
+################################################################################
 
-        #convert the times into datetime objects
-        dt_start, dt_end = dt_start.utc_datetime(), dt_end.utc_datetime()
-        rise_t, set_t = rise_t.utc_datetime(), set_t.utc_datetime()
-
-        ## Now need to carry out the flow chart described above ##
-        #first check is rise_t greater than dt_start
-        if rise_t > dt_start:
-            #if true then target rises after dark time starts
-            #next check: is rise_t greater than dt_end
-            if rise_t > dt_end:
-                #if true target rises and sets after dark time, so cant observe
-                t_obs = 0
-            else:
-                #if false the target rises in dark time
-                #next check: is set_t greater than dt_end
-                if set_t > dt_end:
-                    #if true then target rises in dark time and then sets after
-                    #so observable time is end of dark time minus rise time
-                    t_obs = (dt_end - rise_t).seconds/3600 #have to divide by 3600 to get in hours
-                else:
-                    #if false then target rises and sets in dark time
-                    #so observable time is just the time it is above the certain altitude
-                    t_obs = (set_t - rise_t).seconds/3600
-        else:
-            #if false target rises before dark time
-            #next check: is set_t greater than dt_start
-            if set_t > dt_start:
-                #if true then the target sets in dark time
-                #next check: is set_t greater than dt_end
-                if set_t > dt_end:
-                    #if true then target rises before dark time and sets after it
-                    #so observable time is the length of dark time
-                    t_obs = (dt_end - dt_start).seconds/3600
-                else:
-                    #if false then target rises before dark time and sets in dark time
-                    #so observable time is the set time minus the start of dark time
-                    t_obs = (set_t - dt_start).seconds/3600
-            else:
-                #if false then target rises and sets before dark time starts, so cant observe
-                t_obs = 0
+def constraint_windows(ra, dec, tstart, tend, constraints, step=1/60, lat=28.6468866, long=-17.7742491, elv=2326.0, ephm='de421.bsp'):
+    """
+    Finds when each target is observable between two times under several sets of observing constraints at once.
+    The altitudes of the targets, the altitude of the sun and the separation from the moon are calculated once on
+    a shared grid of times and every set of constraints is then just a comparison against them, so asking for
+    a few different airmass limits costs about the same as asking for one.
+    Arguments:
+        - ra: array of right ascensions of the targets (in decimal degrees)
+        - dec: array of declinations of the targets (in decimal degrees)
+        - tstart: start time as a timezone aware datetime object
+        - tend: end time as a timezone aware datetime object
+        - constraints: list of dicts each containing any of:
+            - "min_alt": the lowest altitude the targets can be observed at in degrees
+            - "airmass": the highest airmass the targets can be observed at
+            - "moon_sep": the smallest separation from the moon the targets can be observed at in degrees
+            - "sky": the brightest sky the targets can be observed in, one of the keys of SKY_CLASSES
+        - step: time between the points the altitudes are calculated at in hours (default is 1 minute)
+        - lat, long, elv: latitude and eastwards longitude in decimal degrees, and elevation in metres of the telescope (default is the LT)
+        - ephm: the path to the ephemerides file for skyfield (default is 'de421.bsp')
+    Outputs:
+        - wstart: array of the times each target becomes observable in hours after tstart, with a row per target
+            and a column per set of constraints (NaN if never observable)
+        - wend: array of the times each target stops being observable in hours after tstart, the same shape as wstart
+    """
 
-        return t_obs
+    ts, eph = ephemeris(ephm)
+    ntar, ncon = np.size(ra), len(constraints)
+
+    #grid of times shared by all targets and constraints
+    offsets = np.arange(0, (tend - tstart).total_seconds()/3600 + step/2, step)
+    if (offsets.size == 0) or (ntar == 0) or (ncon == 0):
+        return np.full((ntar,ncon), np.nan), np.full((ntar,ncon), np.nan)
+    tgrid = ts.tt_jd(ts.from_datetime(tstart).tt + offsets/24)
+
+    #altitudes of the targets and the sun
+    alts = alt_curves(ra, dec, tgrid, lat, long, elv, ephm)
+    Epos = eph['earth'] + wgs84.latlon(lat * N, long * E, elevation_m = elv)
+    sunalt = Epos.at(tgrid).observe(eph['sun']).apparent().altaz()[0].degrees
+
+    #separation between the targets and the moon, only if it is needed
+    if any("moon_sep" in con for con in constraints):
+        mpos = Epos.at(tgrid).observe(eph['moon']).position.au
+        mvec = mpos / np.linalg.norm(mpos, axis=0) #unit vectors of the moon (3 x times)
+        raR = np.radians(np.atleast_1d(np.asarray(ra,dtype=float)))
+        decR = np.radians(np.atleast_1d(np.asarray(dec,dtype=float)))
+        tvec = np.stack([np.cos(decR)*np.cos(raR), np.cos(decR)*np.sin(raR), np.sin(decR)], axis=1) #targets x 3
+        msep = np.degrees(np.arccos(np.clip(tvec @ mvec, -1, 1)))
+
+    #which times each target is visible at under each set of constraints
+    visible = np.empty((ntar, ncon, offsets.size), dtype=bool)
+    for c, con in enumerate(constraints):
+        limit = con.get("min_alt", -90)
+        if "airmass" in con:
+            limit = max(limit, airmass2alt(con["airmass"]))
+        vis = alts >= limit
+        if "sky" in con:
+            vis &= (sunalt <= SKY_CLASSES[con["sky"]])[np.newaxis,:]
+        if "moon_sep" in con:
+            vis &= msep >= con["moon_sep"]
+        visible[:,c] = vis
+
+    #first stretch of time each target is visible for
+    idx = np.arange(offsets.size)
+    first = np.argmax(visible, axis=-1)[...,np.newaxis]
+    broken = np.cumsum(~visible & (idx > first), axis=-1) > 0 #after the target stops being visible
+    run = visible & ~broken & (idx >= first)
+    last = offsets.size - 1 - np.argmax(run[...,::-1], axis=-1)
+
+    ever = visible.any(axis=-1)
+    wstart = np.where(ever, offsets[first[...,0]], np.nan)
+    wend = np.where(ever, offsets[last], np.nan)
+
+    return wstart, wend
+
+
+def vis_windows(ra, dec, tstart, tend, min_alt=MIN_ALT, step=1/60, lat=28.6468866, long=-17.7742491, elv=2326.0):
+    """
+    Finds when each target is observable between two times, i.e., when it is above a minimum altitude during
+    astronomical dark time (sun below -18 degrees).
+    Arguments:
+        - ra: array of right ascensions of the targets (in decimal degrees)
+        - dec: array of declinations of the targets (in decimal degrees)
+        - tstart: start time as a timezone aware datetime object
+        - tend: end time as a timezone aware datetime object
+        - min_alt: the minimum altitude the targets can be observed at in degrees (default is MIN_ALT)
+        - step: time between the points the altitudes are calculated at in hours (default is 1 minute)
+        - lat, long, elv: latitude and eastwards longitude in decimal degrees, and elevation in metres of the telescope (default is the LT)
+    Outputs:
+        - wstart: array of the times each target becomes observable in hours after tstart (NaN if never observable)
+        - wend: array of the times each target stops being observable in hours after tstart (NaN if never observable)
+    """
 
-    ## CALCULATING OUTPUTS ##
-    #empty lists to fill
-    tObs, lSep = [], []
-
-    #find altitude of each transient at sunset, start of dark time, end of darktime, and sunrise
-    for k in range(ra.size):
-        #RA and Dec of target in decimal degrees converted from string
-        RA = float(ra[k])
-        Dec = float(dec[k])
-
-        #convert RA in decimal degrees to RA in hrs, mins, secs
-        raH = RA/15 #RA decimal degrees to decimal hours
-        ra_hours = int(raH) #hours of RA
-        raM = (raH-ra_hours)*60 #decimal mintues of RA
-        ra_mins = int(raM) #mintues of RA
-        ra_secs = (raM-ra_mins)*60 #seconds of RA
-
-        #convert DEC in decimal degrees to dec in degs, arcmins, arcsecs
-        dec_degs = int(Dec) #degs of dec
-        decM = (Dec-dec_degs)*60 #decimal arcmintues of dec
-        dec_mins = int(decM) #arcmintues of dec
-        dec_secs = (decM-dec_mins)*60 #arcseconds of dec
-
-        #cretes star object from RA and Dec which represents the transient
-        target =  Star(ra_hours=(ra_hours, ra_mins, ra_secs),dec_degrees=(dec_degs, dec_mins, dec_secs))
-
-        #finding the UTC time the target transits the meridian
-        trans_time, trans_alt = transit_time(target,t0,t1)
-
-        # if the transit altitude is less than 35 then cant observe it #
-        if trans_alt < 35:
-            t_obs = 0
-            asep = 0 #set lunar separation to be zero also
-        else: #otherwise can continue
-
-            # find the HA of target at 35 degs
-            HA = alt2HA(35,lat,Dec)
-
-            if HA == None: #target never rises above 35 degrees
-                t_obs = 0
-                asep = 0 #set lunar separation to be zero also
-            else:
-                ## Find the time target rises above 35 and then sets below 35 using the HA and transit time ##
-                rise35 = trans_time - dt.timedelta(hours=HA)
-                set35 = trans_time + dt.timedelta(hours=HA)
-                above35 = ((set35.utc_datetime()-rise35.utc_datetime()).seconds)/3600 #time above 35 degs
+    wstart, wend = constraint_windows(ra, dec, tstart, tend, [{"min_alt": min_alt, "sky": "astronomical"}], step, lat, long, elv)
 
-                #find the observable time f the target
-                t_obs = obs_time(darkstart,darkend,rise35,set35)
+    return wstart[:,0], wend[:,0]
 
-                if t_obs > 0: #if non zero time for observing then can calculate the lunar separation
-                    a_seps = []
-                    for DT in darktimes:
-                        # angular separation doesn't depend on location on earth just time
-                        e = earth.at(DT) #set earth as centre
-                        m = e.observe(moon) #observe moon at time DT
-                        T = e.observe(target) #observe target at time DT
-                        a_sep = m.separation_from(T).degrees #find angular separation in degrees
-                        a_seps.append(a_sep) #append to list
+################################################################################
 
-                    asep = np.mean(a_seps) #find mean angular separation during darktime
+GLADE_CAT = 'VII/291/gladep' #VizieR ID of the GLADE+ catalogue
+VIZIER_SERVER = 'vizier.cds.unistra.fr' #default VizieR server
+HYPERLEDA_URL = "https://leda.univ-lyon1.fr/ledacat.cgi" #HyperLEDA object pages (for galaxy radii)
+_local_cats = {} #local catalogues already loaded in (so only read once per run)
 
-                else: #if no observable time then don't need to calculate the angular sep
-                    asep = 0
+def xmatch_query(transients, radius=1*u.arcmin, chunk=500, catalogue=None, server=VIZIER_SERVER):
+    """
+    Cross-matches a whole list of transients with the GLADE+ catalogue using as few queries as possible.
+    The positions are sent to VizieR as a multi-position query in chunks and the combined result is
+    split back up per transient, with separations calculated for all the matches at once.
+    Arguments:
+        - transients: astropy SkyCoord object containing all the transients
+        - radius: radius to search around each transient in Astropy units of angle (default is 1 arcmin)
+        - chunk: maximum number of transients sent in each query to VizieR (default is 500)
+        - catalogue: path to a local copy of GLADE+ (any format astropy Table can read, with the same columns as VizieR)
+            which is searched instead of VizieR, e.g., when there is no network (default is None - i.e., use VizieR)
+        - server: the VizieR server to query, e.g., a local mock server (default is VIZIER_SERVER)
+    Outputs:
+        - matches: astropy Table of all the galaxies matched with any of the transients (with the same columns as the
+            output of Vizier.query_region), with the index of the transient each galaxy matched with added as the
+            column "_idx" and the separation between them (in arcsecs) as the column "_sep". Sorted by "_idx".
+    """
 
-        # add to the lists
-        tObs.append(t_obs)
-        lSep.append(asep)
+    ntran = len(transients)
+    if ntran == 0:
+        return Table({"_idx":np.array([],dtype=int), "_sep":np.array([],dtype=float)})
+
+    if catalogue is not None:
+        ## search a local copy of the catalogue ##
+        if catalogue not in _local_cats:
+            cat = Table.read(catalogue)
+            #sort by declination so the galaxies near each transient can be found with a binary search
+            cat = cat[np.argsort(np.array(cat["DEJ2000"],dtype=float))]
+            _local_cats[catalogue] = cat
+        cat = _local_cats[catalogue]
+        cdec = np.array(cat["DEJ2000"],dtype=float)
+
+        #find the indices of the galaxies in the declination band around each transient
+        rdeg = radius.to(u.deg).value
+        tdec = transients.dec.deg
+        lo = np.searchsorted(cdec, tdec - rdeg, side="left")
+        hi = np.searchsorted(cdec, tdec + rdeg, side="right")
+        counts = hi - lo
+        t_idx = np.repeat(np.arange(ntran), counts)
+        g_idx = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(lo, counts)
+
+        #keep only those within the search radius
+        gals = SkyCoord(ra=np.array(cat["RAJ2000"][g_idx],dtype=float)*u.deg, dec=cdec[g_idx]*u.deg)
+        seps = transients[t_idx].separation(gals)
+        close = seps <= radius
+
+        table = cat[g_idx[close]]
+        t_idx = t_idx[close]
+        table["_sep"] = seps[close].to(u.arcsec).value
 
-    #return and convert to numpy arrays, along with lunar illumination
-    return np.array(tObs), np.array(lSep), mill
+    else:
+        ## multi-position query to VizieR ##
+        viz = Vizier(row_limit=-1, vizier_server=server) #no row limit as all transients share one result
+        counted_session(viz._session) #so the queries show up in the metrics
+
+        tables = []
+        for start in range(0, ntran, chunk):
+            tchunk = transients[start:start+chunk]
+            result = viz.query_region(tchunk, radius = radius, catalog = GLADE_CAT)
+
+            if len(result) == 0: #no matches for any transients in this chunk
+                continue
+
+            table = result[0]
+            #_q is the (1-based) index of the position in the query each galaxy matched with
+            table["_q"] = np.array(table["_q"],dtype=int) - 1 + start
+            tables.append(table)
+
+        if len(tables) == 0: #no matches for any transients
+            return xmatch_query(transients[0:0])
+
+        table = vstack(tables)
+        t_idx = np.array(table["_q"],dtype=int)
+        table.remove_column("_q") #removed so columns are the same as a single position query
+
+        #separations of all the galaxies from the transient they matched with
+        gals = SkyCoord(ra=np.array(table["RAJ2000"],dtype=float)*u.deg, dec=np.array(table["DEJ2000"],dtype=float)*u.deg)
+        table["_sep"] = transients[t_idx].separation(gals).to(u.arcsec).value
+
+    ## order the matches by the transient they matched with ##
+    table["_idx"] = t_idx
+    order = np.argsort(t_idx, kind="stable")
+
+    return table[order]
 
 ################################################################################
 
-def xmatch_rm(tlist):
+@timed("xmatch_rm")
+def xmatch_rm(tlist, catalogue=None, server=VIZIER_SERVER):
     '''Function to remove any transients from a list if they are too close to a target in a catalogue.
     Arguments:
         - tlist: array representing the targets with RA and DEC in column indices 3 and 4
+        - catalogue: path to a local copy of GLADE+ to cross-match with instead of VizieR (default is None - i.e., use VizieR)
+        - server: the VizieR server to query, e.g., a local mock server (default is VIZIER_SERVER)
     Outpts:
         - new_tlist: list of transients with the those to close to catalogue objects removed
     '''
 
     ### Internal Functions ###
-    def host_name(xtable,host_idx):
+    def host_names(xtable):
         """
-        Finds name of host galaxy that cross-mathced with a transient.
+        Finds the names of all the galaxies that cross-matched with the transients.
         Arguments:
-            - xtable: table produced by query to ViziR
-            - host_idx: index of the host in the in xtable
+            - xtable: table of matches produced by xmatch_query
         Output:
-            - name: name of the host galaxy as a string
+            - names: numpy array of the names of the galaxies as strings
         """
-        #names of the columns headers
-        namecols = xtable[0].colnames[1:]
+
+        def col_str(header):
+            #entries of a column as strings with any masked entries set to "--"
+            col = xtable[header]
+            entries = np.asarray(col).astype(str)
+            entries[np.ma.getmaskarray(col)] = "--"
+            return entries
+
+        #default to GLADE name
+        glade = np.char.add("GLADE ", col_str("GLADE_"))
+        names = glade.astype(object)
+        unset = np.ones(len(xtable),dtype=bool) #galaxies that have not been named yet
+
+        #names of the columns headers (in order of preference)
+        namecols = [c for c in xtable.colnames[1:] if c not in ("_idx","_sep")]
 
         for header in namecols:
+            if header == "WISExSCOS":
+                #deafult to GLADE name after 2MASS
+                break
 
-            entry = str(xtable[0][header][host_idx])
+            entry = col_str(header)
+            named = unset & (entry != "-") & (entry != "--")
 
-            if (entry == "-") or (entry == "--"):
-                if header == "WISExSCOS":
-                    #deafult to GLADE name after 2MASS
-                    name = f"GLADE {str(xtable[0]['GLADE_'][host_idx])}"
-                else:
-                    #go to next column
-                    continue
-            else:
-                if header == "PGC":
-                    name = f"{header} {entry}"
+            if header == "PGC":
+                name = np.char.add(f"{header} ", entry)
 
-                elif header == "GWGC":
-                    name = entry
+            elif header == "GWGC":
+                name = entry
 
-                elif header == "HyperLEDA":
-                    if entry.isdigit():
-                        #if the name is a set of digits then need LEDA prefix
-                        name = f"LEDA {entry}"
-                    else:
-                        #if letters in the name then no prefix needed
-                        name = entry
+            elif header == "HyperLEDA":
+                #if the name is a set of digits then need LEDA prefix
+                #if letters in the name then no prefix needed
+                name = np.where(np.char.isdigit(entry), np.char.add("LEDA ", entry), entry)
 
-                elif header == "_2MASS":
-                    name = f"2MASX {entry}"
+            elif header == "_2MASS":
+                name = np.char.add("2MASX ", entry)
 
-                else:
-                    #deafult to GLADE name after 2MASS
-                    name = f"GLADE {str(xtable[0]['GLADE_'][host_idx])}"
+            else:
+                #deafult to GLADE name after 2MASS
+                name = glade
 
-                break
+            names[named] = name[named]
+            unset &= ~named
 
-        return name
+        return names
 
-    def d25_from_HL(host_name, sep):
+    def d25_from_HL(host_name):
         """
-        Queries Hyper LEDA to find the apparent radius of a galaxy and then checks if hosts a transient.
+        Queries Hyper LEDA to find the apparent radius of a galaxy.
         Arguments:
             - host_name: the name of the galaxy
-            - sep: the separtion of the transient to the galaxy in Astropy units of angle
         Outputs:
-            - appR: the apparent radius of the galaxy in arcsecs as a float (set to None if no radius found)
-            - hosted: boolean indicating if transient resides within radius of galaxy (set to None if no radius found)
+            - appR: the apparent radius of the galaxy in arcsecs as a float (set to NaN if no radius found)
         """
 
         #download whole html code for object page in HyperLEDA website
-        r = requests.get(f"https://leda.univ-lyon1.fr/ledacat.cgi?o={host_name}")
+        with counted_session() as session:
+            r = session.get(f"{HYPERLEDA_URL}?o={host_name}")
         HLtxt = r.text
         #slice out the logd25 value (log of apparent diameter, where d25 is in 0.1 arcmin)
         if HLtxt.find(">logd25<") != -1: #if can find d25 value
             logd25 = float(HLtxt[HLtxt.find(">logd25<"):HLtxt.find("</td><td>log(0.1 arcmin)")].split()[1])
             appR = (10**(logd25-1) * u.arcmin)/2 #apparent radius (hence divide by 2)
-
-            if sep > appR:
-                hosted = False
-            else:
-                hosted = True
-
             appR = appR.to(u.arcsec).value
 
         else: #if cannot find a d25 value
-            appR = None
-            hosted = None
-
-        return appR, hosted
-
-    def gal_info(xmatch,idx):
-        """
-        Returns properties of a galaxy from an Astroquery VizieR table.
-        Arguments:
-            - xmatch: the Astroquery VizieR table produced via cross-match with a transient
-            - idx: the index of the galaxy within the table
-        Outputs:
-            - name: name of the galaxy
-            - Bmag: the B-band apparent magnitude of the galaxy
-            - appR: the apparent radius of the galaxy in arcseconds from Hyper LEDA (set to None if no radius found)
-            - separ: the separtion between the galaxy and the transient in arcseconds
-            - hosted: boolean indicating if transient resides within radius of galaxy (set to None if no radius found)
-
-        Note - function returns outputs as a list.
-        """
-        #galaxy object
-        gRA = xmatch[0]["RAJ2000"][idx]
-        gDEC = xmatch[0]["DEJ2000"][idx]
-        gal = SkyCoord(ra=gRA*u.deg,dec=gDEC*u.deg)
+            appR = np.nan
 
-        separ = t.separation(gal).to(u.arcsec)
-        Bmag = xmatch[0]["Bmag"][idx]
-        name = host_name(xmatch,idx)
-
-        #query hyper leda with name for the apparent radius
-        appR, hosted = d25_from_HL(name,separ)
-
-        return [name,Bmag,appR,separ.value,hosted]
+        return appR
 
 
     ## Transients ##
-    #names of the transients
-    tnames = tlist.T[1]+tlist.T[2]
-
     #magnitudes of transients
     tmags = tlist.T[7].astype(float)
 
@@ -590,133 +826,83 @@ def xmatch_rm(tlist):
     #make skycoords object of the transients in list
     transients = SkyCoord(ra=RAs*u.deg,dec=DECs*u.deg)
 
-
-    ## Cross Matching ##
-    Xmatches = []
-    for idx, t in enumerate(transients):
-
-        #cross-match with GLADE+ catalogue via VizieR
-        xmatch = Vizier.query_region(t, radius = 1*u.arcmin, catalog = 'VII/291/gladep')
-
-        if len(xmatch) == 0: #if there is no match within 1 arcmin
-            Xmatches.append([tnames[idx],tmags[idx],None,None,None,None,None])
-
-        else: #if there is a match within 1 arcmin
-
-            if len(xmatch[0]) == 1: #if only one match
-                #find info for that galaxy
-                galaxy = gal_info(xmatch,0)
-
-            else: #if more than one loop through all that matched
-                galaxies = []
-
-                for g in range(len(xmatch[0])):
-
-                    #find info of particular galaxy
-                    G = gal_info(xmatch,g)
-                    galaxies.append(G) #add info to list
-
-
-
-                #convert galaxies list to array for masking
-                g_array = np.array(galaxies,dtype=object)
-
-
-                #mask to extract galaxies with hosted=True
-                host_mask = g_array.T[-1] == True
-                #apply mask to get galaxies that host transient
-                host_gals = g_array[host_mask]
-
-                if host_gals.shape[0] != 0:
-                #if there are host galaxies pick one with lowest sep
-                    g_IDX = host_gals.T[3].argmin() #index of lowest sep galaxy
-                    galaxy = list(host_gals[g_IDX])
-
-                else:
-                #if no host galaxies remove any known not to host transient
-                    ukwn_mask = g_array.T[-1] != False #mask for above task
-                    #apply mask leaving only galaxies didn't get radii for
-                    ukwn_gals = g_array[ukwn_mask]
-
-                    if ukwn_gals.shape[0] != 0:
-                    #if there are galaxies didn't get radii for pick lowest sep galaxy
-                        g_IDX = ukwn_gals.T[3].argmin() #index of lowest sep galaxy
-                        galaxy = list(ukwn_gals[g_IDX])
-
-                    else:
-                    #if only galaxies known not to host pick lowest sep one
-                        g_IDX = g_array.T[3].argmin()
-                        galaxy = list(g_array[g_IDX])
+    ntran = tmags.size
 
 
-            #add transient name and magnitude infront of galaxy's info
-            galaxy.insert(0,tnames[idx])
-            galaxy.insert(1,tmags[idx])
-
-            #add list to cross-matches
-            Xmatches.append(galaxy)
-
+    ## Cross Matching ##
+    #cross-match all the transients with GLADE+ in one go (or a few chunks)
+    gals = xmatch_query(transients, catalogue=catalogue, server=server)
+
+    if len(gals) != 0:
+        #properties of all the matched galaxies in one flat table
+        gals["name"] = host_names(gals)
+
+        #query hyper leda for the apparent radius of each galaxy (only once per name)
+        unames, uinv = np.unique(np.asarray(gals["name"]).astype(str), return_inverse=True)
+        gals["appR"] = np.array([d25_from_HL(name) for name in unames])[uinv]
+
+        #hosted is 1 if the transient resides within radius of galaxy, 0 if not, and -1 if no radius found
+        sep, appR = np.asarray(gals["_sep"]), np.asarray(gals["appR"])
+        gals["hosted"] = np.where(np.isnan(appR), -1, (sep <= appR).astype(int))
+
+        ## pick one galaxy per transient ##
+        #prefer galaxies that host the transient, then those didn't get radii for, then those known not to
+        #host it, and then the galaxy with lowest sep within these groups
+        rank = np.select([gals["hosted"] == 1, gals["hosted"] == -1], [0, 1], 2)
+        order = np.lexsort((sep, rank, np.asarray(gals["_idx"])))
+        gals = gals[order]
+        first = np.ones(len(gals),dtype=bool)
+        first[1:] = gals["_idx"][1:] != gals["_idx"][:-1]
+        hosts = gals[first]
+    else:
+        hosts = gals
+
+    #properties of the chosen galaxy for each transient (NaN/None if there is no match)
+    hidx = np.asarray(hosts["_idx"],dtype=int)
+    matched = np.zeros(ntran,dtype=bool)
+    matched[hidx] = True
+    hname = np.full(ntran, None, dtype=object)
+    Bmag, appR, separ = np.full(ntran,np.nan), np.full(ntran,np.nan), np.full(ntran,np.nan)
+    hosted = np.full(ntran, -1)
+    if len(hosts) != 0:
+        hname[hidx] = np.asarray(hosts["name"])
+        Bmag[hidx] = np.ma.filled(np.ma.asarray(hosts["Bmag"],dtype=float), np.nan)
+        appR[hidx] = np.asarray(hosts["appR"])
+        separ[hidx] = np.asarray(hosts["_sep"])
+        hosted[hidx] = np.asarray(hosts["hosted"])
 
-    Xmatches = np.array(Xmatches,dtype=object)
 
     ## thresholding ##
-    mask = []
-    for entry in Xmatches:
-        if entry[2] == None:
-            #discard if there is no match
-            mask.append(False)
-        else:
-            #if is host compare magnitudes
-            if entry[1] < entry[3]:
-                #keep if the transient magnitude is brighter than galaxy magnitude
-                mask.append(True)
-            else:
-                if entry[4] == None:
-                    if entry[-2] <= 2:
-                        #if no radius recorded and within 2" of host discard
-                        mask.append(False)
-                    else:
-                        #if is radius but larger sep than seeing limit then keep
-                        mask.append(True)
-                elif entry[4] == False:
-                    #if galaxy likely doesn't host transient then discard
-                    mask.append(False)
-                else:
-                    #compare radius and separation
-                    if entry[-2] <= (0.25*entry[4] + 2):
-                        #discard if target within 25% of radius from galaxy centre
-                        #plus 2" to account for seeing
-                        mask.append(False)
-                    else:
-                        #otherwise keep
-                        mask.append(True)
+    #discard if there is no match
+    #keep if the transient magnitude is brighter than galaxy magnitude
+    #if no radius recorded keep if larger sep than seeing limit (2")
+    #if there is a radius (whether or not the galaxy likely hosts the transient) discard if target within 25%
+    #of radius from galaxy centre plus 2" to account for seeing, otherwise keep
+    with np.errstate(invalid="ignore"):
+        brighter = tmags < Bmag
+        no_radius = (hosted == -1) & (separ > 2)
+        outskirts = (hosted != -1) & (separ > (0.25*appR + 2))
+    mask = matched & (brighter | no_radius | outskirts)
 
     #apply mask to tlist to remove unwanted entries
     th_list = tlist[mask]
 
-    #apply mask to list of offical names to get possible hosts
-    new_Xmatches = Xmatches[mask]
-    hosts = []
-    for entry in new_Xmatches:
-        if entry[-1] != False:
-            hosts.append(entry[2])
-        else:
-            hosts.append(None)
-    hosts = np.array(hosts,dtype="str")
+    #possible hosts are the chosen galaxies unless they likely don't host the transient
+    hosts = np.where(hosted[mask] != 0, hname[mask], None).astype(str)
 
     #return new list with possible hosts in second to last columns (before internal name)
     return np.concatenate((th_list,np.resize(hosts,(hosts.size,1))),axis=1)
 
 ################################################################################
 
-def thresholds(DB,mill):
+def cut_list(DB,mill):
     """
-    Removes targets from a database if they don't meet the thresholds of 3 different variables - observable time, lunar separation, and discovery magnitude.
+    Removes targets from a database if they don't meet the thresholds of the cheap to check variables - observable time, lunar separation, discovery magnitude, and galactic latitude.
 	Arguments:
     	- DB: numpy object array of the list of targets with RA, Dec, discovery magnitude, observable time, and lunar separation in column indices 3, 4, -4, -3, and -2 respectively.
     	- mill: the illumination percentage of the moon as a float
 	Output:
-    	- t_array: same database as ingested but with transients removed that don't meet the thresholds set.
+    	- th_list: same database as ingested but with transients removed that don't meet the thresholds set.
     """
     #set observable time threshold (min exp time is ~15mins so cant observe
     #anything with obs time less than this)
@@ -750,6 +936,23 @@ def thresholds(DB,mill):
             bad_idx.append(idx) #check galactic latitude
     th_list = np.delete(DB,bad_idx,0) #deletes rows with no observable time
 
+    return th_list
+
+################################################################################
+
+def thresholds(DB,mill):
+    """
+    Removes targets from a database if they don't meet the thresholds of 3 different variables - observable time, lunar separation, and discovery magnitude, or are too close to a galaxy.
+	Arguments:
+    	- DB: numpy object array of the list of targets with RA, Dec, discovery magnitude, observable time, and lunar separation in column indices 3, 4, -4, -3, and -2 respectively.
+    	- mill: the illumination percentage of the moon as a float
+	Output:
+    	- t_array: same database as ingested but with transients removed that don't meet the thresholds set.
+    """
+
+    #remove entries that fail the cheap cuts
+    th_list = cut_list(DB,mill)
+
     ## Galaxy separations ##
     #execute galaxy separation thresholding
     t_array = xmatch_rm(th_list)
@@ -759,19 +962,119 @@ def thresholds(DB,mill):
 
 ################################################################################
 
-def pscore(database,weights,moon_per):
+def lazy_xmatch(th_list, weights, topK, chunk=None):
     """
-	Filters a database of targets by removing all those with zero observable time and then calculates the rest's priority score, which depends on the target's ranking in observable time, transit altitude, lunar separation, brightness and time since discovery. The filtered database is then saved  as a numpy array with the priority scores as the final column.
+    Cross-matches the targets that passed the cheap cuts in order of their provisional priority score until
+    enough of them have survived the galaxy separation thresholding, so the number of expensive lookups scales
+    with the number of targets acted on rather than the size of the list.
+    Arguments:
+        - th_list: numpy object array of targets that passed the cheap cuts (i.e., output of cut_list)
+        - weights: list of the weightings used to calculate the priority scores (see pscore)
+        - topK: number of targets that need to survive the cross-matching
+        - chunk: number of targets to cross-match at a time (default is None - i.e., topK)
+    Outputs:
+        - x_list: the targets that survived the cross-matching with their possible hosts added as the final column
+            (same as output of xmatch_rm), in order of their provisional priority score
+        - tail: the targets from th_list that have not been cross-matched yet
+    """
+
+    if chunk is None:
+        chunk = topK
+
+    if th_list.size == 0:
+        return xmatch_rm(th_list), th_list
+
+    #order the targets by their provisional priority score (highest priority first)
+    provisional = rank_scores(th_list,weights)
+    th_list = th_list[np.argsort(provisional, kind="stable")]
+
+    #cross-match in chunks until there are enough survivors
+    survivors = []
+    nsurv, start = 0, 0
+    while (nsurv < topK) and (start < th_list.shape[0]):
+        x_chunk = xmatch_rm(th_list[start:start+chunk])
+        survivors.append(x_chunk)
+        nsurv += x_chunk.shape[0]
+        start += chunk
+
+    x_list = np.concatenate(survivors,axis=0)
+    tail = th_list[start:]
+
+    return x_list, tail
+
+################################################################################
+
+def rank_scores(t_array,weights):
+    """
+	Calculates the priority scores of a list of targets from their rankings in observable time, lunar separation, brightness and time since discovery.
 	Arguments:
-    	- database: numpy object array of the list of targets (ID first column and the observable time, and lunar separation in last 3 columns)
-    	- weights: list of numbers to weight the contributions towards the priority score for the  observable time, transit altitude, and lunar separation
-        - moon_per: percentage illumination of the moon used to set threshold for the lunar separation
+    	- t_array: numpy object array of the list of targets (ID first column, discovery date, magnitude, observable time, and lunar separation in column indices 5, 7, 8 and 9)
+    	- weights: list of numbers to weight the contributions towards the priority score for the  observable time, lunar separation, magnitude, and discovery date
 	Outputs:
-    	- t_targets: new numpy object array with the remaining targets and their priority scores in the final column
+    	- pscores: numpy array of the priority scores of the targets in the same order as t_array (between 0 (high) and 5 (low))
     """
 
-    #remove all entries that don't fit within the thresholds
-    t_array = thresholds(database,moon_per)
+    if t_array.shape[0] == 1:
+        #if only one transient then don't calcuate pscore
+        return np.array([0])
+
+    #save remaining IDs
+    IDs = t_array.T[0]
+
+    #convert strings into useable quantities
+    disc = np.array([dt.datetime.strptime(date, "%Y-%m-%d %H:%M:%S.%f") for date in t_array.T[5]])
+    #discovery dates as datetime objects
+
+    mag = np.array(t_array.T[7],dtype="float") #magnitudes as floats
+    tobs = np.array(t_array.T[8],dtype="float") #observable time as decimal hour
+    lsep = np.array(t_array.T[9],dtype="float") #lunar separation as decimal angle
+
+    varbs = [tobs,lsep,mag,disc] #list containing the variables needed to calculate the pscores
+
+    #makes a ordered list of each variable with their ID
+    ivarbs = []
+    for varb in varbs:
+    	I = np.concatenate((np.resize(IDs,(IDs.size,1)),np.resize(varb,(varb.size,1))),axis=1)
+    	#sort the array by ascending priority score (column index = -1)
+    	I = I[I[:, -1].argsort()]
+    	ivarbs.append(I)
+
+    #calculate the pscores
+    pscores = []
+    sz = IDs.size
+    for ID in IDs:
+    	#looks for where the ID is in each of the sorted lists
+    	#then calculates its score by doing (size of the array - index)
+    	#this is so that high index IDs (i.e., higher values) get lower pscore which = higher priority
+    	scores = []
+    	scores.append(sz-np.where(ivarbs[0]==ID)[0][0])
+    	scores.append(sz-np.where(ivarbs[1]==ID)[0][0])
+    	scores.append(np.where(ivarbs[2]==ID)[0][0]) #no subtraction as we want the brightest objects (low mag)
+    	scores.append(sz-np.where(ivarbs[3]==ID)[0][0])
+
+    	#combine scores for different variables into one and apply weightings
+    	score = sum(np.array(scores)*np.array(weights))
+    	#weights applied by multiplication so some variables will contribute more to the final score
+
+    	pscores.append(score)
+    pscores = np.array(pscores,dtype=int)
+
+    #normalise so scores are between 0 (high) and 5 (low)
+    pscores=((pscores-np.min(pscores))/np.max(pscores-np.min(pscores)) * 5)
+
+    return pscores
+
+################################################################################
+
+def score_list(t_array,weights):
+    """
+	Calculates the priority scores of a list of targets that has already been thresholded and orders the list by them.
+	Arguments:
+    	- t_array: numpy object array of the thresholded targets (i.e., output of thresholds)
+    	- weights: list of numbers to weight the contributions towards the priority score (see rank_scores)
+	Outputs:
+    	- t_targets: new numpy object array with the targets and their priority scores in the final column
+    """
 
     #check the lenth of the thresholded array
     if t_array.size == 0:
@@ -779,54 +1082,7 @@ def pscore(database,weights,moon_per):
         print("none")
         return t_array
 
-    if t_array.shape[0] == 1:
-        #if only one transient remains after cuts then don't calcuate pscore
-        pscores = np.array([[0]])
-
-    else:
-        #save remaining IDs
-        IDs = t_array.T[0]
-
-        #convert strings into useable quantities
-        disc = np.array([dt.datetime.strptime(date, "%Y-%m-%d %H:%M:%S.%f") for date in t_array.T[5]])
-        #discovery dates as datetime objects
-
-        mag = np.array(t_array.T[7],dtype="float") #magnitudes as floats
-        tobs = np.array(t_array.T[8],dtype="float") #observable time as decimal hour
-        lsep = np.array(t_array.T[9],dtype="float") #lunar separation as decimal angle
-
-        varbs = [tobs,lsep,mag,disc] #list containing the variables needed to calculate the pscores
-
-        #makes a ordered list of each variable with their ID
-        ivarbs = []
-        for varb in varbs:
-        	I = np.concatenate((np.resize(IDs,(IDs.size,1)),np.resize(varb,(varb.size,1))),axis=1)
-        	#sort the array by ascending priority score (column index = -1)
-        	I = I[I[:, -1].argsort()]
-        	ivarbs.append(I)
-
-        #calculate the pscores
-        pscores = []
-        sz = IDs.size
-        for ID in IDs:
-        	#looks for where the ID is in each of the sorted lists
-        	#then calculates its score by doing (size of the array - index)
-        	#this is so that high index IDs (i.e., higher values) get lower pscore which = higher priority
-        	scores = []
-        	scores.append(sz-np.where(ivarbs[0]==ID)[0][0])
-        	scores.append(sz-np.where(ivarbs[1]==ID)[0][0])
-        	scores.append(np.where(ivarbs[2]==ID)[0][0]) #no subtraction as we want the brightest objects (low mag)
-        	scores.append(sz-np.where(ivarbs[3]==ID)[0][0])
-
-        	#combine scores for different variables into one and apply weightings
-        	score = sum(np.array(scores)*np.array(weights))
-        	#weights applied by multiplication so some variables will contribute more to the final score
-
-        	pscores.append(score)
-        pscores = np.array(pscores,dtype=int)
-
-        #normalise so scores are between 0 (high) and 5 (low)
-        pscores=((pscores-np.min(pscores))/np.max(pscores-np.min(pscores)) * 5)
+    pscores = rank_scores(t_array,weights)
 
     #concatenate the IDs, variables and the pscores
     t_targets = np.concatenate((t_array,np.resize(pscores,(pscores.size,1))),axis=1)
@@ -838,23 +1094,38 @@ def pscore(database,weights,moon_per):
 
 ################################################################################
 
+def pscore(database,weights,moon_per):
+    """
+	Filters a database of targets by removing all those with zero observable time and then calculates the rest's priority score, which depends on the target's ranking in observable time, transit altitude, lunar separation, brightness and time since discovery. The filtered database is then saved  as a numpy array with the priority scores as the final column.
+	Arguments:
+    	- database: numpy object array of the list of targets (ID first column and the observable time, and lunar separation in last 3 columns)
+    	- weights: list of numbers to weight the contributions towards the priority score for the  observable time, transit altitude, and lunar separation
+        - moon_per: percentage illumination of the moon used to set threshold for the lunar separation
+	Outputs:
+    	- t_targets: new numpy object array with the remaining targets and their priority scores in the final column
+    """
+
+    #remove all entries that don't fit within the thresholds
+    t_array = thresholds(database,moon_per)
+
+    return score_list(t_array,weights)
+
+################################################################################
+
 def flatten(l):
     "Flattens a list of lists, l"
     return [item for sublist in l for item in sublist]
 
 ################################################################################
 
-def priority_list(database,date,Slow=True):
+def _priority_table(database,date,Slow=True,now=None):
     """
-    Slices the TNS database to extract only the targets discovered or modififed in a certain time frame in the past. It then calculates the observable time and lunar separation of these targets which along with their discovery magnitude and date are used to calculate their priority scores.
-    Arguments:
-        - database: numpy array of the data from TNS database which holds one entry per line
-        - date: the date extracted from the top of the TNS database CSV file (string with format YY-MM-DD HH:MM:SS)
-        - Slow: string dictating if calculating priority scores for PEPPER Fast or PEPPER Slow surveys (default is True - i.e., PEPPER Slow. Set to False for PEPPER Fast)
+    Slices the TNS database for PEPPER Fast or Slow and works out the columns the priority scores are calculated
+    from (see priority_list for the arguments).
     Outputs:
-        - targets: numpy array consisiting of the revelant targets and their priority scores
-            - Rows are: ['objid','name_prefix','name','ra','declination','discoverydate','lastmodified',
- 'discoverymag','observable_time','lunar_sep','priority_score']
+        - newDB: numpy array of the sliced targets with their observable time, lunar separation and galactic latitude
+        - wghts: list of the weightings of the priority scores
+        - l_per: the lunar illumination percentage
     """
 
     if type(Slow) != bool:
@@ -873,7 +1144,7 @@ def priority_list(database,date,Slow=True):
             moddiff = rdate - dt.timedelta(days=3) #3 days ago
             discdiff = rdate - dt.timedelta(weeks=1) #1 week ago
         else: #i.e., slow
-            rdate = dt.datetime.combine(dt.datetime.now(), dt.datetime.min.time()) #slice from today at midnight
+            rdate = dt.datetime.combine(dt.datetime.now() if now is None else now, dt.datetime.min.time()) #slice from today at midnight
             moddiff = rdate - dt.timedelta(weeks=2) #2 weeks ago
             discdiff = rdate - dt.timedelta(weeks=12) #3 months ago (aka 12 weeks)
 
@@ -907,7 +1178,7 @@ def priority_list(database,date,Slow=True):
 
 
         #calculate observable time and lunar separation of targets
-        t_obs, l_sep, l_per = Visibility(ra, dec, lat, long, elv)
+        t_obs, l_sep, l_per = Visibility(ra, dec, lat, long, elv, now=now)
 
 
         ## calculate the galactic latitudes ##
@@ -934,431 +1205,672 @@ def priority_list(database,date,Slow=True):
         else: #i.e., slow
             wghts = [10,7,8,3] #priortise observable time and magnitude
 
-        #create database with pscores
-        pDB = pscore(newDB,wghts,l_per)
+        return newDB, wghts, l_per
+
+################################################################################
+
+@timed("priority_list")
+@traced("priority_list")
+def priority_list(database,date,Slow=True,now=None):
+    """
+    Slices the TNS database to extract only the targets discovered or modififed in a certain time frame in the past. It then calculates the observable time and lunar separation of these targets which along with their discovery magnitude and date are used to calculate their priority scores.
+    Arguments:
+        - database: numpy array of the data from TNS database which holds one entry per line
+        - date: the date extracted from the top of the TNS database CSV file (string with format YY-MM-DD HH:MM:SS)
+        - Slow: string dictating if calculating priority scores for PEPPER Fast or PEPPER Slow surveys (default is True - i.e., PEPPER Slow. Set to False for PEPPER Fast)
+        - now: datetime of the day the list is made for, e.g., to remake the lists of past nights (default is None - i.e., today)
+    Outputs:
+        - targets: numpy array consisiting of the revelant targets and their priority scores
+            - Rows are: ['objid','name_prefix','name','ra','declination','discoverydate','lastmodified',
+ 'discoverymag','observable_time','lunar_sep','priority_score']
+    """
+
+    newDB, wghts, l_per = _priority_table(database,date,Slow,now)
+
+    #create database with pscores
+    pDB = pscore(newDB,wghts,l_per)
+
+    #check pDB to see if none value
+    if pDB.size == 0:
+        return pDB
 
-        #check pDB to see if none value
-        if pDB.size == 0:
-            return pDB
+    return fink_urls(pDB)
 
+################################################################################
+
+SLOW_TOPK = 10 #number of targets at the top of the PEPPER Slow list that are cross-matched (None to cross-match the whole list)
+
+@timed("priority_list_lazy")
+@traced("priority_list_lazy")
+def priority_list_lazy(database,date,Slow=True,topK=10,background=False,now=None):
+    """
+    Same as priority_list but only cross-matches the targets in order of their provisional priority score until topK
+    of them survive, so the number of HyperLEDA/GLADE lookups grows with topK rather than the size of the list.
+    The rest are only cross-matched if the complete list is asked for with fill (or straight away in a separate thread if background is True).
+    Arguments:
+        - database, date, Slow, now: see priority_list
+        - topK: number of targets that need to survive the cross-matching for the top of the list (default is 10)
+        - background: if True the rest of the targets are cross-matched in a separate thread straight away (default is False)
+    Outputs:
+        - targets: numpy array of the top of the list (at least the topK highest priority targets that were cross-matched)
+        - fill: function that returns the complete list, i.e., the same as the output of priority_list
+    """
+
+    newDB, wghts, l_per = _priority_table(database,date,Slow,now)
+
+    #only cross-match the highest priority targets
+    th_list = cut_list(newDB,l_per)
+    x_list, tail = lazy_xmatch(th_list,wghts,topK)
+    pDB = score_list(x_list,wghts)
+    if pDB.size != 0:
+        pDB = fink_urls(pDB)
+
+    def complete():
+        #cross-match the rest of the targets and rescore the whole list
+        t_array = np.concatenate((x_list,xmatch_rm(tail)),axis=0)
+        fDB = score_list(t_array,wghts)
+        if fDB.size == 0:
+            return fDB
+        return fink_urls(fDB)
+
+    if tail.size == 0: #nothing left to cross-match
+        fill = lambda: pDB
+    elif background: #start filling in the tail now in a separate thread
+        fill = _fill.submit(complete).result
+    else:
+        fill = complete
+
+    return pDB, fill
+
+################################################################################
 
-        # urls to last column #
-        int_names = pDB.T[-3] # locally saved internal names of targets
+def save_list(path, plist, headers, date, tns_date):
+    """
+    Saves a priority score list as a CSV with a line at the top saying when it was made for and from which TNS database.
+    Arguments:
+        - path: path to save the list to
+        - plist: numpy array of the priority score list (output of priority_list)
+        - headers: the column headers of the TNS database (see loadDB)
+        - date: datetime the list was made for
+        - tns_date: the date of the TNS database used as a string
+    """
+
+    #create a new list of headers for the new database (as have removed columns and added new ones)
+    newHeaders = flatten([headers[0:5], [headers[12], headers[-1],headers[13], "observable_time", "lunar_sep", "galactic_latitude", "possible_host","priority_score", "fink_url"]])
+    #line to go before headers to give context in CSV
+    topline = [f"List calculated for {date.strftime('%Y-%m-%d %H:%M:%S')} using TNS database from {tns_date}"]
+
+    with open(path, 'w') as file:
+        csvwriter = csv.writer(file,delimiter=",") # create a csvwriter object
+        csvwriter.writerow(topline)
+        csvwriter.writerow(newHeaders) #add headers first row
+        csvwriter.writerows(plist) # write the rest of the data
 
+################################################################################
 
-        #make the url by finding the ZTF name (if it exsists)
-        urls = []
-        for entry in int_names:
+def fink_urls(pDB):
+    """
+    Replaces the internal names column of a priority list with links to the targets' pages on the Fink broker
+    (if they have a ZTF name).
+    Arguments:
+        - pDB: numpy array of the scored targets with the internal names in column index -3 (i.e., output of pscore)
+    Outputs:
+        - targets: same array with the internal names removed and the fink urls added as the final column
+    """
 
-            #check the target has ZTF internal name at all
-            if "ZTF" in entry:
-                if "," not in entry: #i.e., only internal name is ZTF name
-                    url = "https://fink-portal.org/"+entry
+    # urls to last column #
+    int_names = pDB.T[-3] # locally saved internal names of targets
 
-                else: #if it has multiple internal names
-                    stidx = entry.index("ZTF")+3 #find index where ZTF names starts (after ZTF bit)
 
-                    letter = entry[stidx] #first character of ZTF name
-                    name = "ZTF"
+    #make the url by finding the ZTF name (if it exsists)
+    urls = []
+    for entry in int_names:
 
-                    #loop through name until get to comma which indicates it has ended
-                    while (letter != ",") and (stidx < len(entry)-1):
-                        name += letter
-                        stidx +=1
-                        letter = entry[stidx]
+        #check the target has ZTF internal name at all
+        if "ZTF" in entry:
+            if "," not in entry: #i.e., only internal name is ZTF name
+                url = "https://fink-portal.org/"+entry
 
-                        url = "https://fink-portal.org/"+name
+            else: #if it has multiple internal names
+                stidx = entry.index("ZTF")+3 #find index where ZTF names starts (after ZTF bit)
 
+                letter = entry[stidx] #first character of ZTF name
+                name = "ZTF"
 
-            else:
-                url = ""
+                #loop through name until get to comma which indicates it has ended
+                while (letter != ",") and (stidx < len(entry)-1):
+                    name += letter
+                    stidx +=1
+                    letter = entry[stidx]
 
-            urls.append(url)
+                    url = "https://fink-portal.org/"+name
 
-        urls = np.array(urls)
 
+        else:
+            url = ""
+
+        urls.append(url)
+
+    urls = np.array(urls)
 
-        # combine together and array #
-        targets = np.delete(pDB.T,-3,0).T #remove internal name column
-        targets = np.concatenate((targets,np.resize(urls,(urls.size,1))),axis=1) #add urls to databse
 
-        return targets
+    # combine together and array #
+    targets = np.delete(pDB.T,-3,0).T #remove internal name column
+    targets = np.concatenate((targets,np.resize(urls,(urls.size,1))),axis=1) #add urls to databse
 
-######################### FUNCTIONS FOR EMAILS ETC. ############################
+    return targets
 
-def csv2list(fname):
+######################### FUNCTIONS FOR FOLLOW-UP ##############################
+
+def LTcoords(RA, DEC):
     """
-    This function takes in anysimple CSV file where each row contains a single entry and converts it into a list.
+    Converts RA and DEC in decimal degrees to a format that the ltrtml can understand, which is HH:MM:SS.SS and +/-DD:MM:SS.SS.
+    The seconds are given to up to 8 decimal places with trailing zeros removed (the same as astropy's hmsdms strings).
     Arguments:
-        - fname: the path to the CSV file
-    Output:
-        - lst: a list where each element is a row of the CSV file
-    """
-    with open(fname) as file:
-        lst = []
-        csvreader = csv.reader(file)
-        for row in csvreader:
-            try:
-                lst.append(row[0])
-            except: #skips any blank rows
-                continue
-    return lst
+        - RA: numpy array of RA values in decimal degrees
+        - DEC: numpy array of declination values in decimal degrees
+    Outputs:
+        - ra: list of the original RA values in format HH:MM:SS.SS
+        - dec: list of the original declination values in format +/-DD:MM:SS.SS
+    """
+
+    def sexagesimal(val):
+        """
+        Splits positive decimal values into whole units, minutes and seconds (as integer numbers of 1e-8 seconds)
+        with the seconds rounded and carried over into the minutes and units.
+        """
+        df, d = np.modf(val)
+        mf, m = np.modf(df * 60.0)
+        secs = round8(mf * 60.0) #seconds in units of 1e-8 s
+
+        #carry over if seconds round up to 60 and then minutes if they reach 60
+        carry = secs >= 60*10**8
+        secs[carry] = 0
+        m = m + carry
+        carry = m >= 60
+        m[carry] = 0
+        d = d + carry
+
+        return d.astype(np.int64), m.astype(np.int64), secs
+
+    def round8(x):
+        """
+        Rounds positive values to 8 decimal places exactly as Python's string formatting does (i.e., correctly
+        rounded with ties to even), returning them as integers in units of 1e-8. The product x*1e8 is found
+        exactly as the sum of two floats (Dekker's algorithm) so values near a tie are rounded the right way.
+        """
+        p = x * 1e8
+        #split x and 1e8 into high and low halves so their products are exact
+        c = 134217729.0 * x
+        xh = c - (c - x)
+        xl = x - xh
+        bh, bl = 100000000.0, 0.0 #1e8 fits in half a float
+        err = ((xh*bh - p) + xh*bl + xl*bh) + xl*bl #exact x*1e8 = p + err
+
+        q = np.floor(p)
+        frac = (p - q) + err
+        q = q + (frac >= 1.0) - (frac < 0.0)
+        frac = frac - (frac >= 1.0) + (frac < 0.0)
+        up = (frac > 0.5) | ((frac == 0.5) & (q % 2 == 1))
+        return (q + up).astype(np.int64)
+
+    def fmt(d, m, secs, sep):
+        #join the parts together with colons, with trailing zeros removed from the seconds
+        whole = np.char.zfill((secs // 10**8).astype(str), 2)
+        frac = np.char.rstrip(np.char.zfill((secs % 10**8).astype(str), 8), "0")
+        frac = np.where(frac == "", "", np.char.add(".", frac))
+        out = np.char.add(np.char.zfill(d.astype(str), 2), sep)
+        out = np.char.add(np.char.add(out, np.char.zfill(m.astype(str), 2)), sep)
+        return np.char.add(np.char.add(out, whole), frac)
+
+    RA = np.atleast_1d(np.asarray(RA, dtype=float))
+    DEC = np.atleast_1d(np.asarray(DEC, dtype=float))
+
+    #RA in hours wrapped to 0-24h
+    ra = fmt(*sexagesimal((RA % 360) * u.deg.to(u.hourangle)), ":")
+
+    #declination with its sign always shown
+    sign = np.where(np.signbit(DEC), "-", "+")
+    dec = np.char.add(sign, fmt(*sexagesimal(np.abs(DEC)), ":"))
+
+    return ra.tolist(), dec.tolist()
+
+################################################################################
+
+LT_LOG_URL = "https://telescope.livjm.ac.uk/data/archive/webfiles/Logs/lt/" #where the LT night logs are released
+
+@timed("poll_log")
+def poll_log(date, path, url=LT_LOG_URL, interval=60, max_interval=1800, deadline=18*3600, stop=None):
+    """
+    Waits for the LT night log of a given night to be released and downloads it. Conditional GETs are used so
+    an unchanged "not found" page isn't downloaded again, and the time between tries doubles up to a maximum.
+    Arguments:
+        - date: the date of the start of the night as a string in the format YYYYMMDD
+        - path: path to save the log to
+        - url: the address of the directory the logs are released to (default is LT_LOG_URL)
+        - interval: seconds to wait after the first failed try (default is 60)
+        - max_interval: maximum number of seconds to wait between tries (default is 1800)
+        - deadline: number of seconds after which to stop trying (default is 18hrs)
+        - stop: threading.Event that stops the polling early when set (default is None)
+    Outputs:
+        - Log: list of the lines of the log (None if it wasn't released before the deadline or polling was stopped)
+    """
+
+    session = counted_session()
+    validators = {} #ETag and Last-Modified of the last response for conditional GETs
+    tend = time.monotonic() + deadline
+    wait = interval
+
+    while True:
+        try:
+            r = session.get(f"{url}/{date}.log", headers=validators, timeout=60)
+
+            if (r.status_code == 200) and ("<p>The requested URL was not found on this server.</p>" not in r.text):
+                #log has been released so save it
+                with open(path, "w") as L:
+                    L.write(r.text)
+                return r.text.splitlines(keepends=True)
+
+            #log not released yet (a 304 means nothing has changed since the last try)
+            if "ETag" in r.headers:
+                validators["If-None-Match"] = r.headers["ETag"]
+            if "Last-Modified" in r.headers:
+                validators["If-Modified-Since"] = r.headers["Last-Modified"]
+
+        except requests.RequestException as e:
+            print(f"Could not reach the LT log server: {e}")
+
+        #wait and try again (unless past the deadline)
+        remaining = tend - time.monotonic()
+        if remaining <= 0:
+            print(f"LT log for {date} was not released within {deadline/3600:.1f} hrs.")
+            return None
+
+        if stop is None:
+            time.sleep(min(wait, remaining))
+        elif stop.wait(min(wait, remaining)): #returns True if the polling was stopped
+            return None
+
+        wait = min(wait*2, max_interval)
 
 ################################################################################
 
-def array2html(headers,database,path):
+def poll_log_async(date, path, **kwargs):
     """
-    Function converts a numpy array with headers to a html table. The table must have a column called 'name' which is the TNS name (minus the prefix) and the columnn headers must be in the second row (index 1) - the first row must be a dummy row.
+    Waits for the LT night log (see poll_log) in a background thread so other work can carry on in the meantime.
     Arguments:
-        - headers: list of strings to be headers for html table
-        - database: the numpy array of data the html table contains
-        - path: path you want to save the html table to
-    Output:
-        - saves the HTML table to specified path
-    """
-
-    #try: #may not be possible if databse is empty
-    df = pd.DataFrame(database, columns = headers)
-    df['name'] = '<a href=' + "https://www.wis-tns.org/object/" + df['name'] + '><div>' + df['name'] +'</div></a>' #click tns name to take to website
-    html = df.to_html(escape=False, justify = "left",index = False, render_links=True)
-    with open(path, "w") as file:
-        file.write(html)
-    #except:
-        #print("HTML table failed")
+        - date: the date of the start of the night as a string in the format YYYYMMDD
+        - path: path to save the log to
+        - kwargs: any other arguments to pass to poll_log
+    Outputs:
+        - future: concurrent.futures.Future whose result is the list of lines of the log (or None)
+        - stop: threading.Event which can be set to stop the polling
+    """
+    stop = threading.Event()
+    future = _background.submit(poll_log, date, path, stop=stop, **kwargs)
+    return future, stop
 
 ################################################################################
 
-def visplots(lists):
+LogRecord = namedtuple("LogRecord", ["proposal", "exptime", "fname", "uid", "line"]) #an observation in the LT log
+
+def parse_log(Log):
     """
-    Makes the visiblity plots of the top priority targets from the PEPPER fast and slow lists.
+    Reads the LT night log once into records of each observation, indexed by their group UID.
     Arguments:
-        - lists: a list containing the paths to the two priority score lists
-    Outpts:
-        - apath: the path to the JPEG file of the visiblity plots that was created.
+        - Log: list of the lines of the LT log (e.g., output of poll_log)
+    Outputs:
+        - index: dict with the group UIDs as keys and lists of LogRecords of the observations in that group as values
     """
 
-    # DATES #
-    today = dt.datetime.combine(dt.datetime.now(), dt.datetime.min.time()) + dt.timedelta(days=0.5)
-    today =today.replace(tzinfo=utc)
-    tomorrow = today + dt.timedelta(days=1) #next day at midday
-    tomorrow = tomorrow.replace(tzinfo=utc)
+    index = {}
+    for line in Log:
+        cols = line.split()
+        if len(cols) < 15: #skip headers and blank lines
+            continue
+        try:
+            exptime = float(cols[10])
+        except ValueError: #not an observation row
+            continue
+        record = LogRecord(cols[2], exptime, cols[13], cols[14], line)
+        index.setdefault(record.uid, []).append(record)
 
-    #location of Liverpool Telescope
-    lat = 28.6468866 #latitude in degs
-    long = -17.7742491 #longitude in degs
-    elv = 2326.0 #elevation in metres
+    return index
 
-    ### Set-up sky-field observing ##
-    location = wgs84.latlon(lat * N, long * E, elevation_m = elv) #location of observatory
-    ts = load.timescale() #loads in timescale
-    eph = load('de421.bsp')  #loads in ephemerides
-    #sets up sun, earth (needed for calculating dark time and our location respectivly) and moon (for illumination, etc.)
-    earth, sun, moon = eph['earth'], eph['sun'], eph['moon']
-    Epos = earth + location #sets up observing position (i.e., the postion of the follow-up telescope)
+################################################################################
 
-    #makes time objects from today and tomorrow
-    t0 = ts.from_datetime(today)
-    t1 = ts.from_datetime(tomorrow)
+def match_log(Log, rtargets, r_texp, propID, date):
+    """
+    Finds which of the requested targets were observed in the LT night log.
+    Arguments:
+        - Log: list of the lines of the LT log (e.g., output of poll_log)
+        - rtargets: list of tuples of the names of the requested targets and the UIDs of their requests
+        - r_texp: the exposure time requested for each target in seconds
+        - propID: the LT proposal ID used for the requests
+        - date: the date of the start of the night as a string in the format YYYY-MM-DD
+    Outputs:
+        - observations: list of rows for observations.csv, one per requested target
+        - slog: list of the lines of the log that contain the requested targets
+        - completed: list of the names of targets observed for the full time requested
+    """
 
-    ### Load in the sunrise/set and twilight times ###
-    with open('../xOUTPUTS/solar_times.json') as json_file:
-        sdict = json.load(json_file)
-    #save them as time objects in skyfield
-    sunset = ts.utc(
-    int(sdict["nightstart_date"][0:4]), int(sdict["nightstart_date"][5:7]), int(sdict["nightstart_date"][8:]),
-    int(sdict["sunset"][0:2]), int(sdict["sunset"][3:5]), int(sdict["sunset"][6:])
-    )
-    darkstart = ts.utc(
-    int(sdict["nightstart_date"][0:4]), int(sdict["nightstart_date"][5:7]), int(sdict["nightstart_date"][8:]),
-    int(sdict["darkstart"][0:2]), int(sdict["darkstart"][3:5]), int(sdict["darkstart"][6:])
-    )
-    darkend = ts.utc(
-    int(sdict["nightend_date"][0:4]), int(sdict["nightend_date"][5:7]), int(sdict["nightend_date"][8:]),
-    int(sdict["darkend"][0:2]), int(sdict["darkend"][3:5]), int(sdict["darkend"][6:])
-    )
-    sunrise = ts.utc(
-    int(sdict["nightend_date"][0:4]), int(sdict["nightend_date"][5:7]), int(sdict["nightend_date"][8:]),
-    int(sdict["sunrise"][0:2]), int(sdict["sunrise"][3:5]), int(sdict["sunrise"][6:])
-    )
-
-    #set up figure
-    fig, ax = plt.subplots(1,2,figsize=(20,10))
-
-    for j, fpath in enumerate(lists):
-        ## format the plots ##
-        ax[j].plot((sunset.utc_datetime(),sunrise.utc_datetime()),(0,0),color="grey",alpha=0.5,zorder=0) #horizon
-        ax[j].plot((sunset.utc_datetime(),sunrise.utc_datetime()),(35,35),color="grey",alpha=0.5,zorder=0) #lower alt limit
-
-        ax[j].vlines(darkstart.utc_datetime(), 0,90,color="grey",alpha=0.5,zorder=0)
-        ax[j].vlines(darkend.utc_datetime(), 0,90,color="grey",alpha=0.5,zorder=0)
-        ax[j].vlines(today + dt.timedelta(days=0.5), 0,90,color="grey",alpha=0.5,zorder=0)
-
-        #annotations
-        ax[j].annotate("End of Twilight", (darkstart.utc_datetime(),88),ha='center')
-        ax[j].annotate("Start of Twilight", (darkend.utc_datetime(),88),ha='center')
-        ax[j].annotate("Midnight", (today + dt.timedelta(days=0.5),88),ha='center')
-        ax[j].annotate("Horizon", (sunset.utc_datetime(),1),(10,0),textcoords="offset pixels")
-        ax[j].annotate("Airmass Lower Limit", (sunset.utc_datetime(),36),(10,0),textcoords="offset pixels")
-
-        #backgrounds
-        ax[j].axhspan(35, 0, facecolor='grey', alpha=0.2)
-        ax[j].axhspan(0, -90, facecolor='grey', alpha=0.4)
-
-        #formatting the plot
-        xfmt = mdates.DateFormatter('%H:%M')
-        ax[j].xaxis.set_major_formatter(xfmt)
-        ax[j].set_xlabel("UTC Time")
-        ax[j].set_ylabel("Altitude (degrees)")
-        ax[j].set_xlim((sunset.utc_datetime(),sunrise.utc_datetime()))
-        ax[j].set_ylim(0,90)
-        ax[j].set_title(f"Visibility of highest priority transients from {os.path.basename(fpath)[0:-13]} during dark time on La Palma ({today.strftime('%Y-%m-%d')})")
-
-        ax[j].grid(linestyle = ':')
-
-
-        #ingest the Pscore File
-        dummy, dummy, plist = loadDB(fpath)
-
-        nrows = plist.shape[0] #number of rows in original list
-
-        # check the number of rows in the pscore list
-        if nrows > 5: #if over 5 pick the top 5
-            top = plist[0:5]
-        elif nrows != 0: #if less than 5 and greater than 0 then pick all
-            top = plist[0:]
-        else: #if no rows (blank list) then skip
-            continue
+    index = parse_log(Log)
 
-        names = top.T[1]+top.T[2] #TNS name of each target
-        RA = top.T[3].astype(float)/15 #convert to decimal hours
-        dec = top.T[4].astype(float) #declination
+    observations, slog, completed = [], [], []
+    for name, uid in rtargets:
+        #observations of the target are in the group with its UID
+        trows = [rec for rec in index.get(uid, []) if name in rec.line]
+        slog.extend(rec.line for rec in trows)
 
-        trows = top.shape[0] #number of rows in list of top entries
+        if len(trows) == 0:
+            #if target was not observed
+            observed = False
+            fname_root = "n/a"
+            propid = propID
+            groupid = uid
 
-        talts = []
-        for n in range(trows):
-            tar =  Star(ra_hours=RA[n],dec_degrees=dec[n])
+        else:
+            observed = True
 
-            Time = sunset
+            #calculate percentage of observations completed
+            pc = sum(rec.exptime for rec in trows)/r_texp
+            if pc >= 1:
+                #if the target has been observed for full time requested
+                completed.append(name)
 
-            altitudes = []
-            times = []
+            #extract proposal and group ids from the first log entry for the target
+            propid = trows[0].proposal
+            groupid = trows[0].uid
 
-            while Time.utc_datetime() < sunrise.utc_datetime():
-                astro = Epos.at(Time).observe(tar)
-                app = astro.apparent()
-                #observers star at time from position
+            #extract the root file name from the first log entry for the target
+            split_fname = trows[0].fname.split("_") #split using underscores
+            fname_root = f"{split_fname[1]}_{split_fname[2]}_{split_fname[3]}"
 
-                alt, az, distance = app.altaz()
+        #add target's info to list
+        observations.append([date, propid, groupid, name[0:2], name[2:], observed, fname_root])
 
-                altitudes.append(alt.degrees)
-                times.append(Time.utc_datetime())
+    return observations, slog, completed
 
-                Time += dt.timedelta(hours=0.1)
+################################################################################
 
-            talts.append(altitudes)
+######################### FUNCTIONS FOR REQUEST RECORDS ########################
 
-        for i in range(trows):
-            ax[j].plot(times,talts[i],"--",label=names[i])
+RECORDS = "../xOUTPUTS/request_records.jsonl" #journal of all the requests made to the LT
 
-        ax[j].legend(loc='center left', bbox_to_anchor=(1, 0.5))
+def _records_index(path=RECORDS):
+    """
+    Loads the index of the request records journal, which gives the byte offsets of the entries for each date.
+    The index is brought up to date with any entries after the last one it covers (or rebuilt if lost), and a
+    journal is made from the old request_records.json if there isn't one yet.
+    Arguments:
+        - path: path to the journal (default is RECORDS)
+    Outputs:
+        - index: dict with "size" (bytes of the journal covered) and "dates" (dict of dates to lists of offsets)
+    """
 
+    #make the journal from the old JSON records if this is the first time it's used
+    old = path[:-1] if path.endswith(".jsonl") else None
+    if (not os.path.isfile(path)) and (old is not None) and os.path.isfile(old):
+        with open(old) as fp:
+            allreqs = json.load(fp)
+        with open(path, "w") as fp:
+            for date in allreqs:
+                for name in allreqs[date]:
+                    fp.write(json.dumps({"date":date, "name":name, "record":allreqs[date][name]})+"\n")
+
+    index = {"size":0, "dates":{}}
+    if os.path.isfile(f"{path}.idx"):
+        try:
+            with open(f"{path}.idx") as fp:
+                index = json.load(fp)
+        except ValueError: #corrupted index so rebuild it
+            index = {"size":0, "dates":{}}
+
+    if not os.path.isfile(path):
+        return {"size":0, "dates":{}}
+
+    #index any entries the index doesn't cover yet
+    size = os.path.getsize(path)
+    if size < index["size"]: #journal was replaced so rebuild index
+        index = {"size":0, "dates":{}}
+    if size > index["size"]:
+        with open(path, "rb") as fp:
+            fp.seek(index["size"])
+            offset = index["size"]
+            for line in fp:
+                if not line.endswith(b"\n"): #incomplete line from a crash mid-write
+                    break
+                try:
+                    date = json.loads(line)["date"]
+                    index["dates"].setdefault(date, []).append(offset)
+                except ValueError: #skip corrupted lines
+                    pass
+                offset += len(line)
+        index["size"] = offset
+        _write_atomic(f"{path}.idx", json.dumps(index))
+
+    return index
 
-    #save
-    plt.tight_layout()
-    apath = f"../xOUTPUTS/top_visplots_{today.strftime('%Y%m%d')}.jpg"
-    plt.savefig(apath,dpi=600)
-    plt.close()
+################################################################################
 
-    return apath
+def _write_atomic(path, text):
+    "Writes text to a file by writing to a temporary file and then moving it into place, so the file is never half written."
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as fp:
+        fp.write(text)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(tmp, path)
 
-######################### FUNCTIONS FOR FOLLOW-UP ##############################
+################################################################################
 
-def LTcoords(RA, DEC):
+def load_requests(date, path=RECORDS):
     """
-    Converts RA and DEC in decimal degrees to a format that the ltrtml can understand, which is HH:MM:SS.SS and +/-DD:MM:SS.SS.
+    Loads the requests made to the LT for a night from the request records journal.
     Arguments:
-        - RA: numpy array of RA values in decimal degrees
-        - DEC: numpy array of declination values in decimal degrees
+        - date: the date of the start of the night as a string in the format YYYY-MM-DD
+        - path: path to the journal (default is RECORDS)
     Outputs:
-        - ra: list of the original RA values in format HH:MM:SS.SS
-        - dec: list of the original declination values in format +/-DD:MM:SS.SS
+        - reqs: dict of the requests made for that night (e.g., "Request-1" and "Request-2") with the info about
+            each request (see request) as values. Empty if no requests were made.
     """
 
-    #convert all coords into a astropy coordinates object
-    coords = SkyCoord(RA,DEC,unit="deg")
+    index = _records_index(path)
+
+    reqs = {}
+    if date in index["dates"]:
+        with open(path, "rb") as fp:
+            for offset in index["dates"][date]:
+                fp.seek(offset)
+                entry = json.loads(fp.readline())
+                reqs[entry["name"]] = entry["record"] #later entries replace earlier ones
 
-    #convert all coordinates into strings with units hmsdms
-    cstr = coords.to_string("hmsdms")
+    return reqs
+
+################################################################################
+
+def save_request(date, name, req_info, path=RECORDS):
+    """
+    Appends a request made to the LT to the request records journal.
+    Arguments:
+        - date: the date of the start of the night as a string in the format YYYY-MM-DD
+        - name: name of the request (e.g., "Request-1" or "Request-2")
+        - req_info: dict of the info about the request (output of request)
+        - path: path to the journal (default is RECORDS)
+    Outputs:
+        - appends the request to the journal and updates its index
+    """
 
-    Ra, Dec = [], [] #empty lists to newly formatted RA and DEC to
+    index = _records_index(path)
+
+    line = (json.dumps({"date":date, "name":name, "record":req_info})+"\n").encode()
+    with open(path, "ab+") as fp:
+        offset = fp.tell()
+        if offset != 0:
+            fp.seek(offset-1)
+            if fp.read(1) != b"\n": #finish off an incomplete line from a crash mid-write
+                fp.write(b"\n")
+                offset += 1
+        fp.write(line) #single write of a whole line so a crash can't leave part of an entry before the next
+        fp.flush()
+        os.fsync(fp.fileno())
+
+    if offset == index["size"]: #if nothing else has been added since the index was loaded
+        index["dates"].setdefault(date, []).append(offset)
+        index["size"] = offset + len(line)
+        _write_atomic(f"{path}.idx", json.dumps(index))
 
-    for i in range(RA.size):
+################################################################################
 
-        #split apart the string to isolate ra and dec
-        splt = cstr[i].index(" ")
-        ra = list(cstr[i][0:splt-1])
-        dec = list(cstr[i][splt+1:-1])
+def compact_requests(path=RECORDS):
+    """
+    Rewrites the request records journal keeping only the latest entry of each request for each night.
+    Arguments:
+        - path: path to the journal (default is RECORDS)
+    Outputs:
+        - replaces the journal and its index with the compacted versions
+    """
 
-        #had to convert ra and dec into lists so could change the elements
-        #chnaging from HhMmSs DdMmSs to H:M:S D:M:S as this is format ltrtml needs
-        ra[2]=":"
-        ra[5]=":"
-        dec[3]=":"
-        dec[6]=":"
-        ra = "".join(ra)
-        dec = "".join(dec)
+    index = _records_index(path)
 
-        #add to lists
-        Ra.append(ra)
-        Dec.append(dec)
+    lines = []
+    for date in index["dates"]:
+        for name, record in load_requests(date, path).items():
+            lines.append(json.dumps({"date":date, "name":name, "record":record})+"\n")
 
-    return Ra, Dec
+    _write_atomic(path, "".join(lines))
+    os.remove(f"{path}.idx") #rebuilt next time it's needed
+    _records_index(path)
 
 ################################################################################
 
-def request(plist, blacklist, times):
+####################### FUNCTIONS FOR THE OBSERVATIONS CSV #####################
+
+OBSERVATIONS = "../xOUTPUTS/observations.csv" #all requested observations and whether they were observed
+OBS_HEADERS = ["night_start","prop_id","group_id","name_prefix","name","observed","fname_root"]
+
+def _obs_index(path=OBSERVATIONS):
     """
-    Tries to sends observations requests of the highest priority transients from
-    a specified priority score list to the Liverpool Telescope.
+    Loads the index of the observations CSV, which gives the byte offsets of the rows for each date and of the rows
+    that were observed for each night and proposal. The index is brought up to date with any rows after the last
+    one it covers (or rebuilt if lost), so only new rows are ever read.
     Arguments:
-        - plist: path to the priority score list
-        - blacklist: list of transient names not to be included in requests
-        - times: a dict containing the start and end times and dates for the
-            request as strings in the format "YYYY-MM-DD" for dates and
-            "HH:MM:SS" for times.
+        - path: path to the observations CSV (default is OBSERVATIONS)
     Outputs:
-        - req_info: a dict containg the information regarding the request including:
-            the status of the request, the UID (if request worked), the targets' names
-            and coordinates, the constraints for the observations, and the se-up.
-    """
-
-    #blank dict to add info of morning request to
-    req_info = {}
-
-    # load in the PEPPER Fast priority list CSV file
-    dummy, dummy2, flist = loadDB(plist)
-
-    #remove any entries from the priority list which are in the black list
-    bad_idx = [] #empty list to add bad indices to
-    for idx, entry in enumerate(flist):
-        if (entry[1]+entry[2]) in blacklist: #check if transient name is in black_list
-            bad_idx.append(idx) #if it is append to bad indices list
-    flist = np.delete(flist,bad_idx,0) #deletes bad rows
-
-    if flist.shape[0] == 0: #check if there are targets in the list
-        print("No sutible targets to request observations of.")
-        req_info["status"] = "No requests made." #add status
-
-    else: #if there are targets then can submit observations to the LT
-
-        ### Extract targets to request observations of ###
-        #only extract targets with a priorty scores less than 0.5 and if min > 0.5 then the first target
-        pmin = np.min(flist.T[-2].astype(float))
-        if pmin < 0.5:
-            bad_idx = [] #empty list to add bad indices to
-            for idx, entry in enumerate(flist):
-                if float(entry[-2]) > 0.5: #check the pscore the target
-                    bad_idx.append(idx) #if greater than 0.5 append to bad indices list
-            top = np.delete(flist,bad_idx,0) #deletes bad rows
-        else:
-            top = np.array([flist[0]])
-
-        #create list of dicts containing the transients names and RA and Dec in correct format for ltrtml
-        names = top.T[1]+top.T[2]
-        RA = top.T[3].astype(float)
-        DEC = top.T[4].astype(float)
-
-        ra, dec = LTcoords(RA,DEC)
-
-        #make list of target dicts
-        targets = []
-        for i in range(len(ra)):
-            targets.append( {"name":names[i],"RA":ra[i],"DEC":dec[i]} )
-        #add targets to the requests record
-        req_info["targets"]=targets
-
-        # load in the observating parameters
-        # open file containing the times sunset/rise and twilight times for the night ahead
-        with open('obs_prams.json') as json_file:
-            obs_prams = json.load(json_file)
-
-
-        ### Set up constraints ###
-
-        # start date and time
-        sdate = times["start_date"]
-        stime = times["start_time"]
-
-        # end date and time
-        edate = times["end_date"]
-        etime = times["end_time"]
-
-        # make the constraints dict
-        constraints = {
-            'air_mass': obs_prams['air_mass'],      # 1.74 airmass corresponds to 35deg alt
-            'sky_bright': obs_prams['sky_bright'], # any as targets shouldn't be near moon
-            'seeing': obs_prams["seeing"],        # Maximum allowable FWHM seeing in arcsec
-            'photometric': 'yes',                # Photometric conditions, ['yes', 'no']
-            'start_date': sdate,                # Start Date should be today
-            'start_time': stime,               # Start Time should be when darktime starts
-            'end_date': edate,                # End Date should be next day
-            'end_time': etime,               # End Time when
-        }
-        # add constraints to the request record
-        req_info["constraints"]=constraints
-
-
-        ### Set up observations ###
-        # we want to observe with MOPTOP in the R-band for 880s with slow rot speed for all targets
-
-        # make a list of observation dicts for each target
-        obs = []
-        for target in targets:
-            observation = {
-                'instrument': 'Moptop',
-                'target': target,
-                'filters': {obs_prams["filter"]: {'exp_time': obs_prams['exp_time'],
-                                  'rot_speed': obs_prams['rot_speed']}}}
-            obs.append(observation)
-        #add info from obsevation to set-up part of request record
-        set_up = {
-            'instrument': 'Moptop',
-            'filter': obs_prams['filter'],
-            'exp_time': obs_prams['exp_time'],
-            'rot_speed': obs_prams['rot_speed']
-            }
-        req_info["set_up"]=set_up
-
-
-        ### Set up the credentials ###
-        # need to load the settings in from separate json - these are secrete so don't publish
-
-        with open('LT_creds.json') as json_file:
-            settings = json.load(json_file)
-
-
-        ### Set up connection to the LT ###
+        - index: dict with "size" (bytes of the CSV covered), "dates" (dict of dates to lists of offsets) and
+            "observed" (dict of {YYYYMMDD}_{propID} to lists of offsets of the rows that were observed)
+    """
+
+    blank = {"size":0, "dates":{}, "observed":{}}
+    index = blank
+    if os.path.isfile(f"{path}.idx"):
         try:
-            obs_object = ltrtml.LTObs(settings)
+            with open(f"{path}.idx") as fp:
+                index = json.load(fp)
+        except ValueError: #corrupted index so rebuild it
+            index = blank
+
+    if not os.path.isfile(path):
+        return blank
+
+    #index any rows the index doesn't cover yet
+    size = os.path.getsize(path)
+    if size < index["size"]: #CSV was replaced so rebuild index
+        index = {"size":0, "dates":{}, "observed":{}}
+    if size > index["size"]:
+        with open(path, "rb") as fp:
+            if index["size"] == 0: #skip the description and headers
+                fp.readline(), fp.readline()
+            else:
+                fp.seek(index["size"])
+            offset = fp.tell()
+            for line in fp:
+                if not line.endswith(b"\n"): #incomplete row still being written
+                    break
+                row = next(csv.reader([line.decode()]), [])
+                if len(row) >= 6:
+                    index["dates"].setdefault(row[0], []).append(offset)
+                    if row[5] == "True":
+                        index["observed"].setdefault(f"{''.join(row[0].split('-'))}_{row[1]}", []).append(offset)
+                offset += len(line)
+        index["size"] = offset
+        _write_atomic(f"{path}.idx", json.dumps(index))
+
+    return index
 
+################################################################################
+
+def _read_rows(path, offsets):
+    "Reads the rows of a CSV starting at the given byte offsets."
+    rows = []
+    with open(path, "rb") as fp:
+        for offset in offsets:
+            fp.seek(offset)
+            rows.append(next(csv.reader([fp.readline().decode()])))
+    return rows
+
+################################################################################
+
+def load_observations(date, path=OBSERVATIONS):
+    """
+    Loads the observations of a night from the observations CSV, reading only the rows for that night.
+    Arguments:
+        - date: the date of the start of the night as a string in the format YYYY-MM-DD
+        - path: path to the observations CSV (default is OBSERVATIONS)
+    Outputs:
+        - headers: list of the column headers
+        - rows: numpy object array of the rows for that night (empty if there are none)
+    """
+
+    index = _obs_index(path)
+    rows = _read_rows(path, index["dates"].get(date, []))
+
+    return OBS_HEADERS, np.array(rows, dtype="object").reshape(-1, len(OBS_HEADERS))
+
+################################################################################
+
+def save_observations(observations, path=OBSERVATIONS):
+    """
+    Appends rows to the observations CSV (making it if it doesn't exist) and adds them to its index.
+    Arguments:
+        - observations: list of rows to add (e.g., output of match_log)
+        - path: path to the observations CSV (default is OBSERVATIONS)
+    Outputs:
+        - appends the rows to the CSV and updates its index
+    """
 
-            ### Send Observation request and save the user id ###
-            uid, error = obs_object.submit_group(obs, constraints)
+    if not os.path.isfile(path):
+        with open(path, "w") as obs:
+            obs.write("All requested observations from SALT&PEPPER and their statuses.\n")
+            csv.writer(obs, delimiter=",").writerow(OBS_HEADERS)
 
+    with open(path, "a") as obs:
+        csvwriter = csv.writer(obs, delimiter=",")
+        csvwriter.writerows(observations)
 
-            if error == "": #if no error then add uid and any errors to the request record
-                req_info["uid"] = uid
-                req_info["status"] = "Requests made successfully."
-            else: #if there was error then requests failed
-                req_info["status"] = "Connection to LT failed."
-                print("could not access the LT - please check credentials")
+    _obs_index(path) #catches the index up with the new rows
 
+################################################################################
+
+def pending_downloads(downloaded, since=None, path=OBSERVATIONS):
+    """
+    Finds the nights and proposals with observations that haven't been downloaded yet, using only the index of
+    the observations CSV.
+    Arguments:
+        - downloaded: the {YYYYMMDD}_{propID} of the nights already downloaded (e.g., the "nights" of the download manifest)
+        - since: date as a string in the format YYYYMMDD from which nights are included even if already downloaded,
+            so new or updated files are picked up (default is None - i.e., only ones not downloaded)
+        - path: path to the observations CSV (default is OBSERVATIONS)
+    Outputs:
+        - jobs: list of (date, propID) with dates as strings in the format YYYYMMDD
+    """
 
-        except:
-            req_info["status"] = "Connection to LT failed."
-            print("could not access the LT - please check credentials")
+    jobs = []
+    for night in _obs_index(path)["observed"]:
+        date, propID = night.split("_", 1)
+        if (night not in downloaded) or ((since is not None) and (date >= since)):
+            jobs.append((date, propID))
 
-    return req_info
+    return jobs
 
 ################################################################################
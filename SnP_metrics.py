@@ -0,0 +1,213 @@
+"""
+The metrics of the stages of the SALT&PEPPER pipeline (run time, CPU, memory and external calls) and
+the allocation tracing used by SNP_TRACEMALLOC. Kept apart from SnP_funcs so it only needs the standard library and requests.
+
+Author: George Hume
+2023
+"""
+
+### IMPORTS ###
+import json
+import time
+import datetime as dt
+import os
+import requests
+import threading
+from urllib.parse import urlsplit
+import functools
+import resource
+
+############################ FUNCTIONS FOR METRICS #############################
+
+METRICS = os.environ.get("SNP_METRICS", "../xOUTPUTS/metrics.jsonl") #where the metrics of each stage are saved ("" to not save them)
+
+_net_lock = threading.Lock()
+_net = {"bytes": 0, "calls": {}} #bytes sent/received and (number, total seconds) of the external calls to each host
+
+def net_call(host, seconds, nbytes=0):
+    """
+    Records an external call (e.g., to the TNS, VizieR, HyperLEDA, the LT or the email server) in the metrics.
+    Arguments:
+        - host: the name of the server
+        - seconds: how long the call took
+        - nbytes: number of bytes sent and received (default is 0)
+    """
+    with _net_lock:
+        _net["bytes"] += nbytes
+        count, total = _net["calls"].get(host, (0, 0.0))
+        _net["calls"][host] = (count + 1, total + seconds)
+
+
+class CountedAdapter(requests.adapters.HTTPAdapter):
+    """
+    Transport adapter which records every request sent through it in the metrics.
+    Only sessions it has been mounted on are counted (see counted_session), so importing this module doesn't change requests for anything else.
+    """
+
+    def send(self, request, stream=False, **kwargs):
+        host = urlsplit(request.url).netloc
+        body = request.body if request.body is not None else b""
+        t0 = time.perf_counter()
+        try:
+            r = super().send(request, stream=stream, **kwargs)
+        except requests.RequestException:
+            net_call(host, time.perf_counter() - t0, len(body)) #failed calls still count
+            raise
+        received = int(r.headers.get("Content-Length", 0)) if stream else len(r.content)
+        net_call(host, time.perf_counter() - t0, len(body) + received)
+        return r
+
+
+def counted_session(session=None):
+    """
+    Makes a requests Session whose calls are recorded in the metrics.
+    Arguments:
+        - session: an existing requests Session to count the calls of, e.g. astroquery's (default is None, which makes a new one)
+    Outputs:
+        - session: the requests Session with a CountedAdapter mounted for http and https
+    """
+    session = requests.Session() if session is None else session
+    adapter = CountedAdapter()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _rss():
+    """
+    Current resident memory of the process in MB (None if it can't be read, i.e., not on Linux).
+    """
+    try:
+        with open("/proc/self/statm") as fp:
+            return int(fp.read().split()[1]) * resource.getpagesize() / 1e6
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+class timed:
+    """
+    Records the wall time, CPU time, memory, network bytes and external calls of a stage of the pipeline.
+    Each stage adds a line to the metrics file for the night (METRICS) and prints a one line summary.
+    Can be used as a decorator (@timed("name")) or a context manager (with timed("name"):).
+    The memory figures are the changes from the start of the stage: how much the resident memory changed and how
+    much the stage raised the process' peak (0 if it stayed under an earlier stage's peak). cpu_s only counts the
+    thread running the stage. Memory, process_cpu_s and the network use can't be split between threads, so they are
+    for the whole process and include any threads working in the background at the same time (use SNP_TRACEMALLOC
+    for the memory allocated by a stage itself, see traced).
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(self.name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def __enter__(self):
+        with _net_lock:
+            self.bytes0, self.calls0 = _net["bytes"], dict(_net["calls"])
+        self.rss0 = _rss()
+        self.peak0 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 #peak so far in MB (Linux gives KB)
+        self.cpu0, self.pcpu0 = time.thread_time(), time.process_time()
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self.t0
+        cpu, pcpu = time.thread_time() - self.cpu0, time.process_time() - self.pcpu0
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        rss = _rss()
+        drss = None if (rss is None) or (self.rss0 is None) else rss - self.rss0
+        with _net_lock:
+            nbytes = _net["bytes"] - self.bytes0
+            calls = {}
+            for host, (count, total) in _net["calls"].items():
+                count0, total0 = self.calls0.get(host, (0, 0.0))
+                if count > count0:
+                    calls[host] = {"calls": count - count0, "seconds": round(total - total0, 4)}
+
+        metrics = {"time": dt.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'), "module": os.path.basename(os.getcwd()),
+                   "stage": self.name, "ok": exc_type is None, "wall_s": round(wall, 4), "cpu_s": round(cpu, 4),
+                   "process_cpu_s": round(pcpu, 4), "process_rss_change_mb": None if drss is None else round(drss, 1),
+                   "process_peak_rss_growth_mb": round(peak - self.peak0, 1), "process_peak_rss_mb": round(peak, 1),
+                   "process_net_bytes": nbytes, "process_calls": calls}
+
+        ncalls = sum(c["calls"] for c in calls.values())
+        tcalls = sum(c["seconds"] for c in calls.values())
+        mem = "" if drss is None else f"{drss:+.0f} MB rss, "
+        print(f"[metrics] {self.name}: {wall:.2f} s wall, {cpu:.2f} s cpu; process-wide: {pcpu:.2f} s cpu, {mem}"
+              f"peak +{peak - self.peak0:.0f} MB, {nbytes/1e6:.2f} MB over {ncalls} calls ({tcalls:.2f} s)"
+              f"{'' if exc_type is None else ' - FAILED'}")
+
+        if METRICS:
+            try:
+                with open(METRICS, "a") as fp:
+                    fp.write(json.dumps(metrics) + "\n")
+            except OSError as e:
+                print(f"Could not save metrics: {e}")
+
+        return False #don't hide any errors
+
+###################### FUNCTIONS FOR TRACING ALLOCATIONS #######################
+
+TRACEMALLOC = os.environ.get("SNP_TRACEMALLOC", "") not in ("", "0") #track the memory allocations of loadDB, UPdate and priority_list(_lazy)
+ARCHIVE = "../zARCHIVE"
+
+def profile_dir(date=None, archive=ARCHIVE):
+    """
+    Gives the folder the profiles of a night are saved in (zARCHIVE/{date}/profiles), making it if needed.
+    Arguments:
+        - date: datetime of the night (default is today in UTC)
+        - archive: path to the archive (default is ARCHIVE)
+    Outputs:
+        - path: path to the folder
+    """
+    date = dt.datetime.utcnow() if date is None else date
+    path = os.path.join(archive, date.strftime('%Y%m%d'), "profiles")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class traced:
+    """
+    Tracks the memory allocations of a function with tracemalloc when TRACEMALLOC is set (SNP_TRACEMALLOC=1).
+    The peak memory and the lines holding the most memory when it finishes are added to
+    zARCHIVE/{date}/profiles/{module}_{name}_alloc.txt. Does nothing otherwise.
+    """
+
+    def __init__(self, name, top=25):
+        self.name = name
+        self.top = top
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not TRACEMALLOC:
+                return func(*args, **kwargs)
+            import tracemalloc #only loaded when tracing
+
+            started = not tracemalloc.is_tracing()
+            if started:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            size0 = tracemalloc.get_traced_memory()[0]
+            try:
+                return func(*args, **kwargs)
+            finally:
+                size, peak = tracemalloc.get_traced_memory()
+                stats = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)]).statistics("lineno")
+                if started:
+                    tracemalloc.stop()
+
+                print(f"[tracemalloc] {self.name}: {(peak-size0)/1e6:.1f} MB peak, {(size-size0)/1e6:.1f} MB still held")
+                path = os.path.join(profile_dir(), f"{os.path.basename(os.getcwd())}_{self.name}_alloc.txt")
+                with open(path, "a") as fp:
+                    fp.write(f"{dt.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')} {self.name}: "
+                             f"peak {(peak-size0)/1e6:.1f} MB, still held {(size-size0)/1e6:.1f} MB\n")
+                    for stat in stats[:self.top]:
+                        fp.write(f"    {stat}\n")
+                    fp.write("\n")
+        return wrapper
@@ -0,0 +1,218 @@
+"""
+The visibility plots of the priority lists that are attached to the emails.
+
+Author: George Hume
+2023
+"""
+
+### IMPORTS ###
+import json
+import time
+import numpy as np
+import datetime as dt
+from skyfield.api import utc
+import io
+import matplotlib
+matplotlib.use("Agg") #headless backend as plots are only saved to file
+from matplotlib.figure import Figure
+import matplotlib.dates as mdates
+import os
+from SnP_metrics import timed
+from SnP_funcs import MIN_ALT, _background, alt_curves, ephemeris, loadDB
+
+######################## FUNCTIONS FOR VISIBILITY PLOTS ########################
+
+def visplots_path(fmt="jpg", now=None):
+    """
+    Gives the path visplots saves the visibility plots to.
+    Arguments:
+        - fmt: format of the image file (default is jpg)
+        - now: datetime of the day the night starts on (default is None - i.e., today)
+    Outputs:
+        - apath: path to the image file of the visibility plots
+    """
+    now = dt.datetime.now() if now is None else now
+    return f"../xOUTPUTS/top_visplots_{now.strftime('%Y%m%d')}.{fmt}"
+
+
+@timed("visplots")
+def visplots(lists, step=0.1, dpi=600, fmt="jpg", budget=None, min_alt=MIN_ALT, now=None):
+    """
+    Makes the visiblity plots of the top priority targets from the PEPPER fast and slow lists.
+    Arguments:
+        - lists: a list containing the paths to the two priority score lists
+        - step: the time between points on the altitude curves in hours (default is 0.1)
+        - dpi: resolution to render the plots at in dots per inch (default is 600)
+        - fmt: format of the image file, e.g., jpg, png, webp, or svg (default is jpg)
+        - budget: maximum size of the image file in bytes, the resolution is reduced until it fits (default is None - i.e., no limit)
+        - min_alt: the lowest altitude the targets can be observed at in degrees, drawn as the airmass limit (default is MIN_ALT)
+        - now: datetime of the day the night starts on (default is None - i.e., today)
+    Outpts:
+        - apath: the path to the image file of the visiblity plots that was created.
+    """
+
+    # DATES #
+    now = dt.datetime.now() if now is None else now
+    today = dt.datetime.combine(now, dt.datetime.min.time()) + dt.timedelta(days=0.5)
+    today =today.replace(tzinfo=utc)
+    tomorrow = today + dt.timedelta(days=1) #next day at midday
+    tomorrow = tomorrow.replace(tzinfo=utc)
+
+    #location of Liverpool Telescope
+    lat = 28.6468866 #latitude in degs
+    long = -17.7742491 #longitude in degs
+    elv = 2326.0 #elevation in metres
+
+    ### Set-up sky-field observing ##
+    ts, eph = ephemeris() #loads in timescale and ephemerides (already loaded if Visibility was run)
+
+    #makes time objects from today and tomorrow
+    t0 = ts.from_datetime(today)
+    t1 = ts.from_datetime(tomorrow)
+
+    ### Load in the sunrise/set and twilight times ###
+    with open('../xOUTPUTS/solar_times.json') as json_file:
+        sdict = json.load(json_file)
+    #save them as time objects in skyfield
+    sunset = ts.utc(
+    int(sdict["nightstart_date"][0:4]), int(sdict["nightstart_date"][5:7]), int(sdict["nightstart_date"][8:]),
+    int(sdict["sunset"][0:2]), int(sdict["sunset"][3:5]), int(sdict["sunset"][6:])
+    )
+    darkstart = ts.utc(
+    int(sdict["nightstart_date"][0:4]), int(sdict["nightstart_date"][5:7]), int(sdict["nightstart_date"][8:]),
+    int(sdict["darkstart"][0:2]), int(sdict["darkstart"][3:5]), int(sdict["darkstart"][6:])
+    )
+    darkend = ts.utc(
+    int(sdict["nightend_date"][0:4]), int(sdict["nightend_date"][5:7]), int(sdict["nightend_date"][8:]),
+    int(sdict["darkend"][0:2]), int(sdict["darkend"][3:5]), int(sdict["darkend"][6:])
+    )
+    sunrise = ts.utc(
+    int(sdict["nightend_date"][0:4]), int(sdict["nightend_date"][5:7]), int(sdict["nightend_date"][8:]),
+    int(sdict["sunrise"][0:2]), int(sdict["sunrise"][3:5]), int(sdict["sunrise"][6:])
+    )
+
+    #grid of times from sunset to sunrise shared by all the targets
+    offsets = np.arange(0, (sunrise.tt - sunset.tt)*24, step) #hours after sunset
+    tgrid = ts.tt_jd(sunset.tt + offsets/24)
+    times = tgrid.utc_datetime()
+
+    #set up figure (without pyplot so it can be drawn in a background thread)
+    fig = Figure(figsize=(20,10))
+    ax = fig.subplots(1,2)
+
+    for j, fpath in enumerate(lists):
+        ## format the plots ##
+        ax[j].plot((sunset.utc_datetime(),sunrise.utc_datetime()),(0,0),color="grey",alpha=0.5,zorder=0) #horizon
+        ax[j].plot((sunset.utc_datetime(),sunrise.utc_datetime()),(min_alt,min_alt),color="grey",alpha=0.5,zorder=0) #lower alt limit
+
+        ax[j].vlines(darkstart.utc_datetime(), 0,90,color="grey",alpha=0.5,zorder=0)
+        ax[j].vlines(darkend.utc_datetime(), 0,90,color="grey",alpha=0.5,zorder=0)
+        ax[j].vlines(today + dt.timedelta(days=0.5), 0,90,color="grey",alpha=0.5,zorder=0)
+
+        #annotations
+        ax[j].annotate("End of Twilight", (darkstart.utc_datetime(),88),ha='center')
+        ax[j].annotate("Start of Twilight", (darkend.utc_datetime(),88),ha='center')
+        ax[j].annotate("Midnight", (today + dt.timedelta(days=0.5),88),ha='center')
+        ax[j].annotate("Horizon", (sunset.utc_datetime(),1),(10,0),textcoords="offset pixels")
+        ax[j].annotate("Airmass Lower Limit", (sunset.utc_datetime(),min_alt+1),(10,0),textcoords="offset pixels")
+
+        #backgrounds
+        ax[j].axhspan(min_alt, 0, facecolor='grey', alpha=0.2)
+        ax[j].axhspan(0, -90, facecolor='grey', alpha=0.4)
+
+        #formatting the plot
+        xfmt = mdates.DateFormatter('%H:%M')
+        ax[j].xaxis.set_major_formatter(xfmt)
+        ax[j].set_xlabel("UTC Time")
+        ax[j].set_ylabel("Altitude (degrees)")
+        ax[j].set_xlim((sunset.utc_datetime(),sunrise.utc_datetime()))
+        ax[j].set_ylim(0,90)
+        ax[j].set_title(f"Visibility of highest priority transients from {os.path.basename(fpath)[0:-13]} during dark time on La Palma ({today.strftime('%Y-%m-%d')})")
+
+        ax[j].grid(linestyle = ':')
+
+
+        #ingest the Pscore File
+        dummy, dummy, plist = loadDB(fpath)
+
+        nrows = plist.shape[0] #number of rows in original list
+
+        # check the number of rows in the pscore list
+        if nrows > 5: #if over 5 pick the top 5
+            top = plist[0:5]
+        elif nrows != 0: #if less than 5 and greater than 0 then pick all
+            top = plist[0:]
+        else: #if no rows (blank list) then skip
+            continue
+
+        names = top.T[1]+top.T[2] #TNS name of each target
+        RA = top.T[3].astype(float)/15 #convert to decimal hours
+        dec = top.T[4].astype(float) #declination
+
+        trows = top.shape[0] #number of rows in list of top entries
+
+        #altitudes of all the targets over the night in one go
+        talts = alt_curves(RA*15, dec, tgrid, lat, long, elv)
+
+        for i in range(trows):
+            ax[j].plot(times,talts[i],"--",label=names[i])
+
+        ax[j].legend(loc='center left', bbox_to_anchor=(1, 0.5))
+
+
+    #save
+    fig.tight_layout()
+    apath = visplots_path(fmt, now)
+    save_figure(fig, apath, dpi, budget)
+
+    return apath
+
+################################################################################
+
+def save_figure(fig, path, dpi, budget=None):
+    """
+    Renders a figure and saves it to file, reducing the resolution until it fits within a size budget.
+    The time taken to render and the size of the file are printed out for the log.
+    Arguments:
+        - fig: the matplotlib figure to save
+        - path: the path to save the figure to (the extension sets the format, e.g., jpg, png, webp, or svg)
+        - dpi: the resolution to render the figure at in dots per inch
+        - budget: maximum size of the file in bytes (default is None - i.e., no limit). Ignored for svg.
+    Outputs:
+        - saves the figure to the specified path
+    """
+
+    fmt = os.path.splitext(path)[1][1:].lower()
+
+    tstart = time.perf_counter()
+    for attempt in range(5): #don't keep trying forever
+        buf = io.BytesIO()
+        fig.savefig(buf, format=fmt, dpi=dpi)
+        size = buf.getbuffer().nbytes
+
+        if (budget is None) or (fmt == "svg") or (size <= budget):
+            break
+
+        #file size scales roughly with number of pixels so scale the dpi by the square root
+        dpi = int(dpi * np.sqrt(budget/size) * 0.9)
+    rtime = time.perf_counter() - tstart
+
+    with open(path, "wb") as file:
+        file.write(buf.getbuffer())
+
+    print(f"{os.path.basename(path)} rendered in {rtime:.2f}s at {dpi} dpi ({size/1e6:.2f} MB)")
+    if (budget is not None) and (size > budget):
+        print(f"{os.path.basename(path)} is larger than the budget of {budget/1e6:.2f} MB")
+
+################################################################################
+
+def visplots_async(lists, **kwargs):
+    """
+    Makes the visiblity plots (see visplots) in a background thread so other work can carry on while they are drawn.
+    Arguments:
+        - lists: a list containing the paths to the two priority score lists
+        - kwargs: any other arguments to pass to visplots
+    Outputs:
+        - future: concurrent.futures.Future whose result is the path to the visiblity plots
+    """
+    return _background.submit(visplots, lists, **kwargs)
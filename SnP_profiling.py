@@ -0,0 +1,116 @@
+"""
+The profilers the modules' scripts are run under when SnP is run with --profile (see profiler.py).
+
+Author: George Hume
+2023
+"""
+
+### IMPORTS ###
+import os
+import threading
+import sys
+import runpy
+import cProfile
+import pstats
+from SnP_metrics import profile_dir
+
+########################### FUNCTIONS FOR PROFILING ############################
+
+PROFILE = os.environ.get("SNP_PROFILE", "") #profiler to run the modules under ("sample" or "cprofile", "" for none)
+PROFILE_ONLY = [m for m in os.environ.get("SNP_PROFILE_ONLY", "").split(",") if m] #only profile these modules (default all)
+
+class Sampler:
+    """
+    Sampling profiler which records the call stacks of every thread (so includes work done in the background)
+    at regular intervals. The stacks are saved in the "folded" format used by flamegraph.pl, speedscope, etc.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, "thread"))
+                stack = ";".join(reversed(stack))
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def save(self, path, top=25):
+        """
+        Saves the stacks (one "frame;frame;... count" line each) and prints the functions most often seen running.
+        """
+        with open(path, "w") as fp:
+            for stack, count in sorted(self.stacks.items(), key=lambda s: -s[1]):
+                fp.write(f"{stack} {count}\n")
+
+        total = sum(self.stacks.values())
+        own = {}
+        for stack, count in self.stacks.items():
+            leaf = stack.rsplit(";", 1)[-1]
+            own[leaf] = own.get(leaf, 0) + count
+        print(f"[profile] {total} samples every {self.interval*1e3:.0f} ms, top functions:")
+        for leaf, count in sorted(own.items(), key=lambda s: -s[1])[:top]:
+            print(f"    {100*count/max(total,1):5.1f}%  {leaf}")
+
+
+def profile_script(script, args=(), mode=PROFILE, only=PROFILE_ONLY, date=None):
+    """
+    Runs one of the modules' scripts (e.g., pscores.py) under a profiler and saves the profile to
+    zARCHIVE/{date}/profiles/{module}_{script}.{folded,prof,txt}, so slow nights can be looked into afterwards.
+    Arguments:
+        - script: path to the script
+        - args: command line arguments to give the script
+        - mode: "sample" for the sampling profiler (folded stacks for flame graphs) or "cprofile" for
+                cProfile (a .prof file for snakeviz/flameprof and a text summary, main thread only) (default is PROFILE)
+        - only: list of the modules to profile, the script is run as normal in any others (default is PROFILE_ONLY)
+        - date: datetime of the night (default is today in UTC)
+    """
+
+    module = os.path.basename(os.getcwd())
+    name = f"{module}_{os.path.splitext(os.path.basename(script))[0]}"
+    sys.argv = [script, *args]
+    if mode not in ("sample", "cprofile") or (len(only) != 0 and module not in only):
+        if mode not in ("", "sample", "cprofile"):
+            print(f"Unknown profiler '{mode}', running {script} without one")
+        runpy.run_path(script, run_name="__main__")
+        return
+
+    path = os.path.join(profile_dir(date), name)
+    if mode == "sample":
+        prof = Sampler().start()
+    else:
+        prof = cProfile.Profile()
+        prof.enable()
+    try:
+        runpy.run_path(script, run_name="__main__")
+    finally:
+        #save the profile even if the script fails
+        if mode == "sample":
+            prof.stop()
+            prof.save(path + ".folded")
+        else:
+            prof.disable()
+            prof.dump_stats(path + ".prof")
+            with open(path + ".txt", "w") as fp:
+                pstats.Stats(prof, stream=fp).sort_stats("cumulative").print_stats(100)
+        print(f"[profile] {name} saved to {path}")
@@ -0,0 +1,122 @@
+"""
+Remaking the outputs of the pipeline for past nights (see replay.py).
+
+Author: George Hume
+2023
+"""
+
+### IMPORTS ###
+import json
+import datetime as dt
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from SnP_funcs import SLOW_TOPK, loadDB, priority_list, priority_list_lazy, reconstruct_tns, save_list
+from SnP_plots import visplots
+from SnP_email import array2html
+from SnP_schedule import load_blacklist, request
+
+##################### FUNCTIONS FOR REPLAYING PAST NIGHTS ######################
+
+def replay_night(date, out="replay", root=None, archive=None, window=14):
+    """
+    Remakes the outputs of the pipeline for a past night (the TNS database as it was, the priority lists, the
+    visibility plots, the HTML table of the fast list and the LT request that would have been made) in
+    out/{YYYYMMDD}/xOUTPUTS. Nothing is sent: the request is made to MockLTObs and no emails are made.
+    Arguments:
+        - date: datetime of the day the night starts on
+        - out: directory to save the outputs of each night in (default is "replay")
+        - root: path to the SALT&PEPPER directory (default is the directory of this file)
+        - archive: path to the archive holding the daily TNS updates (default is zARCHIVE in root)
+        - window: number of days of TNS updates used to rebuild the database (default is 14, see reconstruct_tns)
+    Outputs:
+        - summary: dict of the number of targets in the lists and requested, and any TNS updates that were missing
+    """
+
+    root = os.path.dirname(os.path.abspath(__file__)) if root is None else os.path.abspath(root)
+    archive = os.path.join(root, "zARCHIVE") if archive is None else os.path.abspath(archive)
+    date = dt.datetime.combine(date, dt.datetime.min.time())
+    day = date.strftime('%Y%m%d')
+
+    #directory that stands in for the modules' directories, so ../xOUTPUTS is the night's outputs
+    night = os.path.abspath(os.path.join(out, day))
+    run = os.path.join(night, "replay")
+    os.makedirs(run, exist_ok=True)
+    os.makedirs(os.path.join(night, "xOUTPUTS"), exist_ok=True)
+    for src in (os.path.join(root, "LUCY", "de421.bsp"), os.path.join(root, "LUCY", "finals2000A.all"), os.path.join(root, "RITA", "obs_prams.json")):
+        dst = os.path.join(run, os.path.basename(src))
+        if os.path.isfile(src) and not os.path.lexists(dst):
+            os.symlink(src, dst)
+
+    start = os.getcwd()
+    os.chdir(run) #only changes the directory of this process, so nights can be replayed in parallel
+    try:
+        ## BILLY ##
+        tns_date, headers, database, missing = reconstruct_tns(date, os.path.join(root, "xOUTPUTS", "tns_public_objects.csv"), archive, window)
+
+        ## LUCY ##
+        fastname = f"../xOUTPUTS/TransientList_F_{day}.csv"
+        slowname = f"../xOUTPUTS/TransientList_S_{day}.csv"
+        fastDB = priority_list(database, tns_date, False, now=date)
+        save_list(fastname, fastDB, headers, date, tns_date)
+        if SLOW_TOPK is None:
+            slowDB = priority_list(database, tns_date, now=date)
+        else:
+            slowDB, dummy = priority_list_lazy(database, tns_date, topK=SLOW_TOPK, now=date)
+        save_list(slowname, slowDB, headers, date, tns_date)
+
+        ## MR. KITE ##
+        visplots([slowname, fastname], dpi=150, fmt="png", now=date)
+        if fastDB.size != 0:
+            dummy, lheaders, flist = loadDB(fastname)
+            array2html(lheaders, flist.astype(str), f"{fastname[0:-4]}.html")
+
+        ## RITA ##
+        with open('../xOUTPUTS/solar_times.json') as json_file:
+            sdict = json.load(json_file)
+        req_times = {"start_date": sdict["nightstart_date"], "start_time": sdict["darkstart"],
+                     "end_date": sdict["nightend_date"], "end_time": sdict["darkend"]}
+        blist = load_blacklist(os.path.join(root, "RITA", "blacklist.csv"), date.strftime('%Y-%m-%d'))
+        req_info = request(fastname, blist, req_times, settings={"LT_HOST": "mock"})
+        with open('../xOUTPUTS/requests.json', 'w') as fp:
+            json.dump(req_info, fp, indent=4)
+
+        summary = {"date": day, "tns_date": tns_date, "tns_objects": int(database.shape[0]), "fast": int(fastDB.shape[0]),
+                   "slow": int(slowDB.shape[0]), "requested": len(req_info.get("targets", [])),
+                   "status": req_info["status"], "missing_updates": missing}
+        with open('../xOUTPUTS/replay.json', 'w') as fp:
+            json.dump(summary, fp, indent=4)
+
+    finally:
+        os.chdir(start)
+
+    return summary
+
+################################################################################
+
+def replay(start, end, out="replay", workers=4, **kwargs):
+    """
+    Remakes the outputs of every night from start to end (see replay_night), with the nights shared between a pool of processes.
+    Arguments:
+        - start: datetime of the first night
+        - end: datetime of the last night (inclusive)
+        - out: directory to save the outputs of each night in (default is "replay")
+        - workers: number of processes (default is 4)
+        - kwargs: any other arguments to pass to replay_night
+    Outputs:
+        - summaries: dict of the summary of each night (or the error if it failed) by date (YYYYMMDD)
+    """
+
+    dates = [start + dt.timedelta(days=k) for k in range((end - start).days + 1)]
+    summaries = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(replay_night, date, out, **kwargs): date.strftime('%Y%m%d') for date in dates}
+        for future in as_completed(futures):
+            day = futures[future]
+            try:
+                summaries[day] = future.result()
+                print(f"{day}: {summaries[day]['fast']} fast, {summaries[day]['slow']} slow, {summaries[day]['requested']} requested")
+            except Exception as e:
+                summaries[day] = {"date": day, "error": f"{type(e).__name__}: {e}"}
+                print(f"{day} could not be replayed: {summaries[day]['error']}")
+
+    return dict(sorted(summaries.items()))
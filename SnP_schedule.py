@@ -0,0 +1,443 @@
+"""
+Scheduling the follow-up of the targets and submitting the requests to the LT.
+
+Author: George Hume
+2023
+"""
+
+### IMPORTS ###
+import csv
+import json
+import time
+import numpy as np
+import datetime as dt
+from skyfield.api import utc
+import os
+import ltrtml
+import types
+import bisect
+from SnP_metrics import net_call, timed
+from SnP_funcs import EXP_TIME, LTcoords, MIN_ALT, OVERHEAD, airmass2alt, loadDB, vis_windows
+
+###################### FUNCTIONS FOR SCHEDULING FOLLOW-UP ######################
+
+def schedule(wstart, wend, weights, duration):
+    """
+    Picks the set of targets with the highest total priority that can be observed one after the other within their
+    visibility windows. Targets are taken in order of priority and each is given the earliest free slot in its window.
+    Arguments:
+        - wstart: array of the times each target becomes observable in hours (NaN if never observable)
+        - wend: array of the times each target stops being observable in hours (NaN if never observable)
+        - weights: array of the priorities of the targets (higher is more important)
+        - duration: time needed to observe each target in hours (including overheads)
+    Outputs:
+        - sel: array of the indices of the targets that fit in, in order of priority
+        - slots: array of the start time of the slot given to each selected target in hours
+    """
+
+    busy = [] #sorted list of (start, end) of slots already given out
+    sel, slots = [], []
+
+    for i in np.argsort(-np.asarray(weights,dtype=float), kind="stable"):
+        a, b = wstart[i], wend[i]
+        if not (b - a >= duration): #never observable or not for long enough (also catches NaN)
+            continue
+
+        #earliest time after a that doesn't overlap a slot already given out
+        t = a
+        for s, e in busy:
+            if t + duration <= s:
+                break
+            t = max(t, e)
+
+        if t + duration <= b:
+            bisect.insort(busy, (t, t + duration))
+            sel.append(i)
+            slots.append(t)
+
+    return np.array(sel, dtype=int), np.array(slots)
+
+################################################################################
+
+def night_schedule(RA, DEC, pscores, times, exp_time, overhead=OVERHEAD, min_alt=MIN_ALT):
+    """
+    Works out which targets can be fitted into the time given for a request to the LT and when each can be observed.
+    Arguments:
+        - RA: array of RA values of the targets in decimal degrees
+        - DEC: array of declination values of the targets in decimal degrees
+        - pscores: array of the priority scores of the targets (lower is higher priority)
+        - times: a dict containing the start and end times and dates for the request (see request)
+        - exp_time: the exposure time requested for each target in seconds
+        - overhead: time needed to set up on each target in seconds (default is OVERHEAD)
+        - min_alt: the minimum altitude the targets can be observed at in degrees (default is MIN_ALT)
+    Outputs:
+        - sel: array of the indices of the targets that fit in, in order of priority
+        - windows: list of dicts of the start and end dates and times of the slot each selected target was given
+            (the slots don't overlap, so all the targets can be observed one after the other)
+    """
+
+    tstart = dt.datetime.strptime(f"{times['start_date']} {times['start_time']}", "%Y-%m-%d %H:%M:%S").replace(tzinfo=utc)
+    tend = dt.datetime.strptime(f"{times['end_date']} {times['end_time']}", "%Y-%m-%d %H:%M:%S").replace(tzinfo=utc)
+
+    wstart, wend = vis_windows(RA, DEC, tstart, tend, min_alt)
+    sel, slots = schedule(wstart, wend, 5 - np.asarray(pscores,dtype=float), (exp_time + overhead)/3600)
+
+    windows = []
+    for slot in slots:
+        wS = tstart + dt.timedelta(hours=slot)
+        wE = tstart + dt.timedelta(hours=slot + (exp_time + overhead)/3600)
+        windows.append({"start_date": wS.strftime("%Y-%m-%d"), "start_time": wS.strftime("%H:%M:%S"),
+                        "end_date": wE.strftime("%Y-%m-%d"), "end_time": wE.strftime("%H:%M:%S")})
+
+    return sel, windows
+
+################################################################################
+
+def load_blacklist(path="blacklist.csv", today=None):
+    """
+    Loads the black list of transients not to be requested. Each row of the CSV is a TNS name, optionally followed
+    by the date (YYYY-MM-DD) after which it should no longer be black listed. Rows starting with # are ignored.
+    Arguments:
+        - path: path to the black list CSV (default is "blacklist.csv")
+        - today: date as a string in the format YYYY-MM-DD used to check for expired entries (default is None - i.e., today's UTC date)
+    Outputs:
+        - blist: set of the names of the transients that are black listed
+    """
+
+    if today is None:
+        today = dt.datetime.utcnow().strftime('%Y-%m-%d')
+
+    blist = set()
+    if not os.path.isfile(path):
+        return blist
+
+    with open(path) as file:
+        for row in csv.reader(file):
+            if (len(row) == 0) or (row[0].strip() == "") or row[0].startswith("#"):
+                continue #skips blank rows and comments
+            if (len(row) > 1) and (row[1].strip() != "") and (row[1].strip() < today):
+                continue #skips expired entries
+            blist.add(row[0].strip())
+
+    return blist
+
+################################################################################
+
+def blacklist_add(names, blist=None, path="blacklist.csv", expires=None):
+    """
+    Adds transients to the black list, skipping any that are already on it.
+    Arguments:
+        - names: list of TNS names to add to the black list
+        - blist: the black list already loaded in (output of load_blacklist), which is updated with the new names (default is None - i.e., load it from path)
+        - path: path to the black list CSV (default is "blacklist.csv")
+        - expires: date as a string in the format YYYY-MM-DD after which the new entries expire (default is None - i.e., never expire)
+    Outputs:
+        - blist: the updated black list as a set
+    """
+
+    if blist is None:
+        blist = load_blacklist(path)
+
+    new = [name for name in dict.fromkeys(names) if name not in blist] #dict keeps order and removes duplicates
+    if len(new) != 0:
+        with open(path, "a") as file:
+            for name in new:
+                file.write(f"{name}\n" if expires is None else f"{name},{expires}\n")
+        blist.update(new)
+
+    return blist
+
+################################################################################
+
+@timed("request")
+def request(plist, blacklist, times, per_target=True, settings=None):
+    """
+    Tries to sends observations requests of the highest priority transients from
+    a specified priority score list to the Liverpool Telescope.
+    Arguments:
+        - plist: path to the priority score list
+        - blacklist: set (or list) of transient names not to be included in requests (see load_blacklist)
+        - times: a dict containing the start and end times and dates for the
+            request as strings in the format "YYYY-MM-DD" for dates and
+            "HH:MM:SS" for times.
+        - per_target: if True each target is requested separately with the slot it was given in the night's schedule
+            as its time window, otherwise all targets are requested as one group for the whole time (default is True)
+        - settings: dict of the LT credentials and connection settings, e.g., {"LT_HOST": "mock"} so nothing is sent
+            to the LT (default is None - i.e., loaded from LT_creds.json)
+    Outputs:
+        - req_info: a dict containg the information regarding the request including:
+            the status of the request, the UID (if request worked), the targets' names
+            and coordinates, the constraints for the observations, and the se-up.
+    """
+
+    #blank dict to add info of morning request to
+    req_info = {}
+
+    # load in the PEPPER Fast priority list CSV file
+    dummy, dummy2, flist = loadDB(plist)
+
+    #remove any entries from the priority list which are in the black list
+    if flist.size != 0:
+        names = (flist.T[1]+flist.T[2]).astype(str)
+        flist = flist[~np.isin(names, np.array(sorted(blacklist),dtype=str))]
+
+    if flist.shape[0] == 0: #check if there are targets in the list
+        print("No sutible targets to request observations of.")
+        req_info["status"] = "No requests made." #add status
+
+    else: #if there are targets then can submit observations to the LT
+
+        ### Extract targets to request observations of ###
+        #the whole ranked list is given to the scheduler, which picks the highest priority targets that fit in the night
+        top = flist
+
+        # load in the observating parameters
+        # open file containing the times sunset/rise and twilight times for the night ahead
+        with open('obs_prams.json') as json_file:
+            obs_prams = json.load(json_file)
+        if str(obs_prams['exp_time']).strip() == "":
+            print(f"No exposure time set in obs_prams.json - using the default of {EXP_TIME}s")
+            obs_prams['exp_time'] = EXP_TIME
+        overhead = float(obs_prams['overhead']) if str(obs_prams.get('overhead', "")).strip() != "" else OVERHEAD
+
+        ### Fit the targets into the time available ###
+        #lowest altitude from the airmass limit requested (if one is set)
+        min_alt = airmass2alt(float(obs_prams['air_mass'])) if str(obs_prams['air_mass']).strip() != "" else MIN_ALT
+        sel, windows = night_schedule(top.T[3].astype(float), top.T[4].astype(float), top.T[-2].astype(float), times,
+                                      float(obs_prams['exp_time']), overhead, min_alt)
+        if sel.size == 0:
+            print("No targets can be observed in the time available.")
+            req_info["status"] = "No requests made." #add status
+        else:
+            top = top[sel]
+
+            #create list of dicts containing the transients names and RA and Dec in correct format for ltrtml
+            names = top.T[1]+top.T[2]
+            RA = top.T[3].astype(float)
+            DEC = top.T[4].astype(float)
+
+            ra, dec = LTcoords(RA,DEC)
+
+            #make list of target dicts
+            targets = []
+            for i in range(len(ra)):
+                targets.append( {"name":names[i],"RA":ra[i],"DEC":dec[i]} )
+
+
+            ### Set up constraints ###
+
+            # start date and time
+            sdate = times["start_date"]
+            stime = times["start_time"]
+
+            # end date and time
+            edate = times["end_date"]
+            etime = times["end_time"]
+
+            # make the constraints dict
+            constraints = {
+                'air_mass': obs_prams['air_mass'],      # 1.74 airmass corresponds to 35deg alt (see airmass2alt)
+                'sky_bright': obs_prams['sky_bright'], # any as targets shouldn't be near moon
+                'seeing': obs_prams["seeing"],        # Maximum allowable FWHM seeing in arcsec
+                'photometric': 'yes',                # Photometric conditions, ['yes', 'no']
+                'start_date': sdate,                # Start Date should be today
+                'start_time': stime,               # Start Time should be when darktime starts
+                'end_date': edate,                # End Date should be next day
+                'end_time': etime,               # End Time when
+            }
+            # add constraints to the request record
+            req_info["constraints"]=constraints
+
+
+            ### Set up observations ###
+            # we want to observe with MOPTOP in the R-band for 880s with slow rot speed for all targets
+
+            # make a list of observation dicts for each target
+            obs = []
+            for target in targets:
+                observation = {
+                    'instrument': 'Moptop',
+                    'target': target,
+                    'filters': {obs_prams["filter"]: {'exp_time': obs_prams['exp_time'],
+                                      'rot_speed': obs_prams['rot_speed']}}}
+                obs.append(observation)
+            #add info from obsevation to set-up part of request record
+            set_up = {
+                'instrument': 'Moptop',
+                'filter': obs_prams['filter'],
+                'exp_time': obs_prams['exp_time'],
+                'rot_speed': obs_prams['rot_speed']
+                }
+            req_info["set_up"]=set_up
+
+
+            ### Set up the credentials ###
+            # need to load the settings in from separate json - these are secrete so don't publish
+
+            if settings is None:
+                with open('LT_creds.json') as json_file:
+                    settings = json.load(json_file)
+
+
+            if not per_target:
+                ### Send Observation request to the LT and save the user id ###
+                uid, error = submit_group(obs, constraints, settings)
+
+                if error == "": #if no error then add uid and any errors to the request record
+                    req_info["uid"] = uid
+                    req_info["status"] = "Requests made successfully."
+                else: #if there was error then requests failed
+                    req_info["status"] = "Connection to LT failed."
+                    print("could not access the LT - please check credentials")
+
+            else:
+                ### Send a request for each target with its own time window and save the user ids ###
+                submitted = []
+                for target, observation, window in zip(targets, obs, windows):
+                    tconstraints = dict(constraints, **window)
+                    uid, error = submit_group([observation], tconstraints, settings)
+                    if error == "":
+                        target["uid"] = uid
+                        target["window"] = window
+                        submitted.append(target)
+
+                if len(submitted) != 0:
+                    targets = submitted #only keep targets that were requested
+                    req_info["uid"] = submitted[0]["uid"]
+                    req_info["status"] = "Requests made successfully."
+                else:
+                    req_info["status"] = "Connection to LT failed."
+                    print("could not access the LT - please check credentials")
+
+            #add targets to the requests record
+            req_info["targets"]=targets
+
+    return req_info
+
+################################################################################
+
+_lt_clients = {} #connections to the LT already made (so only made once per run)
+
+def lt_client(settings, timeout=60):
+    """
+    Returns a connection to the LT's RTML service, reusing one that has already been made with the same settings.
+    If the LT_HOST in the settings is "mock" then a MockLTObs is returned instead so requests can be tested offline.
+    The service definition (WSDL) is cached on disk in the RITA directory, so it isn't fetched and parsed each time.
+    Arguments:
+        - settings: dict of the LT credentials and connection settings (from LT_creds.json)
+        - timeout: seconds to wait for the LT to respond (default is 60)
+    Outputs:
+        - obs_object: ltrtml.LTObs object (or MockLTObs)
+    """
+
+    key = json.dumps([settings, timeout], sort_keys=True)
+    if key not in _lt_clients:
+        if settings.get("LT_HOST") == "mock":
+            _lt_clients[key] = MockLTObs(settings)
+        else:
+            obs_object = ltrtml.LTObs(settings)
+            if hasattr(ltrtml, "Client"): #ltrtml makes its suds client by name
+                _inject_client(obs_object, _suds_client(timeout))
+            _lt_clients[key] = obs_object
+    return _lt_clients[key]
+
+################################################################################
+
+def _suds_client(timeout, location=os.path.join(os.path.dirname(os.path.abspath(__file__)), "RITA", "wsdl_cache"), days=30):
+    """
+    Makes a function that creates suds SOAP clients which cache the parsed service definition on disk (so it doesn't
+    have to be downloaded and parsed again in every run) and give up on the LT after a timeout.
+    Arguments:
+        - timeout: seconds to wait for the LT to respond
+        - location: directory to keep the cache in (default is RITA/wsdl_cache)
+        - days: number of days to keep the cached definition for (default is 30)
+    Outputs:
+        - Client: function taking the same arguments as suds.client.Client
+    """
+
+    from suds.client import Client as SudsClient
+    from suds.cache import ObjectCache
+    cache = ObjectCache(location=location, days=days)
+
+    def Client(*args, **kwargs):
+        kwargs.setdefault("cache", cache)
+        kwargs.setdefault("timeout", timeout)
+        return SudsClient(*args, **kwargs)
+    return Client
+
+
+def _inject_client(obs_object, Client):
+    """
+    Makes one ltrtml.LTObs object create its suds clients with the given function. ltrtml looks Client up in its own
+    globals, so the object's methods are given a copy of those globals with Client replaced, which leaves ltrtml (and
+    every other LTObs object) unchanged.
+    Arguments:
+        - obs_object: the ltrtml.LTObs object
+        - Client: function to create the suds clients with (see _suds_client)
+    """
+
+    namespace = dict(vars(ltrtml), Client=Client)
+    for cls in type(obs_object).__mro__:
+        for name, func in vars(cls).items():
+            if isinstance(func, types.FunctionType) and (func.__globals__ is vars(ltrtml)) and not name.startswith("__") \
+                    and name not in vars(obs_object):
+                method = types.FunctionType(func.__code__, namespace, func.__name__, func.__defaults__, func.__closure__)
+                method.__kwdefaults__ = func.__kwdefaults__
+                setattr(obs_object, name, types.MethodType(method, obs_object))
+
+################################################################################
+
+def submit_group(obs, constraints, settings, retries=3, backoff=10, timeout=60):
+    """
+    Submits a group of observations to the LT, retrying with an increasing wait if the connection fails.
+    Arguments:
+        - obs: list of observation dicts for ltrtml (see request)
+        - constraints: dict of the constraints for the observations for ltrtml (see request)
+        - settings: dict of the LT credentials and connection settings (from LT_creds.json)
+        - retries: number of times to try again if the connection fails (default is 3)
+        - backoff: seconds to wait before the first retry, doubling each time (default is 10)
+        - timeout: seconds to wait for the LT to respond, given to the suds client (default is 60)
+    Outputs:
+        - uid: the uid of the group of observations (None if failed)
+        - error: error message from the LT ("" if the request was successful)
+    """
+
+    for attempt in range(retries+1):
+        tstart = time.perf_counter()
+        try:
+            uid, error = lt_client(settings, timeout).submit_group(obs, constraints)
+            net_call(settings.get("LT_HOST", "LT"), time.perf_counter()-tstart)
+            print(f"LT submission took {time.perf_counter()-tstart:.1f}s")
+            return uid, error
+
+        except Exception as e: #connection failed so forget client and try again
+            net_call(settings.get("LT_HOST", "LT"), time.perf_counter()-tstart)
+            print(f"LT submission failed (attempt {attempt+1} of {retries+1}): {e}")
+            _lt_clients.pop(json.dumps([settings, timeout], sort_keys=True), None)
+            if attempt < retries:
+                time.sleep(backoff * 2**attempt)
+
+    return None, "Connection to LT failed."
+
+################################################################################
+
+class MockLTObs:
+    """
+    Local stand-in for ltrtml.LTObs which accepts observation requests without connecting to the LT, so submissions
+    can be tested and benchmarked offline. Used when LT_HOST is set to "mock" in the settings. The settings can
+    also include MOCK_LATENCY (seconds each submission takes) and MOCK_FAIL (fraction of submissions where the
+    connection fails).
+    """
+
+    def __init__(self, settings):
+        self.latency = float(settings.get("MOCK_LATENCY", 0))
+        self.fail = float(settings.get("MOCK_FAIL", 0))
+        self.submitted = [] #record of the groups submitted
+
+    def submit_group(self, obs, constraints):
+        time.sleep(self.latency)
+        if np.random.random() < self.fail:
+            raise ConnectionError("mock LT connection failed")
+        uid = f"mock{len(self.submitted)+1:04d}"
+        self.submitted.append((uid, obs, constraints))
+        return uid, ""
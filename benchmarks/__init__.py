@@ -0,0 +1,6 @@
+"""
+Benchmarks of the SALT&PEPPER pipeline on synthetic data (see bench.py).
+
+Author: George Hume
+2023
+"""
@@ -0,0 +1,232 @@
+"""
+Benchmarks every stage of the SALT&PEPPER pipeline on synthetic data and saves the timings as JSON, comparing
+them with a stored baseline to catch regressions. Nothing is downloaded or sent: the galaxy catalogue is a
+local synthetic copy of GLADE+ and HyperLEDA is replaced by a local mock server. The ephemerides
+(de421.bsp and finals2000A.all) are used from the current directory or LUCY if they are there.
+
+Run from the top directory of the repo, e.g.:
+    python -m benchmarks.bench --rows 50000 --out bench.json --baseline benchmarks/baseline.json
+    python -m benchmarks.bench --rows 1000000 --save-baseline benchmarks/baseline.json
+
+Author: George Hume
+2023
+"""
+
+## IMPORTS ##
+import argparse
+import datetime as dt
+import http.server
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import zlib
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+import SnP_funcs
+import SnP_email
+import SnP_plots
+from benchmarks import synthetic
+
+#location of Liverpool Telescope
+LAT, LONG, ELV = 28.6468866, -17.7742491, 2326.0
+
+
+class _LedaHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Local stand-in for HyperLEDA which gives every galaxy a random radius (or none).
+    """
+    def do_GET(self):
+        rng = np.random.default_rng(zlib.crc32(self.path.encode()))
+        body = "<html>no data</html>" if rng.random() < 0.3 else \
+               f"<tr><td>>logd25< {rng.uniform(0.3,1.5):.3f}</td><td>log(0.1 arcmin)</td></tr>"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, *args):
+        pass
+
+
+def timeit(func, repeats):
+    """
+    Runs a function a number of times and returns the fastest time in seconds and the output of the last run.
+    """
+    best, out = np.inf, None
+    for r in range(repeats):
+        t0 = time.perf_counter()
+        out = func()
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+
+def run(args):
+    """
+    Makes the synthetic inputs and times each stage.
+    Outputs:
+        - results: dict of the timings of each stage
+    """
+
+    results = {}
+    def record(name, n, func, repeats=args.repeats):
+        seconds, out = timeit(func, repeats)
+        results[name] = {"seconds": round(seconds, 6), "n": int(n), "per_item_us": round(seconds/max(n,1)*1e6, 3)}
+        print(f"{name:<12} {seconds:10.4f} s   n = {n}")
+        return out
+
+    today = dt.datetime.combine(dt.datetime.utcnow(), dt.datetime.min.time())
+    date = today.strftime('%Y-%m-%d %H:%M:%S')
+
+    ## TNS database: loadDB, UPdate and slicing ##
+    database = synthetic.tns_database(args.rows, today, args.seed)
+    synthetic.write_csv("../xOUTPUTS/tns_public_objects.csv", date, synthetic.TNS_HEADERS, database)
+    dummy, headers, database = record("loadDB", args.rows, lambda: SnP_funcs.loadDB("../xOUTPUTS/tns_public_objects.csv"))
+
+    ufile = f"tns_public_objects_{today.strftime('%Y%m%d')}.csv"
+    updates = synthetic.tns_update(database, today, args.churn, args.churn//4, args.seed)
+    synthetic.write_csv(f"../xOUTPUTS/{ufile}", date, synthetic.TNS_HEADERS, updates)
+    record("UPdate", updates.shape[0], lambda: SnP_funcs.UPdate(ufile, today, database.copy()), 1)
+
+    sliceDB = record("TNSlice", args.rows, lambda: SnP_funcs.TNSlice(database, date))
+
+    ## visibility of a sample of targets ##
+    nvis = min(args.vis, database.shape[0])
+    record("Visibility", nvis, lambda: SnP_funcs.Visibility(database.T[3][:nvis], database.T[4][:nvis], LAT, LONG, ELV), 1)
+
+    ## priority scores ##
+    table = synthetic.priority_table(sliceDB if sliceDB.size != 0 else database[:1000], args.seed)
+    cut = record("cut_list", table.shape[0], lambda: SnP_funcs.cut_list(table, 0.5))
+
+    catpath = os.path.abspath("glade_mock.fits")
+    synthetic.glade_catalogue(table.T[3].astype(float), table.T[4].astype(float), args.galaxies, seed=args.seed).write(catpath, overwrite=True)
+    xlist = record("xmatch_rm", cut.shape[0], lambda: SnP_funcs.xmatch_rm(cut, catalogue=catpath), 1)
+    record("pscore", xlist.shape[0], lambda: SnP_funcs.score_list(xlist, [2,3,8,10]))
+
+    ## outputs of LUCY and MR_KITE ##
+    plist = synthetic.priority_list(args.html, args.seed)
+    paths = []
+    for kind in ("S", "F"):
+        paths.append(f"../xOUTPUTS/TransientList_{kind}_{today.strftime('%Y%m%d')}.csv")
+        synthetic.write_csv(paths[-1], f"List calculated for {date} using TNS database from {date}", synthetic.PLIST_HEADERS, plist)
+    record("visplots", 20, lambda: SnP_plots.visplots(paths, dpi=args.dpi, fmt="png"), 1)
+    record("array2html", plist.shape[0], lambda: SnP_email.array2html(synthetic.PLIST_HEADERS, plist, "table.html"))
+
+    ## RITA ##
+    rng = np.random.default_rng(args.seed)
+    ra, dec = rng.uniform(0, 360, args.coords), np.degrees(np.arcsin(rng.uniform(-1, 1, args.coords)))
+    record("LTcoords", args.coords, lambda: SnP_funcs.LTcoords(ra, dec))
+
+    rtargets = [(f"SN2023{name}", str(700000 + k)) for k, name in enumerate(synthetic._letters(args.targets))]
+    Log = synthetic.lt_log(rtargets, "PL23A01", today.strftime('%Y%m%d'), args.log, seed=args.seed)
+    record("match_log", len(Log), lambda: SnP_funcs.match_log(Log, rtargets, 880, "PL23A01", today.strftime('%Y-%m-%d')))
+
+    obs = synthetic.observations(args.nights, seed=args.seed)
+    SnP_funcs.save_observations(obs, "../xOUTPUTS/observations.csv")
+    night = obs[len(obs)//2][0]
+    record("load_obs", len(obs), lambda: SnP_funcs.load_observations(night, "../xOUTPUTS/observations.csv"))
+
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compares the timings with a baseline and prints any stages that have got slower by more than the tolerance.
+    Outputs:
+        - regressions: list of the names of the stages that have got slower
+    """
+
+    regressions = []
+    print(f"\n{'stage':<12} {'baseline':>10} {'now':>10} {'ratio':>7}")
+    for name, res in results.items():
+        if name not in baseline["stages"]:
+            continue
+        base = baseline["stages"][name]
+        #compare time per item in case the sizes are different
+        ratio = res["per_item_us"] / max(base["per_item_us"], 1e-9)
+        flag = ""
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+            flag = "  <-- slower"
+        print(f"{name:<12} {base['seconds']:10.4f} {res['seconds']:10.4f} {ratio:7.2f}{flag}")
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the SALT&PEPPER pipeline on synthetic data.")
+    parser.add_argument("--rows", type=int, default=50000, help="number of transients in the TNS database (default 50000)")
+    parser.add_argument("--churn", type=int, default=200, help="number of transients modified in the daily update (default 200)")
+    parser.add_argument("--vis", type=int, default=100, help="number of targets to calculate the visibility of (default 100)")
+    parser.add_argument("--galaxies", type=int, default=200000, help="number of galaxies in the mock GLADE+ catalogue (default 200000)")
+    parser.add_argument("--html", type=int, default=5000, help="number of rows in the priority lists (default 5000)")
+    parser.add_argument("--coords", type=int, default=100000, help="number of coordinates converted by LTcoords (default 100000)")
+    parser.add_argument("--targets", type=int, default=50, help="number of requested targets in the LT log (default 50)")
+    parser.add_argument("--log", type=int, default=2000, help="number of other observations in the LT log (default 2000)")
+    parser.add_argument("--nights", type=int, default=1000, help="number of nights in observations.csv (default 1000)")
+    parser.add_argument("--dpi", type=int, default=150, help="resolution of the visibility plots (default 150)")
+    parser.add_argument("--repeats", type=int, default=3, help="number of times the quick stages are run, the fastest is kept (default 3)")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the synthetic data (default 0)")
+    parser.add_argument("--out", default="bench.json", help="path to save the results to (default bench.json)")
+    parser.add_argument("--baseline", default=None, help="results to compare with (default none)")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="fractional slow down counted as a regression (default 0.2)")
+    parser.add_argument("--save-baseline", default=None, help="also save the results as a new baseline to this path")
+    args = parser.parse_args(argv)
+
+    start = os.getcwd()
+    out = os.path.abspath(args.out)
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+
+    #mock HyperLEDA
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _LedaHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    SnP_funcs.HYPERLEDA_URL = f"http://127.0.0.1:{server.server_port}/ledacat.cgi"
+
+    #work in a temporary copy of the directory layout (module directory next to xOUTPUTS)
+    with tempfile.TemporaryDirectory() as tmp:
+        os.makedirs(os.path.join(tmp, "run"))
+        os.makedirs(os.path.join(tmp, "xOUTPUTS"))
+        for name in ("de421.bsp", "finals2000A.all"):
+            for src in (os.path.join(start, name), os.path.join(ROOT, "LUCY", name)):
+                if os.path.isfile(src):
+                    shutil.copy(src, os.path.join(tmp, "run", name))
+                    break
+        os.chdir(os.path.join(tmp, "run"))
+        try:
+            stages = run(args)
+        finally:
+            os.chdir(start)
+            server.shutdown()
+
+    results = {
+        "created": dt.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+        "python": platform.python_version(),
+        "machine": platform.platform(),
+        "params": {k: v for k, v in vars(args).items() if k not in ("out", "baseline", "save_baseline")},
+        "stages": stages,
+    }
+    with open(out, "w") as fp:
+        json.dump(results, fp, indent=4)
+    print(f"\nresults saved to {out}")
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as fp:
+            json.dump(results, fp, indent=4)
+
+    if baseline is not None:
+        with open(baseline) as fp:
+            regressions = compare(stages, json.load(fp), args.tolerance)
+        if len(regressions) != 0:
+            print(f"\n{len(regressions)} stages slower than the baseline: {', '.join(regressions)}")
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,68 @@
+"""
+Benchmark of how long array2html takes to write the HTML table of a 5000 row priority list
+(and how long pandas' to_html took for the same table, if pandas is installed).
+
+Author: George Hume
+2023
+"""
+
+## IMPORTS ##
+import numpy as np
+import time
+import tempfile
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from SnP_email import array2html
+
+rows = 5000 #number of rows in the synthetic list
+repeats = 5 #number of times each renderer is timed (the fastest is kept)
+
+#synthetic priority list with the same columns as the PEPPER lists
+headers = ["objid","name_prefix","name","ra","declination","redshift","typeid","type","discoverymag","pscore","mag_rate",
+           "lunar_sep","obs_time","host_name","discoverydate","lastmodified","fink_url"]
+rng = np.random.default_rng(42)
+plist = np.empty((rows, len(headers)), dtype=object)
+plist[:,0] = np.arange(rows).astype(str)
+plist[:,1] = "SN"
+plist[:,2] = np.char.add("2023", np.arange(rows).astype(str))
+plist[:,3:7] = np.round(rng.uniform(0, 360, (rows, 4)), 5).astype(str)
+plist[:,7] = "SN Ia"
+plist[:,8:13] = np.round(rng.uniform(0, 20, (rows, 5)), 5).astype(str)
+plist[:,13] = '<a href=https://ned.ipac.caltech.edu/byname?objname=NGC+1234><div>NGC+1234</div></a>'
+plist[:,14:16] = "2023-06-01 00:00:00"
+plist[:,16] = np.where(rng.uniform(0, 1, rows) < 0.5, np.char.add("https://fink-portal.org/ZTF23aa", np.arange(rows).astype(str)), "None")
+
+
+def best(func):
+    """
+    Times a function a few times and returns the fastest time in seconds.
+    """
+    times = []
+    for r in range(repeats):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+with tempfile.TemporaryDirectory() as tmp:
+    path = os.path.join(tmp, "table.html")
+
+    t_new = best(lambda: array2html(headers, plist, path))
+    print(f"array2html: {t_new*1e3:.1f} ms for {rows} rows ({os.path.getsize(path)/1e6:.2f} MB)")
+
+    try:
+        import pandas as pd
+    except ImportError:
+        print("pandas not installed so can't compare with to_html")
+    else:
+        def pandas_table():
+            df = pd.DataFrame(plist, columns = headers)
+            df['name'] = '<a href=' + "https://www.wis-tns.org/object/" + df['name'] + '><div>' + df['name'] +'</div></a>'
+            html = df.to_html(escape=False, justify = "left",index = False, render_links=True)
+            with open(path, "w") as file:
+                file.write(html)
+
+        t_old = best(pandas_table)
+        print(f"pandas to_html: {t_old*1e3:.1f} ms ({t_old/t_new:.1f}x slower)")
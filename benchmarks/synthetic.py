@@ -0,0 +1,283 @@
+"""
+Generators of realistic synthetic inputs for benchmarking the SALT&PEPPER pipeline: TNS databases and
+daily update files, priority lists, LT night logs, observation CSVs and GLADE+-like galaxy catalogues.
+
+Author: George Hume
+2023
+"""
+
+## IMPORTS ##
+import csv
+import numpy as np
+import datetime as dt
+from astropy.table import Table
+
+#columns of the TNS public objects CSV
+TNS_HEADERS = ["objid","name_prefix","name","ra","declination","redshift","typeid","type","reporting_groupid",
+               "reporting_group","source_groupid","source_group","discoverydate","discoverymag","discmagfilter",
+               "filter","reporters","time_received","internal_names","creationdate","lastmodified"]
+
+#columns of the PEPPER priority lists (see LUCY/pscores.py)
+PLIST_HEADERS = ["objid","name_prefix","name","ra","declination","discoverydate","lastmodified","discoverymag",
+                 "observable_time","lunar_sep","galactic_latitude","possible_host","priority_score","fink_url"]
+
+OBS_HEADERS = ["night_start","prop_id","group_id","name_prefix","name","observed","fname_root"]
+
+
+def _letters(n, offset=0):
+    """
+    Makes the letter part of TNS names (a, b, ..., z, aa, ab, ...) for n objects.
+    """
+    out = []
+    for k in range(offset + 1, offset + n + 1):
+        name = ""
+        while k > 0:
+            k, r = divmod(k - 1, 26)
+            name = chr(97 + r) + name
+        out.append(name)
+    return np.array(out, dtype=str)
+
+
+def _times(date, rng, n, max_days, recent=0.0, recent_days=0):
+    """
+    Random times before a date as strings (YYYY-MM-DD HH:MM:SS.fff). A fraction of them (recent) are
+    within recent_days of the date, the rest are spread over max_days.
+    """
+    days = rng.uniform(0, max_days, n)
+    soon = rng.random(n) < recent
+    days[soon] = rng.uniform(0, recent_days, soon.sum())
+    t = np.datetime64(date.strftime('%Y-%m-%dT%H:%M:%S'), "ms") - (days*86400e3).astype("timedelta64[ms]")
+    return np.char.replace(np.datetime_as_string(t, unit="ms").astype(str), "T", " ")
+
+
+def tns_database(rows, date, seed=0, recent=0.05):
+    """
+    Makes a synthetic TNS database.
+    Arguments:
+        - rows: number of transients
+        - date: the date the database was released as a datetime object
+        - seed: seed of the random number generator (default is 0)
+        - recent: fraction of the transients discovered and modified recently enough to be in the priority lists (default is 0.05)
+    Outputs:
+        - database: numpy object array with one row per transient and the columns in TNS_HEADERS
+    """
+
+    rng = np.random.default_rng(seed)
+    db = np.empty((rows, len(TNS_HEADERS)), dtype=object)
+
+    disc = _times(date, rng, rows, 730, recent, 6)
+    #modified between discovery and the release date (mostly soon after discovery)
+    tdisc = np.array(disc, dtype="datetime64[ms]")
+    mod = tdisc + (rng.uniform(0, 1, rows)**3 * (np.datetime64(date, "ms") - tdisc).astype(float)).astype("timedelta64[ms]")
+
+    db[:,0] = np.arange(100000, 100000 + rows).astype(str)
+    db[:,1] = rng.choice(["AT","SN"], rows, p=[0.8,0.2])
+    db[:,2] = np.char.add(np.array(disc, dtype="datetime64[Y]").astype(str), _letters(rows))
+    db[:,3] = np.round(rng.uniform(0, 360, rows), 8).astype(str)
+    db[:,4] = np.round(np.degrees(np.arcsin(rng.uniform(-1, 1, rows))), 8).astype(str)
+    db[:,5] = np.where(rng.random(rows) < 0.1, np.round(rng.uniform(0.001, 0.3, rows), 4).astype(str), "")
+    db[:,6] = rng.choice(["0","1","3","4"], rows)
+    db[:,7] = rng.choice(["","SN Ia","SN II","SN Ic"], rows, p=[0.85,0.09,0.04,0.02])
+    db[:,8] = rng.choice(["48","74","18"], rows)
+    db[:,9] = rng.choice(["ZTF","ATLAS","GOTO"], rows)
+    db[:,10], db[:,11] = db[:,8], db[:,9]
+    db[:,12] = disc
+    db[:,13] = np.round(rng.uniform(13, 22, rows), 2).astype(str)
+    db[:,14] = rng.choice(["r","g","o","c"], rows)
+    db[:,15] = db[:,14]
+    db[:,16] = "A. Reporter, B. Reporter"
+    db[:,17] = disc
+    db[:,18] = np.char.add("ZTF", db[:,2].astype(str))
+    db[:,19] = disc
+    db[:,20] = np.char.replace(np.datetime_as_string(mod, unit="s").astype(str), "T", " ")
+
+    return db
+
+
+def tns_update(database, date, churn=200, new=50, seed=1):
+    """
+    Makes a synthetic TNS daily update file for a database: some existing transients are modified and some new ones are added.
+    Arguments:
+        - database: the TNS database (output of tns_database)
+        - date: the date the update was released as a datetime object
+        - churn: number of existing transients that are modified (default is 200)
+        - new: number of new transients (default is 50)
+        - seed: seed of the random number generator (default is 1)
+    Outputs:
+        - updates: numpy object array of the rows of the update file
+    """
+
+    rng = np.random.default_rng(seed)
+    changed = database[rng.choice(database.shape[0], min(churn, database.shape[0]), replace=False)].copy()
+    changed[:,13] = np.round(rng.uniform(13, 22, changed.shape[0]), 2).astype(str)
+    changed[:,20] = date.strftime('%Y-%m-%d %H:%M:%S')
+
+    fresh = tns_database(new, date, seed + 1000, recent=1.0)
+    fresh[:,0] = np.arange(database.shape[0] + 100000, database.shape[0] + 100000 + new).astype(str)
+    fresh[:,2] = np.char.add(str(date.year), _letters(new, database.shape[0]))
+
+    return np.vstack([fresh, changed])
+
+
+def write_csv(path, topline, headers, rows):
+    """
+    Saves rows as a CSV with a description (e.g., the date of a TNS database) on the first row and the headers on the second,
+    which is the format loadDB reads.
+    """
+    with open(path, "w") as file:
+        csvwriter = csv.writer(file, delimiter=",")
+        csvwriter.writerow([topline])
+        csvwriter.writerow(headers)
+        csvwriter.writerows(rows)
+
+
+def priority_table(database, seed=2):
+    """
+    Makes the columns used in the priority score calculation (the same as in priority_list, before thresholding) from a TNS database.
+    Arguments:
+        - database: the TNS database (output of tns_database)
+        - seed: seed of the random number generator (default is 2)
+    Outputs:
+        - table: numpy object array with the columns objid, name_prefix, name, ra, declination, discoverydate,
+            lastmodified, discoverymag, observable_time, lunar_sep, galactic_latitude and internal_names
+    """
+
+    rng = np.random.default_rng(seed)
+    rows = database.shape[0]
+    t_obs = np.round(rng.uniform(0, 9, rows), 5)
+    l_sep = np.round(rng.uniform(5, 175, rows), 5)
+    glat = np.round(rng.uniform(-90, 90, rows), 5)
+
+    return np.array([database.T[0], database.T[1], database.T[2], database.T[3], database.T[4], database.T[12],
+                     database.T[-1], database.T[13], t_obs, l_sep, glat, database.T[-3]], dtype=object).T
+
+
+def priority_list(rows, seed=3):
+    """
+    Makes a synthetic PEPPER priority list (as saved by LUCY/pscores.py), ordered by priority score.
+    Arguments:
+        - rows: number of targets
+        - seed: seed of the random number generator (default is 3)
+    Outputs:
+        - plist: numpy object array with the columns in PLIST_HEADERS
+    """
+
+    rng = np.random.default_rng(seed)
+    date = dt.datetime(2023, 6, 1)
+    db = tns_database(rows, date, seed, recent=1.0)
+    plist = np.empty((rows, len(PLIST_HEADERS)), dtype=object)
+    plist[:,0:5] = db[:,0:5]
+    plist[:,4] = np.round(rng.uniform(-25, 75, rows), 8).astype(str) #visible from La Palma
+    plist[:,5], plist[:,6], plist[:,7] = db[:,12], db[:,20], db[:,13]
+    plist[:,8] = np.round(rng.uniform(0.25, 9, rows), 5).astype(str)
+    plist[:,9] = np.round(rng.uniform(10, 175, rows), 5).astype(str)
+    plist[:,10] = np.round(rng.uniform(-90, 90, rows), 5).astype(str)
+    plist[:,11] = rng.choice(["None","NGC 1234","GLADE+ 123456","LEDA 98765"], rows)
+    plist[:,12] = np.sort(np.round(rng.uniform(0, 5, rows), 5)).astype(str)
+    plist[:,13] = np.char.add("https://fink-portal.org/", db[:,18].astype(str))
+    return plist
+
+
+def glade_catalogue(ra, dec, field=20000, hosted=0.5, seed=4):
+    """
+    Makes a synthetic GLADE+-like galaxy catalogue (with the same columns xmatch_rm uses from VizieR) with galaxies close to
+    some of the transients and the rest spread over the sky.
+    Arguments:
+        - ra: array of right ascensions of the transients (in decimal degrees)
+        - dec: array of declinations of the transients (in decimal degrees)
+        - field: number of galaxies spread over the sky (default is 20000)
+        - hosted: fraction of the transients with a galaxy within 1 arcmin (default is 0.5)
+        - seed: seed of the random number generator (default is 4)
+    Outputs:
+        - cat: astropy Table of the galaxies
+    """
+
+    rng = np.random.default_rng(seed)
+    near = rng.random(np.size(ra)) < hosted
+    nnear = near.sum()
+    #galaxies within 1 arcmin of the hosted transients
+    off = rng.uniform(0, 1/60, nnear)
+    ang = rng.uniform(0, 2*np.pi, nnear)
+    gdec = np.clip(np.asarray(dec,dtype=float)[near] + off*np.sin(ang), -90, 90)
+    gra = (np.asarray(ra,dtype=float)[near] + off*np.cos(ang)/np.maximum(np.cos(np.radians(gdec)), 1e-3)) % 360
+
+    gra = np.concatenate([gra, rng.uniform(0, 360, field)])
+    gdec = np.concatenate([gdec, np.degrees(np.arcsin(rng.uniform(-1, 1, field)))])
+    n = gra.size
+
+    def names(prefix, frac):
+        return np.where(rng.random(n) < frac, np.char.add(prefix, rng.integers(1, 999999, n).astype(str)), "-")
+
+    return Table({
+        "recno": np.arange(1, n+1),
+        "GLADE_": np.arange(1, n+1).astype(str),
+        "PGC": names("", 0.4),
+        "GWGC": names("NGC", 0.05),
+        "HyperLEDA": names("", 0.3),
+        "_2MASS": names("J", 0.3),
+        "WISExSCOS": names("J", 0.3),
+        "RAJ2000": gra,
+        "DEJ2000": gdec,
+        "Bmag": np.round(rng.uniform(12, 22, n), 3),
+    })
+
+
+def lt_log(rtargets, propID, date, other=500, frames=4, exptime=220.0, observed=0.7, seed=5):
+    """
+    Makes a synthetic LT night log with the requested targets (some of them observed) among other observations.
+    Arguments:
+        - rtargets: list of tuples of the names of the requested targets and the UIDs of their requests
+        - propID: the LT proposal ID used for the requests
+        - date: the date of the start of the night as a string in the format YYYYMMDD
+        - other: number of observations of other proposals (default is 500)
+        - frames: number of frames taken of each observed target (default is 4)
+        - exptime: exposure time of each frame in seconds (default is 220)
+        - observed: fraction of the requested targets that were observed (default is 0.7)
+        - seed: seed of the random number generator (default is 5)
+    Outputs:
+        - Log: list of the lines of the log
+    """
+
+    rng = np.random.default_rng(seed)
+    Log = ["# LT night log\n", f"# night {date}\n", "#\n",
+           "# time date proposal object ra dec filter airmass seeing sky exptime binning mode fname groupuid\n"]
+
+    def line(prop, obj, fname, uid):
+        t = f"{rng.integers(19,30)%24:02d}:{rng.integers(0,60):02d}:{rng.integers(0,60):02d}"
+        return (f"{t} {date} {prop} {obj} 12:00:00.0 +30:00:00.0 MOP-R {rng.uniform(1,2):.2f} {rng.uniform(0.8,2):.2f} "
+                f"dark {exptime:.1f} 2x2 polar {fname} {uid}\n")
+
+    run = 1
+    for name, uid in rtargets:
+        if rng.random() < observed:
+            for k in range(frames):
+                Log.append(line(propID, name, f"{3+k%2}_e_{date}_{run}_1_{k}_1.fits", uid))
+            run += 1
+
+    for k in range(other):
+        Log.append(line("PL00X00", f"OTHER{k}", f"h_e_{date}_{run+k}_1_1_1.fits", f"{900000+k}"))
+
+    return Log
+
+
+def observations(nights, per_night=10, seed=6):
+    """
+    Makes synthetic rows of observations.csv for a number of nights.
+    Arguments:
+        - nights: number of nights
+        - per_night: number of requested targets each night (default is 10)
+        - seed: seed of the random number generator (default is 6)
+    Outputs:
+        - rows: list of the rows with the columns in OBS_HEADERS
+    """
+
+    rng = np.random.default_rng(seed)
+    start = dt.date(2023, 1, 1)
+    rows = []
+    for n in range(nights):
+        night = start + dt.timedelta(days=n)
+        for k in range(per_night):
+            observed = bool(rng.random() < 0.7)
+            root = f"e_{night.strftime('%Y%m%d')}_{k+1}" if observed else "n/a"
+            rows.append([night.strftime('%Y-%m-%d'), "PL23A01", str(800000 + n*per_night + k), "SN", f"2023{_letters(1, n*per_night + k)[0]}", observed, root])
+    return rows
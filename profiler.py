@@ -0,0 +1,15 @@
+"""
+Runs one of the modules' scripts under a profiler (set by SNP_PROFILE, see profile_script in SnP_profiling.py)
+and saves the profile to zARCHIVE/{date}/profiles. Used by SnP when it is run with --profile, e.g.:
+    python ../profiler.py pscores.py
+
+Author: George Hume
+2023
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from SnP_profiling import profile_script
+
+profile_script(sys.argv[1], sys.argv[2:])
@@ -0,0 +1,42 @@
+"""
+Remakes the outputs of the pipeline for past nights, e.g., to backfill nights it didn't run or to see how a change
+to the priority scores would have changed a season. The TNS database of each night is rebuilt from the current one
+and the daily updates in zARCHIVE, and the outputs are saved in {out}/{YYYYMMDD}/xOUTPUTS. No emails are sent and
+no requests are made to the LT. E.g.:
+    python replay.py 2023-05-01 2023-05-31 --workers 4
+
+Author: George Hume
+2023
+"""
+
+## IMPORTS ##
+import argparse
+import datetime as dt
+import json
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from SnP_replay import replay
+
+parser = argparse.ArgumentParser(description="Remake the outputs of SALT&PEPPER for past nights.")
+parser.add_argument("start", help="first night to replay (YYYY-MM-DD)")
+parser.add_argument("end", nargs="?", default=None, help="last night to replay (YYYY-MM-DD, default is the first night)")
+parser.add_argument("--out", default="replay", help="directory to save the outputs of each night in (default replay)")
+parser.add_argument("--workers", type=int, default=4, help="number of nights replayed at once (default 4)")
+parser.add_argument("--archive", default=None, help="archive holding the daily TNS updates (default zARCHIVE)")
+parser.add_argument("--window", type=int, default=14, help="days of TNS updates used to rebuild the database (default 14)")
+args = parser.parse_args()
+
+start = dt.datetime.strptime(args.start, '%Y-%m-%d')
+end = start if args.end is None else dt.datetime.strptime(args.end, '%Y-%m-%d')
+
+summaries = replay(start, end, args.out, args.workers, archive=args.archive, window=args.window)
+
+#save the summary of all the nights
+path = os.path.join(args.out, f"replay_{start.strftime('%Y%m%d')}_{end.strftime('%Y%m%d')}.json")
+with open(path, "w") as fp:
+    json.dump(summaries, fp, indent=4)
+print(f"summary saved to {path}")
+
+failed = [day for day, summary in summaries.items() if "error" in summary]
+sys.exit(1 if len(failed) != 0 else 0)
@@ -0,0 +1,23 @@
+"""
+Shared set up of the tests - the pipeline's modules and the benchmarks' synthetic data are imported from the
+base SALT&PEPPER directory, and each test runs in its own temporary directory with the metrics turned off.
+
+Author: George Hume
+2023
+"""
+
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+import SnP_metrics
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(SnP_metrics, "METRICS", "") #don't save the metrics of the stages
+    return tmp_path
@@ -0,0 +1,46 @@
+"""
+array2html must write the same HTML table as the original pandas to_html version.
+"""
+
+import pytest
+import numpy as np
+from SnP_email import array2html
+from benchmarks import synthetic
+
+pd = pytest.importorskip("pandas")
+
+
+def pandas_html(headers, database, path):
+    #the original array2html
+    df = pd.DataFrame(database, columns = headers)
+    df['name'] = '<a href=' + "https://www.wis-tns.org/object/" + df['name'] + '><div>' + df['name'] +'</div></a>'
+    html = df.to_html(escape=False, justify = "left",index = False, render_links=True)
+    with open(path, "w") as file:
+        file.write(html)
+
+
+def both(headers, plist):
+    array2html(headers, plist, "new.html")
+    pandas_html(headers, plist, "old.html")
+    with open("new.html") as new, open("old.html") as old:
+        return new.read(), old.read()
+
+
+def test_priority_list():
+    new, old = both(synthetic.PLIST_HEADERS, synthetic.priority_list(2000))
+    assert new == old
+
+
+def test_links_and_whitespace():
+    #cells are stripped and only urls with known schemes become links
+    plist = synthetic.priority_list(10)
+    cells = [" https://fink-portal.org/ZTF23 ", "mailto:someone@example.com", "ftp://host/file", "git+ssh://host/repo",
+             "2023-06-01 00:00:00", "a:b", "  padded  ", "", "<b>bold</b>", "HTTPS://FINK-PORTAL.ORG/X"]
+    plist[:,13] = np.array(cells, dtype=object)
+    new, old = both(synthetic.PLIST_HEADERS, plist)
+    assert new == old
+
+
+def test_empty_list():
+    new, old = both(synthetic.PLIST_HEADERS, np.empty((0, len(synthetic.PLIST_HEADERS)), dtype=object))
+    assert new == old
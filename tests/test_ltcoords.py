@@ -0,0 +1,53 @@
+"""
+LTcoords must give the same strings as the original conversion, which went through astropy's hmsdms strings.
+"""
+
+import numpy as np
+from astropy.coordinates import SkyCoord
+from SnP_funcs import LTcoords
+
+
+def astropy_coords(RA, DEC):
+    #the original conversion - astropy's hmsdms strings with the unit letters swapped for colons
+    Ra, Dec = [], []
+    for cstr in SkyCoord(RA, DEC, unit="deg").to_string("hmsdms"):
+        splt = cstr.index(" ")
+        ra = list(cstr[0:splt-1])
+        dec = list(cstr[splt+1:-1])
+        ra[2], ra[5] = ":", ":"
+        dec[3], dec[6] = ":", ":"
+        Ra.append("".join(ra))
+        Dec.append("".join(dec))
+    return Ra, Dec
+
+
+def test_random_positions():
+    rng = np.random.default_rng(0)
+    RA = rng.uniform(0, 360, 20000)
+    DEC = np.degrees(np.arcsin(rng.uniform(-1, 1, 20000)))
+    assert LTcoords(RA, DEC) == astropy_coords(RA, DEC)
+
+
+def test_tns_precision():
+    #the TNS gives positions to 8 decimal places
+    rng = np.random.default_rng(1)
+    RA = np.round(rng.uniform(0, 360, 20000), 8)
+    DEC = np.round(rng.uniform(-90, 90, 20000), 8)
+    assert LTcoords(RA, DEC) == astropy_coords(RA, DEC)
+
+
+def test_edge_cases():
+    #zero, the ends of the ranges, small negative declinations (the sign must be kept) and
+    #values whose seconds round up to 60 (carried over into the minutes and hours/degrees)
+    sec = 1/3600
+    RA = np.array([0.0, 360.0, 359.99999999999, 15.0, 15*(1 - 1e-12), 15*(1 - 0.4e-8*sec), 15*59.999999999*sec/60,
+                   180.0, 0.5, 1e-9, 14.999999999999998, 90.0, 270.0, 45.0])
+    DEC = np.array([0.0, 90.0, -90.0, -0.5, -1e-9, -0.999999999999, 1 - 1e-12, -(59.9999999999*sec),
+                    30.0, -30.0, 89.99999999999, -89.99999999999, 0.0016666666666, -0.0016666666666])
+    assert LTcoords(RA, DEC) == astropy_coords(RA, DEC)
+
+
+def test_single_target():
+    ra, dec = LTcoords(np.array([150.0]), np.array([-2.5]))
+    assert (ra, dec) == (["10:00:00"], ["-02:30:00"])
+    assert (ra, dec) == astropy_coords(np.array([150.0]), np.array([-2.5]))
@@ -0,0 +1,80 @@
+"""
+match_log must find the same observations as the original check in RITA/obs_check.py, which scanned the whole LT log for every target.
+"""
+
+import numpy as np
+from SnP_funcs import match_log
+from benchmarks import synthetic
+
+DATE = "2023-06-01"
+PROPID = "PL23A01"
+
+
+def scan_log(Log, rtargets, r_texp, propID, date):
+    #the original check
+    observations = [] #blank list which will contain the contents for the csv
+    slog = [] #empty list to contain all log rows that contain our targets
+    completed = [] #targets observed for the full time requested (were added to the blacklist)
+
+    for target in rtargets:
+        trows = []
+        for row in Log:
+            if (target[0] in row) and (target[1] in row):
+                trows.append(row.split())
+                slog.append(row)
+        trows = np.array(trows)
+
+        if trows.size == 0:
+            observed = False
+            fname_root = "n/a"
+            propid = propID
+            groupid = target[1]
+
+        else:
+            observed = True
+            total_exp = sum(trows.T[10].astype(float))
+            pc = total_exp/r_texp
+            if pc >= 1:
+                completed.append(target[0])
+            propid = trows.T[2][0]
+            groupid = trows.T[14][0]
+            split_fname = trows.T[13][0].split("_")
+            fname_root = f"{split_fname[1]}_{split_fname[2]}_{split_fname[3]}"
+
+        observations.append([date, propid, groupid, target[0][0:2], target[0][2:], observed, fname_root])
+
+    return observations, slog, completed
+
+
+def targets(n):
+    return [(f"SN2023{name}", str(700000 + k)) for k, name in enumerate(synthetic._letters(n))]
+
+
+def test_full_time():
+    rtargets = targets(200)
+    Log = synthetic.lt_log(rtargets, PROPID, "20230601", other=2000)
+    new = match_log(Log, rtargets, 880, PROPID, DATE)
+    assert new == scan_log(Log, rtargets, 880, PROPID, DATE)
+    assert len(new[2]) != 0 #some targets were completed
+
+
+def test_partial_time():
+    #none of the targets got all the time requested, so none are completed
+    rtargets = targets(50)
+    Log = synthetic.lt_log(rtargets, PROPID, "20230601", frames=3, seed=7)
+    new = match_log(Log, rtargets, 880, PROPID, DATE)
+    assert new == scan_log(Log, rtargets, 880, PROPID, DATE)
+    assert new[2] == []
+
+
+def test_nothing_observed():
+    rtargets = targets(20)
+    Log = synthetic.lt_log(rtargets, PROPID, "20230601", observed=0.0)
+    new = match_log(Log, rtargets, 880, PROPID, DATE)
+    assert new == scan_log(Log, rtargets, 880, PROPID, DATE)
+    assert new[1] == [] and not any(row[5] for row in new[0])
+
+
+def test_empty_log():
+    rtargets = targets(5)
+    assert match_log([], rtargets, 880, PROPID, DATE) == scan_log([], rtargets, 880, PROPID, DATE)
@@ -0,0 +1,166 @@
+"""
+xmatch_rm must keep the same transients and pick the same hosts as the original version, which cross-matched one
+transient at a time. The original's VizieR queries are replaced by a search of the same local catalogue, and HyperLEDA
+by the benchmarks' local stand-in.
+"""
+
+import http.server
+import threading
+import pytest
+import numpy as np
+import datetime as dt
+import requests
+from astropy import units as u
+from astropy.coordinates import SkyCoord
+from astropy.table import vstack
+import SnP_funcs
+from benchmarks import synthetic
+from benchmarks.bench import _LedaHandler
+
+
+@pytest.fixture(scope="module")
+def leda():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _LedaHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/ledacat.cgi"
+    server.shutdown()
+
+
+def cone_search(cat):
+    #stand-in for Vizier.query_region on a local catalogue (a list holding a table of the matches, or an empty list)
+    gals = SkyCoord(ra=np.array(cat["RAJ2000"])*u.deg, dec=np.array(cat["DEJ2000"])*u.deg)
+    def query_region(t, radius):
+        xmatch = cat[t.separation(gals) <= radius]
+        return [xmatch] if len(xmatch) != 0 else []
+    return query_region
+
+
+def original_xmatch_rm(tlist, query_region, leda_url):
+    #the original xmatch_rm, one query per transient
+    def host_name(xtable,host_idx):
+        namecols = xtable[0].colnames[1:]
+        for header in namecols:
+            entry = str(xtable[0][header][host_idx])
+            if (entry == "-") or (entry == "--"):
+                if header == "WISExSCOS":
+                    name = f"GLADE {str(xtable[0]['GLADE_'][host_idx])}"
+                else:
+                    continue
+            else:
+                if header == "PGC":
+                    name = f"{header} {entry}"
+                elif header == "GWGC":
+                    name = entry
+                elif header == "HyperLEDA":
+                    name = f"LEDA {entry}" if entry.isdigit() else entry
+                elif header == "_2MASS":
+                    name = f"2MASX {entry}"
+                else:
+                    name = f"GLADE {str(xtable[0]['GLADE_'][host_idx])}"
+                break
+        return name
+
+    def d25_from_HL(host_name, sep):
+        HLtxt = requests.get(f"{leda_url}?o={host_name}").text
+        if HLtxt.find(">logd25<") != -1:
+            logd25 = float(HLtxt[HLtxt.find(">logd25<"):HLtxt.find("</td><td>log(0.1 arcmin)")].split()[1])
+            appR = (10**(logd25-1) * u.arcmin)/2
+            hosted = not (sep > appR)
+            appR = appR.to(u.arcsec).value
+        else:
+            appR = None
+            hosted = None
+        return appR, hosted
+
+    def gal_info(xmatch,idx):
+        gal = SkyCoord(ra=xmatch[0]["RAJ2000"][idx]*u.deg,dec=xmatch[0]["DEJ2000"][idx]*u.deg)
+        separ = t.separation(gal).to(u.arcsec)
+        Bmag = xmatch[0]["Bmag"][idx]
+        name = host_name(xmatch,idx)
+        appR, hosted = d25_from_HL(name,separ)
+        return [name,Bmag,appR,separ.value,hosted]
+
+    tnames = tlist.T[1]+tlist.T[2]
+    tmags = tlist.T[7].astype(float)
+    transients = SkyCoord(ra=tlist.T[3].astype(float)*u.deg,dec=tlist.T[4].astype(float)*u.deg)
+
+    Xmatches = []
+    for idx, t in enumerate(transients):
+        xmatch = query_region(t, radius = 1*u.arcmin)
+        if len(xmatch) == 0:
+            Xmatches.append([tnames[idx],tmags[idx],None,None,None,None,None])
+            continue
+        if len(xmatch[0]) == 1:
+            galaxy = gal_info(xmatch,0)
+        else:
+            g_array = np.array([gal_info(xmatch,g) for g in range(len(xmatch[0]))],dtype=object)
+            host_gals = g_array[g_array.T[-1] == True]
+            if host_gals.shape[0] != 0:
+                galaxy = list(host_gals[host_gals.T[3].argmin()])
+            else:
+                ukwn_gals = g_array[g_array.T[-1] != False]
+                if ukwn_gals.shape[0] != 0:
+                    galaxy = list(ukwn_gals[ukwn_gals.T[3].argmin()])
+                else:
+                    galaxy = list(g_array[g_array.T[3].argmin()])
+        galaxy.insert(0,tnames[idx])
+        galaxy.insert(1,tmags[idx])
+        Xmatches.append(galaxy)
+    Xmatches = np.array(Xmatches,dtype=object)
+
+    mask = []
+    for entry in Xmatches:
+        if entry[2] == None:
+            mask.append(False)
+        elif entry[1] < entry[3]:
+            mask.append(True)
+        elif entry[4] == None:
+            mask.append(not (entry[-2] <= 2))
+        elif entry[4] == False:
+            mask.append(False)
+        else:
+            mask.append(not (entry[-2] <= (0.25*entry[4] + 2)))
+
+    th_list = tlist[mask]
+    hosts = np.array([entry[2] if entry[-1] != False else None for entry in Xmatches[mask]],dtype="str")
+    return np.concatenate((th_list,np.resize(hosts,(hosts.size,1))),axis=1)
+
+
+def cut_table(rows, seed):
+    today = dt.datetime(2023, 6, 1)
+    db = synthetic.tns_database(rows, today, seed)
+    table = synthetic.priority_table(SnP_funcs.TNSlice(db, today.strftime('%Y-%m-%d %H:%M:%S')), seed)
+    return table, SnP_funcs.cut_list(table, 0.5)
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_same_as_one_at_a_time(leda, monkeypatch, tmp_path, seed):
+    monkeypatch.setattr(SnP_funcs, "HYPERLEDA_URL", leda)
+    table, cut = cut_table(20000, seed)
+    #galaxies close to most of the transients (and a second one close to some of them) among the rest of the sky
+    ra, dec = table.T[3].astype(float), table.T[4].astype(float)
+    cat = synthetic.glade_catalogue(ra, dec, 20000, hosted=0.8, seed=seed)
+    more = synthetic.glade_catalogue(ra, dec, 0, hosted=0.4, seed=seed+10)
+    more["recno"] += len(cat)
+    more["GLADE_"] = (more["recno"]).astype(str)
+    cat = vstack([cat, more])
+    path = str(tmp_path / "glade.fits") #local catalogues are kept by their path
+    cat.write(path)
+
+    new = SnP_funcs.xmatch_rm(cut, catalogue=path)
+    old = original_xmatch_rm(cut, cone_search(cat), leda)
+    assert len(cut) != 0 and len(new) != 0
+    assert new.tolist() == old.tolist()
+
+
+def test_no_matches(leda, monkeypatch, tmp_path):
+    monkeypatch.setattr(SnP_funcs, "HYPERLEDA_URL", leda)
+    dummy, cut = cut_table(5000, 2)
+    #one galaxy far from every transient
+    cat = synthetic.glade_catalogue([0.0], [-89.999], 0, hosted=1.0, seed=2)
+    path = str(tmp_path / "glade.fits")
+    cat.write(path)
+
+    new = SnP_funcs.xmatch_rm(cut, catalogue=path)
+    assert new.shape == (0, cut.shape[1] + 1)
+    assert new.tolist() == original_xmatch_rm(cut, cone_search(cat), leda).tolist()